@@ -0,0 +1,153 @@
+# -*- coding: utf-8 -*-
+"""
+Documents de facture (HTML / PDF) avec cache adressé par contenu : le nom du
+fichier est l'empreinte SHA-256 de tout ce qui est affiché (facture, lignes,
+en-tête de l'hôtel, version du gabarit). Une facture inchangée n'est jamais
+rendue deux fois ; une facture modifiée change d'empreinte, donc de fichier.
+Les documents sont rangés par facture : un nouveau rendu supprime les anciens.
+
+Le PDF utilise xhtml2pdf s'il est installé ; sinon seul le HTML est disponible.
+"""
+import hashlib
+import json
+import zipfile
+from io import BytesIO
+
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.template.loader import render_to_string
+
+from settings.models import AppSettings
+
+# À incrémenter à chaque modification de templates/billing/invoice_document.html
+VERSION_GABARIT = 1
+DOSSIER_CACHE = 'factures'
+CHAMPS_HOTEL = ('hotel_name', 'address', 'contact_phone', 'contact_email', 'currency')
+
+try:
+    from xhtml2pdf import pisa
+except ImportError:
+    pisa = None
+
+
+def formats_disponibles():
+    return ['pdf', 'html'] if pisa is not None else ['html']
+
+
+def factures_a_rendre(queryset):
+    """Charge tout ce que le document affiche, sans requête par facture"""
+    return queryset.select_related('client', 'reservation__chambre').prefetch_related('lines')
+
+
+def empreinte(facture, parametres):
+    """SHA-256 du contenu affiché de la facture (les lignes doivent être préchargées pour les lots)"""
+    reservation = facture.reservation
+    contenu = {
+        'gabarit': VERSION_GABARIT,
+        'hotel': [str(getattr(parametres, champ, '') or '') for champ in CHAMPS_HOTEL],
+        'facture': [
+            facture.numero_facture, str(facture.date_emission), str(facture.date_echeance),
+            facture.client.nom, str(facture.sous_total), str(facture.remise), str(facture.taux_tva),
+            str(facture.montant_tva), str(facture.montant_total), str(facture.montant_paye), facture.statut,
+        ],
+        'sejour': [
+            reservation.chambre.numero, str(reservation.date_debut), str(reservation.date_fin),
+        ] if reservation else None,
+        'lignes': [
+            [ligne.description, str(ligne.quantite), str(ligne.prix_unitaire), str(ligne.montant_total)]
+            for ligne in sorted(facture.lines.all(), key=lambda ligne: ligne.pk)
+        ],
+    }
+    return hashlib.sha256(json.dumps(contenu, ensure_ascii=False).encode('utf-8')).hexdigest()
+
+
+def _rendre(facture, parametres, extension):
+    html = render_to_string('billing/invoice_document.html', {
+        'invoice': facture,
+        'lines': sorted(facture.lines.all(), key=lambda ligne: ligne.pk),
+        'app_settings': parametres,
+    })
+    if extension == 'html':
+        return html.encode('utf-8')
+
+    sortie = BytesIO()
+    resultat = pisa.CreatePDF(html, dest=sortie, encoding='utf-8')
+    if resultat.err:
+        raise ValueError(f"Échec du rendu PDF de la facture {facture.numero_facture}")
+    return sortie.getvalue()
+
+
+def document_facture(facture, extension='pdf', parametres=None):
+    """
+    Document de la facture : relu depuis le cache s'il existe, rendu et mis en cache sinon.
+    Retourne (empreinte, contenu en octets).
+    """
+    if extension not in formats_disponibles():
+        raise ValueError(f"Format indisponible : {extension}")
+    parametres = parametres or AppSettings.load()
+    cle = empreinte(facture, parametres)
+    dossier = f"{DOSSIER_CACHE}/{facture.pk}"
+    chemin = f"{dossier}/{cle}.{extension}"
+
+    if default_storage.exists(chemin):
+        with default_storage.open(chemin, 'rb') as fichier:
+            return cle, fichier.read()
+
+    contenu = _rendre(facture, parametres, extension)
+    enregistre = default_storage.save(chemin, ContentFile(contenu))
+    if enregistre != chemin:
+        # Même document rendu en parallèle par une autre requête : garder un seul exemplaire
+        default_storage.delete(enregistre)
+    _purger(dossier, f"{cle}.{extension}", extension)
+    return cle, contenu
+
+
+def _purger(dossier, garde, extension):
+    """Supprime les documents périmés de la facture (anciennes empreintes) dans ce format"""
+    try:
+        fichiers = default_storage.listdir(dossier)[1]
+    except FileNotFoundError:
+        return
+    for fichier in fichiers:
+        if fichier != garde and fichier.endswith(f".{extension}"):
+            default_storage.delete(f"{dossier}/{fichier}")
+
+
+def nom_fichier(facture, extension):
+    return f"{facture.numero_facture or facture.pk}.{extension}"
+
+
+class _Tampon:
+    """Flux en écriture seule pour zipfile : les octets écrits sont récupérés et vidés à chaque fichier"""
+
+    def __init__(self):
+        self.morceaux = []
+
+    def write(self, donnees):
+        self.morceaux.append(bytes(donnees))
+        return len(donnees)
+
+    def flush(self):
+        pass
+
+    def vider(self):
+        donnees = b''.join(self.morceaux)
+        self.morceaux = []
+        return donnees
+
+
+def zip_factures(queryset, extension='pdf', chunk_size=200):
+    """
+    Générateur des octets d'une archive ZIP des documents du queryset : les factures sont
+    lues par paquets de chunk_size (lignes préchargées) et chaque document est envoyé dès
+    qu'il est prêt, sans garder l'archive en mémoire.
+    """
+    parametres = AppSettings.load()
+    tampon = _Tampon()
+    # Flux non positionnable : zipfile écrit les tailles après chaque fichier
+    with zipfile.ZipFile(tampon, mode='w', compression=zipfile.ZIP_DEFLATED) as archive:
+        for facture in factures_a_rendre(queryset).iterator(chunk_size=chunk_size):
+            cle, contenu = document_facture(facture, extension, parametres)
+            archive.writestr(nom_fichier(facture, extension), contenu)
+            yield tampon.vider()
+    yield tampon.vider()
@@ -0,0 +1,257 @@
+# -*- coding: utf-8 -*-
+"""
+Opérations en lot sur les folios (factures de séjour) : ouverture des factures
+au check-in, facturation des nuitées et des commandes restaurant des résidents,
+sans passer par Invoice.save() / InvoiceLine.save() pour chaque ligne. Les totaux et soldes sont recalculés
+une fois par lot.
+"""
+import datetime
+from decimal import Decimal, ROUND_HALF_UP
+
+from django.db import transaction
+from django.db.models import Sum, OuterRef, Subquery
+from django.utils import timezone
+
+from reservations.models import Reservation
+from reservations.availability import nuits_entre
+from .models import Invoice, InvoiceLine
+from .numbering import allouer_numeros
+from .ledger import enregistrer_mouvements
+
+
+def recalculer_factures(facture_ids):
+    """
+    Recalcule en lot les totaux des factures à partir de la somme de leurs lignes
+    (une agrégation SQL) et reporte les écarts sur les soldes clients.
+    """
+    facture_ids = set(facture_ids)
+    if not facture_ids:
+        return
+    sommes = dict(
+        InvoiceLine.objects.filter(facture_id__in=facture_ids)
+        .values('facture_id').annotate(somme=Sum('montant_total'))
+        .values_list('facture_id', 'somme')
+    )
+    factures = list(Invoice.objects.select_for_update().filter(pk__in=facture_ids))
+    mouvements = []
+    maintenant = timezone.now()
+    for facture in factures:
+        ancien_total = facture.montant_total
+        facture.appliquer_sous_total(sommes.get(facture.pk) or Decimal('0'))
+        facture.updated_at = maintenant
+        mouvements.append((facture.client_id, facture.montant_total - ancien_total, 'facture', facture.pk))
+    Invoice.objects.bulk_update(
+        factures, ['sous_total', 'montant_tva', 'montant_total', 'statut', 'updated_at'], batch_size=500
+    )
+    enregistrer_mouvements(mouvements)
+
+
+def ouvrir_folios(reservations):
+    """
+    Crée en lot la facture de séjour des réservations qui n'en ont pas encore,
+    avec la première nuitée, et reporte les montants sur le solde des clients.
+    Les réservations doivent être chargées avec client et chambre__categorie.
+    Retourne le nombre de factures créées.
+    """
+    reservations = list(reservations)
+    existantes = set(
+        Invoice.objects.filter(reservation__in=reservations).values_list('reservation_id', flat=True)
+    )
+    a_facturer = [r for r in reservations if r.pk not in existantes]
+    if not a_facturer:
+        return 0
+
+    # Mêmes numéros que Invoice.save(), réservés en une fois pour tout le lot
+    numeros = allouer_numeros(len(a_facturer))
+
+    factures = []
+    for numero, reservation in zip(numeros, a_facturer):
+        facture = Invoice(
+            client=reservation.client,
+            reservation=reservation,
+            numero_facture=numero,
+        )
+        facture.appliquer_sous_total(reservation.chambre.categorie.prix)
+        factures.append(facture)
+    Invoice.objects.bulk_create(factures)
+
+    # Relire les clés par numéro (unique) : tous les SGBD ne les renvoient pas après un bulk_create
+    ids = dict(
+        Invoice.objects.filter(numero_facture__in=[f.numero_facture for f in factures]).values_list('numero_facture', 'id')
+    )
+    lignes = []
+    mouvements = []
+    for facture, reservation in zip(factures, a_facturer):
+        prix = reservation.chambre.categorie.prix
+        lignes.append(InvoiceLine(
+            facture_id=ids[facture.numero_facture],
+            description=f"Nuitée du {reservation.date_debut.strftime('%d/%m/%Y')} - Chambre {reservation.chambre.numero}",
+            quantite=1,
+            prix_unitaire=prix,
+            montant_total=prix,
+            reservation=reservation,
+            date_nuitee=reservation.date_debut,
+        ))
+        mouvements.append((reservation.client_id, facture.montant_total, 'facture', ids[facture.numero_facture]))
+    InvoiceLine.objects.bulk_create(lignes)
+    enregistrer_mouvements(mouvements)
+
+    return len(factures)
+
+
+def reservations_a_facturer(date_min, date_max, tranche=None):
+    """Réservations actives ayant au moins une nuit dans [date_min, date_max], limitées à une tranche d'identifiants (min, max)"""
+    reservations = Reservation.objects.filter(
+        statut='active', date_debut__lte=date_max, date_fin__gt=date_min
+    )
+    if tranche is not None:
+        reservations = reservations.filter(pk__range=tranche)
+    return reservations
+
+
+def nuitees_a_facturer(date_min, date_max, tranche=None):
+    """
+    Paires (réservation active, nuit) de la période [date_min, date_max] qui n'ont
+    pas encore de ligne de nuitée, en deux requêtes quelle que soit la période.
+    Retourne (nuitées à poster, réservations ignorées avec leur motif).
+    """
+    facture_ouverte = Invoice.objects.filter(
+        reservation=OuterRef('pk'), statut__in=['impaye', 'partiel']
+    ).order_by('-id').values('id')[:1]
+
+    reservations = reservations_a_facturer(date_min, date_max, tranche)
+    deja_facturees = set(
+        InvoiceLine.objects.filter(
+            reservation__in=reservations, date_nuitee__gte=date_min, date_nuitee__lte=date_max
+        ).values_list('reservation_id', 'date_nuitee')
+    )
+
+    nuitees = []
+    ignorees = []
+    for reservation in reservations.annotate(facture_id=Subquery(facture_ouverte)).values(
+        'id', 'facture_id', 'client_id', 'chambre__numero', 'chambre__categorie__prix', 'date_debut', 'date_fin'
+    ).order_by('id'):
+        debut = max(reservation['date_debut'], date_min)
+        fin = min(reservation['date_fin'], date_max + datetime.timedelta(days=1))
+        manquantes = [
+            nuit for nuit in nuits_entre(debut, fin)
+            if (reservation['id'], nuit) not in deja_facturees
+        ]
+        if not manquantes:
+            continue
+        if reservation['facture_id'] is None:
+            ignorees.append((reservation['id'], "Aucune facture impayée trouvée"))
+            continue
+        if reservation['chambre__categorie__prix'] is None:
+            ignorees.append((reservation['id'], "Chambre sans catégorie tarifaire"))
+            continue
+        for nuit in manquantes:
+            nuitees.append({
+                'reservation_id': reservation['id'],
+                'facture_id': reservation['facture_id'],
+                'client_id': reservation['client_id'],
+                'chambre': reservation['chambre__numero'],
+                'prix': reservation['chambre__categorie__prix'],
+                'nuit': nuit,
+            })
+    return nuitees, ignorees
+
+
+def poster_nuitees(nuitees, batch_size=500):
+    """
+    Insère les nuitées par lots de batch_size, chaque lot dans sa transaction :
+    insertion en lot puis recalcul agrégé des factures touchées et des soldes.
+    """
+    for i in range(0, len(nuitees), batch_size):
+        lot = nuitees[i:i + batch_size]
+        with transaction.atomic():
+            # La contrainte (réservation, nuit) écarte les nuitées postées entre-temps par un autre processus
+            InvoiceLine.objects.bulk_create([
+                InvoiceLine(
+                    facture_id=nuitee['facture_id'],
+                    description=f"Nuitée du {nuitee['nuit'].strftime('%d/%m/%Y')} - Chambre {nuitee['chambre']}",
+                    quantite=1,
+                    prix_unitaire=nuitee['prix'],
+                    montant_total=nuitee['prix'],
+                    reservation_id=nuitee['reservation_id'],
+                    date_nuitee=nuitee['nuit'],
+                )
+                for nuitee in lot
+            ], ignore_conflicts=True)
+            recalculer_factures(nuitee['facture_id'] for nuitee in lot)
+    return len(nuitees)
+
+
+def facturer_nuitees(date_min, date_max=None, batch_size=500, tranche=None):
+    """
+    Poste toutes les nuitées manquantes des réservations actives entre date_min et
+    date_max (inclus ; une seule nuit si date_max est omis), au tarif de la catégorie
+    de chambre, sur la facture ouverte de chaque réservation. tranche limite le
+    traitement à un intervalle d'identifiants de réservation (exécution parallèle).
+    Retourne (nombre de nuitées postées, réservations ignorées avec leur motif).
+    """
+    nuitees, ignorees = nuitees_a_facturer(date_min, date_max or date_min, tranche)
+    return poster_nuitees(nuitees, batch_size), ignorees
+
+
+def poster_commandes(order_ids):
+    """
+    Poste sur le folio les commandes restaurant livrées des résidents : réservation
+    active de la chambre et facture ouverte résolues en une requête pour tout le lot,
+    facture créée si la réservation n'en a pas, lignes insérées en lot puis totaux et
+    soldes recalculés une fois. À appeler dans la transaction qui passe les commandes
+    à 'livre'. Retourne (nombre de commandes postées, commandes ignorées avec leur motif).
+    """
+    from restaurant.models import Order, OrderItem
+
+    commandes = list(
+        Order.objects.filter(pk__in=order_ids, type_commande='resident', chambre__isnull=False)
+        .values_list('id', 'chambre_id')
+    )
+    if not commandes:
+        return 0, []
+
+    facture_ouverte = Invoice.objects.filter(
+        reservation=OuterRef('pk'), statut__in=['impaye', 'partiel']
+    ).order_by('-id').values('id')[:1]
+    sejours = {}
+    for reservation in Reservation.objects.filter(
+        chambre_id__in={chambre_id for _, chambre_id in commandes}, statut='active'
+    ).annotate(facture_id=Subquery(facture_ouverte)).values('id', 'chambre_id', 'client_id', 'facture_id').order_by('pk'):
+        # Première réservation active de la chambre, comme Order.get_client_name()
+        sejours.setdefault(reservation['chambre_id'], reservation)
+
+    ignorees = [(order_id, "Aucune réservation active pour la chambre") for order_id, chambre_id in commandes if chambre_id not in sejours]
+    a_poster = [(order_id, sejours[chambre_id]) for order_id, chambre_id in commandes if chambre_id in sejours]
+    if not a_poster:
+        return 0, ignorees
+
+    # Folio ouvert pour les séjours qui n'ont plus de facture impayée
+    sans_facture = {sejour['id']: sejour for _, sejour in a_poster if sejour['facture_id'] is None}
+    if sans_facture:
+        factures = [
+            Invoice(client_id=sejour['client_id'], reservation_id=sejour['id'], numero_facture=numero)
+            for numero, sejour in zip(allouer_numeros(len(sans_facture)), sans_facture.values())
+        ]
+        Invoice.objects.bulk_create(factures)
+        ids = dict(
+            Invoice.objects.filter(numero_facture__in=[f.numero_facture for f in factures]).values_list('reservation_id', 'id')
+        )
+        for sejour in sans_facture.values():
+            sejour['facture_id'] = ids[sejour['id']]
+
+    facture_par_commande = {order_id: sejour['facture_id'] for order_id, sejour in a_poster}
+    lignes = []
+    for item in OrderItem.objects.filter(commande_id__in=facture_par_commande).select_related('plat').order_by('commande_id', 'pk'):
+        lignes.append(InvoiceLine(
+            facture_id=facture_par_commande[item.commande_id],
+            menu_item_id=item.plat_id,
+            description=f"Restaurant: {item.plat.nom}",
+            quantite=item.quantite,
+            # Prix de la commande, pas le prix actuel de la carte
+            prix_unitaire=item.prix_unitaire,
+            montant_total=(item.prix_unitaire * item.quantite).quantize(Decimal('0.01'), rounding=ROUND_HALF_UP),
+        ))
+    InvoiceLine.objects.bulk_create(lignes, batch_size=500)
+    recalculer_factures(facture_par_commande.values())
+    return len(a_poster), ignorees
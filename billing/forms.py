@@ -0,0 +1,96 @@
+from django import forms
+from django.db import transaction
+from django.db.models import F, Q
+from django.forms import BaseInlineFormSet, inlineformset_factory
+from .models import Invoice, InvoiceLine
+from .folios import recalculer_factures
+
+
+class BaseInvoiceLineFormSet(BaseInlineFormSet):
+    """
+    Enregistre les lignes de facture en lot : insertions, modifications et suppressions
+    groupées, puis un seul recalcul des totaux et du solde client. Le nombre de requêtes
+    ne dépend pas du nombre de lignes.
+    """
+
+    def get_queryset(self):
+        # Service et article chargés avec les lignes : InvoiceLine.preparer() ne requête plus
+        return super().get_queryset().select_related('service', 'menu_item')
+
+    def save(self, commit=True):
+        if not commit:
+            return super().save(commit=False)
+
+        self.new_objects = []
+        self.changed_objects = []
+        self.deleted_objects = []
+
+        for form in self.initial_forms:
+            ligne = form.instance
+            if ligne.pk is None:
+                continue
+            if self.can_delete and self._should_delete_form(form):
+                self.deleted_objects.append(ligne)
+            elif form.has_changed():
+                ligne.preparer()
+                self.changed_objects.append((ligne, form.changed_data))
+
+        for form in self.extra_forms:
+            if not form.has_changed() or (self.can_delete and self._should_delete_form(form)):
+                continue
+            ligne = form.instance
+            ligne.facture = self.instance
+            ligne.preparer()
+            self.new_objects.append(ligne)
+
+        with transaction.atomic():
+            if self.deleted_objects:
+                InvoiceLine.objects.filter(pk__in=[ligne.pk for ligne in self.deleted_objects]).delete()
+            if self.changed_objects:
+                InvoiceLine.objects.bulk_update(
+                    [ligne for ligne, _ in self.changed_objects],
+                    ['service', 'description', 'quantite', 'prix_unitaire', 'montant_total'],
+                )
+            if self.new_objects:
+                InvoiceLine.objects.bulk_create(self.new_objects)
+
+            # Totaux de la facture et solde client mis à jour une seule fois
+            if self.new_objects or self.changed_objects or self.deleted_objects:
+                recalculer_factures([self.instance.pk])
+
+        return self.new_objects + [ligne for ligne, _ in self.changed_objects]
+
+
+InvoiceLineFormSet = inlineformset_factory(
+    Invoice, InvoiceLine,
+    formset=BaseInvoiceLineFormSet,
+    fields=('service', 'description', 'quantite', 'prix_unitaire'),
+    extra=1,
+    can_delete=True
+)
+
+
+class InvoiceFilterForm(forms.Form):
+    """Filtres de la liste et de l'export des factures (paramètres GET)"""
+    statut = forms.ChoiceField(label="Statut", required=False, choices=[('', 'Tous')] + Invoice.STATUT_CHOICES)
+    client = forms.CharField(label="Client", required=False, max_length=100)
+    date_debut = forms.DateField(label="Émises du", required=False, widget=forms.DateInput(attrs={'type': 'date'}))
+    date_fin = forms.DateField(label="au", required=False, widget=forms.DateInput(attrs={'type': 'date'}))
+    impayees = forms.BooleanField(label="Reste dû uniquement", required=False)
+
+    def filtrer(self, queryset):
+        """Applique les filtres valides au queryset (à appeler après is_valid())"""
+        donnees = self.cleaned_data
+        if donnees.get('statut'):
+            queryset = queryset.filter(statut=donnees['statut'])
+        if donnees.get('client'):
+            client = donnees['client'].strip()
+            # Identifiant exact ou partie du nom
+            queryset = queryset.filter(Q(client_id=int(client)) if client.isdigit() else Q(client__nom__icontains=client))
+        if donnees.get('date_debut'):
+            queryset = queryset.filter(date_emission__gte=donnees['date_debut'])
+        if donnees.get('date_fin'):
+            queryset = queryset.filter(date_emission__lte=donnees['date_fin'])
+        if donnees.get('impayees'):
+            queryset = queryset.filter(montant_total__gt=F('montant_paye'))
+        return queryset
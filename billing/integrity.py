@@ -0,0 +1,109 @@
+# -*- coding: utf-8 -*-
+"""
+Contrôle et reconstruction des montants dérivés de la facturation : totaux et
+statut de chaque facture (somme des lignes), montant payé (somme des paiements)
+et solde de chaque client (reste dû de ses factures). Les factures et les clients
+sont parcourus par tranches de clés ; chaque tranche coûte quelques requêtes
+agrégées, quel que soit le nombre de lignes.
+"""
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import Sum, F
+
+from clients.models import Client
+from .models import Invoice, InvoiceLine, Payment, MouvementSolde
+
+CHAMPS_FACTURE = ['sous_total', 'montant_tva', 'montant_total', 'montant_paye', 'statut']
+CENTIME = Decimal('0.01')
+
+
+def _tranches(queryset, champs, batch_size, verrouiller):
+    """Parcourt le queryset par clé croissante, batch_size objets à la fois (pagination par clé)"""
+    dernier = 0
+    while True:
+        with transaction.atomic():
+            tranche = queryset.filter(pk__gt=dernier).order_by('pk').only(*champs)
+            if verrouiller:
+                tranche = tranche.select_for_update()
+            objets = list(tranche[:batch_size])
+            if not objets:
+                return
+            yield objets
+        dernier = objets[-1].pk
+
+
+def _sommes(queryset, cle, expression, premier, dernier):
+    return {
+        pk: total for pk, total in queryset.filter(**{f'{cle}__gte': premier, f'{cle}__lte': dernier})
+        .values(cle).annotate(total=expression).values_list(cle, 'total')
+    }
+
+
+def verifier_factures(corriger=False, batch_size=2000):
+    """
+    Recalcule les montants de chaque facture et les compare aux valeurs enregistrées.
+    En mode correction, les factures en écart sont mises à jour dans la transaction de
+    leur tranche, sans mouvement de solde : un total erroné n'a pas forcément atteint
+    le solde du client, verifier_soldes aligne ensuite solde et journal en une fois.
+    Retourne (nombre de factures contrôlées, liste des écarts).
+    """
+    controlees = 0
+    ecarts = []
+    champs = ['client_id', 'remise', 'taux_tva'] + CHAMPS_FACTURE
+    for factures in _tranches(Invoice.objects.all(), champs, batch_size, verrouiller=corriger):
+        premier, dernier = factures[0].pk, factures[-1].pk
+        lignes = _sommes(InvoiceLine.objects.all(), 'facture_id', Sum('montant_total'), premier, dernier)
+        paiements = _sommes(Payment.objects.all(), 'facture_id', Sum('montant'), premier, dernier)
+
+        a_corriger = []
+        for facture in factures:
+            enregistre = {champ: getattr(facture, champ) for champ in CHAMPS_FACTURE}
+
+            facture.montant_paye = (paiements.get(facture.pk) or Decimal('0')).quantize(CENTIME)
+            facture.appliquer_sous_total((lignes.get(facture.pk) or Decimal('0')).quantize(CENTIME))
+
+            differences = {
+                champ: (enregistre[champ], getattr(facture, champ))
+                for champ in CHAMPS_FACTURE if enregistre[champ] != getattr(facture, champ)
+            }
+            if differences:
+                ecarts.append((facture.pk, differences))
+                a_corriger.append(facture)
+        controlees += len(factures)
+
+        if corriger and a_corriger:
+            Invoice.objects.bulk_update(a_corriger, CHAMPS_FACTURE, batch_size=500)
+    return controlees, ecarts
+
+
+def verifier_soldes(corriger=False, batch_size=2000):
+    """
+    Compare le solde de chaque client, et la somme de son journal, au reste dû de ses
+    factures. En mode correction, un mouvement d'ajustement aligne le journal et le
+    solde est réécrit. Retourne (nombre de clients contrôlés, liste des écarts).
+    """
+    controles = 0
+    ecarts = []
+    reste_du = Sum(F('montant_total') - F('montant_paye'))
+    for clients in _tranches(Client.objects.all(), ['solde'], batch_size, verrouiller=corriger):
+        premier, dernier = clients[0].pk, clients[-1].pk
+        attendus = _sommes(Invoice.objects.all(), 'client_id', reste_du, premier, dernier)
+        journal = _sommes(MouvementSolde.objects.all(), 'client_id', Sum('montant'), premier, dernier)
+
+        a_corriger, ajustements = [], []
+        for client in clients:
+            attendu = (attendus.get(client.pk) or Decimal('0')).quantize(CENTIME)
+            journalise = (journal.get(client.pk) or Decimal('0')).quantize(CENTIME)
+            if client.solde != attendu or journalise != attendu:
+                ecarts.append((client.pk, {'solde': (client.solde, attendu), 'journal': (journalise, attendu)}))
+                if journalise != attendu:
+                    ajustements.append(MouvementSolde(client_id=client.pk, montant=attendu - journalise, motif='ajustement'))
+                client.solde = attendu
+                a_corriger.append(client)
+        controles += len(clients)
+
+        if corriger and a_corriger:
+            MouvementSolde.objects.bulk_create(ajustements)
+            Client.objects.bulk_update(a_corriger, ['solde'], batch_size=500)
+    return controles, ecarts
@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+"""
+Journal des mouvements du solde client (append-only).
+
+Chaque variation de Client.solde est écrite dans MouvementSolde dans la même
+transaction que la modification de facture qui la provoque, et le solde est
+ajusté par une mise à jour atomique F() : deux caissiers qui postent en même
+temps sur le même client ne perdent plus de mise à jour. Le solde peut être
+reconstruit à tout moment à partir du journal.
+"""
+from collections import defaultdict
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import F, Sum, Case, When, Value, DecimalField
+
+from clients.models import Client
+from .models import MouvementSolde
+
+
+@transaction.atomic
+def enregistrer_mouvements(mouvements):
+    """
+    Enregistre des mouvements (client_id, montant, motif, facture_id) et les reporte
+    sur les soldes : une insertion en lot et une seule requête UPDATE.
+    """
+    mouvements = [m for m in mouvements if m[1]]
+    if not mouvements:
+        return
+    MouvementSolde.objects.bulk_create([
+        MouvementSolde(client_id=client_id, montant=montant, motif=motif, facture_id=facture_id)
+        for client_id, montant, motif, facture_id in mouvements
+    ])
+
+    deltas = defaultdict(Decimal)
+    for client_id, montant, motif, facture_id in mouvements:
+        deltas[client_id] += montant
+    Client.objects.filter(pk__in=deltas.keys()).update(
+        solde=F('solde') + Case(
+            *[When(pk=client_id, then=Value(montant)) for client_id, montant in deltas.items()],
+            default=Value(Decimal('0')),
+            output_field=DecimalField(max_digits=10, decimal_places=2),
+        )
+    )
+
+
+def recalculer_soldes(client_ids=None, batch_size=1000):
+    """
+    Reconstruit Client.solde à partir du journal en une passe agrégée
+    (tous les clients, ou seulement ceux de client_ids). Retourne le nombre de soldes corrigés.
+    """
+    mouvements = MouvementSolde.objects.all()
+    clients = Client.objects.only('id', 'solde')
+    if client_ids is not None:
+        mouvements = mouvements.filter(client_id__in=client_ids)
+        clients = clients.filter(pk__in=client_ids)
+
+    sommes = dict(mouvements.values('client_id').annotate(total=Sum('montant')).values_list('client_id', 'total'))
+
+    with transaction.atomic():
+        a_corriger = []
+        for client in clients.select_for_update():
+            attendu = sommes.get(client.pk) or Decimal('0')
+            if client.solde != attendu:
+                client.solde = attendu
+                a_corriger.append(client)
+        Client.objects.bulk_update(a_corriger, ['solde'], batch_size=batch_size)
+    return len(a_corriger)
@@ -1,52 +1,116 @@
-from django.core.management.base import BaseCommand
+import datetime
+from collections import defaultdict
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Min
 from django.utils import timezone
 from reservations.models import Reservation
-from billing.models import Invoice, InvoiceLine
-import datetime
+from billing.folios import nuitees_a_facturer, poster_nuitees, reservations_a_facturer, facturer_nuitees
+from billing.sharding import decouper_en_tranches, executer_par_tranches
+
+
+def parse_date(value):
+    try:
+        return datetime.datetime.strptime(value, '%Y-%m-%d').date()
+    except ValueError:
+        raise CommandError(f"Date invalide : {value}. Utilisez YYYY-MM-DD")
+
 
 class Command(BaseCommand):
-    help = 'Charges the daily rate for all active reservations that have not been charged for the current day.'
+    help = 'Charges the daily rate for all active reservations: the current day, a date range (--from/--to) or every missed night (--catch-up), optionally across several processes (--workers).'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--from', dest='date_from', type=parse_date, help="Première nuit à facturer (YYYY-MM-DD)")
+        parser.add_argument('--to', dest='date_to', type=parse_date, help="Dernière nuit à facturer (YYYY-MM-DD, aujourd'hui par défaut)")
+        parser.add_argument('--catch-up', action='store_true', help="Rattraper toutes les nuitées manquantes des réservations actives jusqu'à aujourd'hui")
+        parser.add_argument('--batch-size', type=int, default=500, help="Nombre de nuitées postées par transaction")
+        parser.add_argument('--dry-run', action='store_true', help="Afficher ce qui serait facturé sans rien enregistrer")
+        parser.add_argument('--workers', type=int, default=1, help="Nombre de processus en parallèle (tranches d'identifiants de réservation)")
 
     def handle(self, *args, **options):
         today = timezone.now().date()
-        # On ne prend que les réservations actives dont la date de fin n'est pas encore passée
-        active_reservations = Reservation.objects.filter(statut='active', date_fin__gte=today)
-        
-        self.stdout.write(f"Vérification des facturations journalières pour {active_reservations.count()} réservation(s) active(s) en date du {today.strftime('%d/%m/%Y')}.")
-        
+        date_to = options['date_to'] or today
+
+        if options['catch_up']:
+            date_from = Reservation.objects.filter(statut='active').aggregate(debut=Min('date_debut'))['debut'] or today
+        else:
+            date_from = options['date_from'] or date_to
+
+        if date_to > today:
+            raise CommandError("Impossible de facturer des nuitées futures.")
+        if date_from > date_to:
+            raise CommandError("La date de début doit précéder la date de fin.")
+        if options['batch_size'] < 1:
+            raise CommandError("--batch-size doit être positif.")
+        if options['workers'] < 1:
+            raise CommandError("--workers doit être positif.")
+
+        self.stdout.write(
+            f"Recherche des nuitées non facturées du {date_from.strftime('%d/%m/%Y')} au {date_to.strftime('%d/%m/%Y')}."
+        )
+        if options['workers'] > 1 and not options['dry_run']:
+            self.facturer_en_parallele(date_from, date_to, options['workers'], options['batch_size'])
+            return
+
+        nuitees, ignorees = nuitees_a_facturer(date_from, date_to)
+
+        for reservation_id, motif in ignorees:
+            self.stdout.write(self.style.ERROR(f"-> {motif} pour la réservation active #{reservation_id}. Ignoré."))
+
+        if options['dry_run']:
+            self.rapport(nuitees)
+            return
+
+        charged_count = poster_nuitees(nuitees, batch_size=options['batch_size'])
+        reservations_count = len({nuitee['reservation_id'] for nuitee in nuitees})
+        self.stdout.write(self.style.SUCCESS(
+            f"\nOpération terminée. {charged_count} nuitée(s) facturée(s) sur {reservations_count} réservation(s)."
+        ))
+
+    def facturer_en_parallele(self, date_from, date_to, workers, batch_size):
+        """Répartit les réservations en tranches d'identifiants entre plusieurs processus"""
+        ids = reservations_a_facturer(date_from, date_to).order_by('pk').values_list('pk', flat=True)
+        # Plusieurs tranches par processus : une tranche lente ne retient pas tout le pool
+        tranches = decouper_en_tranches(ids, workers * 4)
+        resultats, echecs = executer_par_tranches(
+            facturer_nuitees, tranches, workers=workers,
+            date_min=date_from, date_max=date_to, batch_size=batch_size,
+        )
+
         charged_count = 0
-        for reservation in active_reservations:
-            try:
-                # Trouver la facture impayée ou partiellement payée correspondante
-                invoice = Invoice.objects.get(reservation=reservation, statut__in=['impaye', 'partiel'])
-                
-                # Description de la ligne de facture pour aujourd'hui
-                description_today = f"Nuitée du {today.strftime('%d/%m/%Y')}"
-                
-                # Vérifier si une facturation pour aujourd'hui a déjà été faite pour éviter les doublons
-                already_charged = invoice.lines.filter(description__startswith=description_today).exists()
-                
-                if not already_charged:
-                    # Ajouter la ligne de facture pour la nuitée du jour
-                    InvoiceLine.objects.create(
-                        facture=invoice,
-                        description=f"{description_today} - Chambre {reservation.chambre.numero}",
-                        quantite=1,
-                        prix_unitaire=reservation.chambre.room_group.price
-                    )
-                    
-                    # Recalculer les totaux de la facture
-                    invoice.calculer_totaux()
-                    invoice.save()
-                    
-                    charged_count += 1
-                    self.stdout.write(self.style.SUCCESS(f"-> Facturé avec succès pour la réservation #{reservation.id} (Client: {reservation.client.nom})."))
-                else:
-                    self.stdout.write(self.style.WARNING(f"-> La réservation #{reservation.id} a déjà été facturée pour aujourd'hui. Ignoré."))
-            
-            except Invoice.DoesNotExist:
-                self.stdout.write(self.style.ERROR(f"-> Aucune facture impayée trouvée pour la réservation active #{reservation.id}. Ignoré."))
-            except Exception as e:
-                self.stdout.write(self.style.ERROR(f"-> Une erreur est survenue pour la réservation #{reservation.id}: {e}"))
-
-        self.stdout.write(f"\nOpération terminée. {charged_count} réservation(s) ont été facturées pour la journée.")
+        for tranche in tranches:
+            if tranche not in resultats:
+                continue
+            postees, ignorees = resultats[tranche]
+            charged_count += postees
+            self.stdout.write(f"-> Réservations #{tranche[0]} à #{tranche[1]} : {postees} nuitée(s) facturée(s).")
+            for reservation_id, motif in ignorees:
+                self.stdout.write(self.style.ERROR(f"-> {motif} pour la réservation active #{reservation_id}. Ignoré."))
+
+        if echecs:
+            details = '; '.join(f"#{debut} à #{fin} : {erreur}" for (debut, fin), erreur in echecs.items())
+            raise CommandError(
+                f"{charged_count} nuitée(s) facturée(s), mais {len(echecs)} tranche(s) en échec ({details}). "
+                "Relancez la commande : les nuitées déjà postées ne seront pas refacturées."
+            )
+        self.stdout.write(self.style.SUCCESS(
+            f"\nOpération terminée. {charged_count} nuitée(s) facturée(s) en {len(tranches)} tranche(s) sur {workers} processus."
+        ))
+
+    def rapport(self, nuitees):
+        """Résumé par réservation de ce qui serait facturé (--dry-run)"""
+        par_reservation = defaultdict(list)
+        for nuitee in nuitees:
+            par_reservation[nuitee['reservation_id']].append(nuitee)
+
+        total = 0
+        for reservation_id, lignes in par_reservation.items():
+            montant = sum(nuitee['prix'] for nuitee in lignes)
+            total += montant
+            nuits = ', '.join(nuitee['nuit'].strftime('%d/%m') for nuitee in lignes)
+            self.stdout.write(
+                f"-> Réservation #{reservation_id} (Chambre {lignes[0]['chambre']}) : "
+                f"{len(lignes)} nuitée(s) [{nuits}] = {montant} HT"
+            )
+        self.stdout.write(self.style.WARNING(
+            f"\n[Simulation] {len(nuitees)} nuitée(s) seraient facturées pour un total de {total} HT. Rien n'a été enregistré."
+        ))
@@ -0,0 +1,41 @@
+import time
+from django.core.management.base import BaseCommand, CommandError
+from billing.integrity import verifier_factures, verifier_soldes
+
+
+class Command(BaseCommand):
+    help = (
+        "Recomputes invoice totals, TVA, paid amounts and status from their lines and payments, "
+        "and client balances from their invoices, in chunked aggregate passes. "
+        "--check reports drift only (default), --fix writes the corrected values."
+    )
+
+    def add_arguments(self, parser):
+        mode = parser.add_mutually_exclusive_group()
+        mode.add_argument('--check', action='store_true', help="Signaler les écarts sans rien modifier (par défaut)")
+        mode.add_argument('--fix', action='store_true', help="Corriger les écarts (ajustements inscrits au journal des soldes)")
+        parser.add_argument('--batch-size', type=int, default=2000, help="Nombre de factures / clients contrôlés par tranche")
+        parser.add_argument('--details', type=int, default=20, help="Nombre d'écarts détaillés affichés par passe")
+
+    def handle(self, *args, **options):
+        if options['batch_size'] < 1:
+            raise CommandError("--batch-size doit être positif.")
+        corriger = options['fix']
+
+        # Les soldes après les factures : leur passe reporte une seule fois les totaux corrigés
+        for libelle, passe in (('Factures', verifier_factures), ('Soldes clients', verifier_soldes)):
+            debut = time.monotonic()
+            controles, ecarts = passe(corriger=corriger, batch_size=options['batch_size'])
+            duree = time.monotonic() - debut
+
+            style = self.style.WARNING if ecarts else self.style.SUCCESS
+            etat = 'corrigé(s)' if corriger else 'détecté(s)'
+            self.stdout.write(style(f"{libelle} : {controles} contrôlé(s), {len(ecarts)} écart(s) {etat} en {duree:.1f} s."))
+            for pk, differences in ecarts[:options['details']]:
+                details = ', '.join(f"{champ} {avant} -> {apres}" for champ, (avant, apres) in differences.items() if avant != apres)
+                self.stdout.write(f"  #{pk} : {details}")
+            if len(ecarts) > options['details']:
+                self.stdout.write(f"  ... et {len(ecarts) - options['details']} autre(s).")
+
+        if not corriger:
+            self.stdout.write("Mode contrôle : rien n'a été modifié. Utilisez --fix pour corriger.")
@@ -0,0 +1,60 @@
+# Generated by Django 4.2.27 on 2026-10-18 16:25
+
+from django.db import migrations, models
+import datetime
+import re
+import django.db.models.deletion
+
+
+def indexer_nuitees(apps, schema_editor):
+    """Renseigne (réservation, nuit) sur les lignes de nuitée existantes, repérées par leur description"""
+    InvoiceLine = apps.get_model('billing', 'InvoiceLine')
+
+    motif = re.compile(r'^Nuitée du (\d{2}/\d{2}/\d{4})')
+    vues = set()
+    a_modifier = []
+    lignes = InvoiceLine.objects.filter(
+        description__startswith='Nuitée du', facture__reservation__isnull=False
+    ).values_list('id', 'description', 'facture__reservation_id').order_by('id')
+    for line_id, description, reservation_id in lignes.iterator():
+        trouve = motif.match(description)
+        if not trouve:
+            continue
+        nuit = datetime.datetime.strptime(trouve.group(1), '%d/%m/%Y').date()
+        # Les doublons historiques gardent leur description mais pas la clé
+        if (reservation_id, nuit) in vues:
+            continue
+        vues.add((reservation_id, nuit))
+        a_modifier.append(InvoiceLine(id=line_id, reservation_id=reservation_id, date_nuitee=nuit))
+    InvoiceLine.objects.bulk_update(a_modifier, ['reservation', 'date_nuitee'], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('reservations', '0007_reservation_reference_groupe'),
+        ('billing', '0004_invoiceline_menu_item_alter_invoice_statut'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='invoiceline',
+            name='date_nuitee',
+            field=models.DateField(blank=True, null=True, verbose_name='Nuitée du'),
+        ),
+        migrations.AddField(
+            model_name='invoiceline',
+            name='reservation',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='nuitees_facturees', to='reservations.reservation', verbose_name='Réservation (nuitée)'),
+        ),
+        migrations.AlterField(
+            model_name='invoice',
+            name='statut',
+            field=models.CharField(choices=[('impaye', 'Impayée'), ('partiel', 'Paiement Partiel'), ('paye', 'Payée')], default='impaye', max_length=20, verbose_name='Statut'),
+        ),
+        migrations.RunPython(indexer_nuitees, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='invoiceline',
+            constraint=models.UniqueConstraint(fields=('reservation', 'date_nuitee'), name='unique_nuitee_par_reservation'),
+        ),
+    ]
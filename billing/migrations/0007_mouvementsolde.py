@@ -0,0 +1,44 @@
+# Generated by Django 4.2.27 on 2026-10-18 16:28
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def ouvrir_journal(apps, schema_editor):
+    """Un mouvement d'ouverture par client reprend le solde existant dans le journal"""
+    Client = apps.get_model('clients', 'Client')
+    MouvementSolde = apps.get_model('billing', 'MouvementSolde')
+
+    MouvementSolde.objects.bulk_create([
+        MouvementSolde(client_id=client_id, montant=solde, motif='ouverture')
+        for client_id, solde in Client.objects.exclude(solde=0).values_list('id', 'solde').iterator()
+    ], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('clients', '0004_remove_client_contact_client_email_client_telephone'),
+        ('billing', '0006_invoicesequence'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MouvementSolde',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('montant', models.DecimalField(decimal_places=2, max_digits=12, verbose_name='Montant')),
+                ('motif', models.CharField(choices=[('ouverture', "Solde d'ouverture"), ('facture', 'Facture'), ('paiement', 'Paiement'), ('suppression', 'Suppression de facture'), ('ajustement', 'Ajustement')], max_length=20, verbose_name='Motif')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('client', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='mouvements_solde', to='clients.client', verbose_name='Client')),
+                ('facture', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='mouvements_solde', to='billing.invoice', verbose_name='Facture')),
+            ],
+            options={
+                'verbose_name': 'Mouvement de solde',
+                'verbose_name_plural': 'Mouvements de solde',
+                'ordering': ['-created_at'],
+                'indexes': [models.Index(fields=['client', 'created_at'], name='billing_mou_client__a0cb20_idx')],
+            },
+        ),
+        migrations.RunPython(ouvrir_journal, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,49 @@
+# Generated by Django 4.2.27 on 2026-10-18 16:31
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+def reprendre_paiements(apps, schema_editor):
+    """Un paiement de reprise par facture déjà réglée : montant_paye reste égal à la somme des paiements"""
+    Invoice = apps.get_model('billing', 'Invoice')
+    Payment = apps.get_model('billing', 'Payment')
+
+    Payment.objects.bulk_create([
+        Payment(facture_id=pk, montant=montant_paye, mode='reprise', date_paiement=date_paiement or date_emission)
+        for pk, montant_paye, date_paiement, date_emission in Invoice.objects.filter(montant_paye__gt=0)
+        .values_list('pk', 'montant_paye', 'date_paiement', 'date_emission').iterator()
+    ], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('billing', '0007_mouvementsolde'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Payment',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('montant', models.DecimalField(decimal_places=2, max_digits=12, verbose_name='Montant')),
+                ('mode', models.CharField(choices=[('cash', 'Cash'), ('carte', 'Carte bancaire'), ('mobile_money', 'Mobile Money'), ('banque', 'Virement bancaire'), ('reprise', 'Reprise (historique)')], default='cash', max_length=20, verbose_name='Mode de paiement')),
+                ('reference', models.CharField(blank=True, max_length=100, verbose_name='Référence de transaction')),
+                ('cle_idempotence', models.CharField(blank=True, max_length=64, null=True, unique=True, verbose_name="Clé d'idempotence")),
+                ('date_paiement', models.DateField(default=django.utils.timezone.localdate, verbose_name='Date du paiement')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('created_by', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to=settings.AUTH_USER_MODEL, verbose_name='Enregistré par')),
+                ('facture', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='paiements', to='billing.invoice', verbose_name='Facture')),
+            ],
+            options={
+                'verbose_name': 'Paiement',
+                'verbose_name_plural': 'Paiements',
+                'ordering': ['-created_at'],
+            },
+        ),
+        migrations.RunPython(reprendre_paiements, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 4.2.27 on 2026-10-18 16:47
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('billing', '0008_payment'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='invoice',
+            index=models.Index(fields=['date_emission', 'id'], name='billing_inv_date_em_1ba439_idx'),
+        ),
+    ]
@@ -1,6 +1,9 @@
 # -*- coding: utf-8 -*-
-from decimal import Decimal
-from django.db import models
+from decimal import Decimal, ROUND_HALF_UP
+from django.db import models, transaction
+from django.conf import settings
+from django.db.models import Sum
+from django.utils import timezone
 from clients.models import Client
 from reservations.models import Reservation
 from services.models import Service
@@ -40,15 +43,23 @@ class Invoice(models.Model):
         ordering = ['-date_emission']
         verbose_name = "Facture"
         verbose_name_plural = "Factures"
+        indexes = [
+            # Pagination par clé de la liste des factures
+            models.Index(fields=['date_emission', 'id']),
+        ]
     
     def calculer_totaux(self):
-        """Calcule automatiquement les totaux"""
+        """Recalcul complet des totaux à partir de toutes les lignes (réparation uniquement)"""
         # Sous-total = somme des lignes
-        self.sous_total = sum(line.montant_total for line in self.lines.all())
+        self.appliquer_sous_total(self.lines.aggregate(total=Sum('montant_total'))['total'] or Decimal('0'))
+    
+    def appliquer_sous_total(self, sous_total):
+        """Met à jour TVA, total TTC et statut à partir d'un sous-total déjà connu"""
+        self.sous_total = sous_total
         
         # TVA sur (sous-total - remise)
         base_taxable = self.sous_total - self.remise
-        self.montant_tva = base_taxable * (self.taux_tva / Decimal('100'))
+        self.montant_tva = (base_taxable * (self.taux_tva / Decimal('100'))).quantize(Decimal('0.01'), rounding=ROUND_HALF_UP)
         
         # Total TTC
         self.montant_total = base_taxable + self.montant_tva
@@ -61,35 +72,78 @@ class Invoice(models.Model):
         else:
             self.statut = 'impaye'
     
+    @classmethod
+    def appliquer_ecart_ligne(cls, facture_id, ecart):
+        """
+        Reporte l'écart de montant d'une ligne sur les totaux de la facture et le solde
+        du client, sans relire les lignes : coût constant quelle que soit la taille du folio.
+        """
+        if not ecart:
+            return
+        with transaction.atomic():
+            # Verrou sur la seule ligne de la facture pendant le calcul des nouveaux totaux
+            facture = cls.objects.select_for_update().only(
+                'client_id', 'sous_total', 'remise', 'taux_tva', 'montant_total', 'montant_paye', 'statut'
+            ).get(pk=facture_id)
+            ancien_total = facture.montant_total
+            facture.appliquer_sous_total(facture.sous_total + ecart)
+            cls.objects.filter(pk=facture_id).update(
+                sous_total=facture.sous_total,
+                montant_tva=facture.montant_tva,
+                montant_total=facture.montant_total,
+                statut=facture.statut,
+                updated_at=timezone.now(),
+            )
+            from .ledger import enregistrer_mouvements
+            enregistrer_mouvements([(facture.client_id, facture.montant_total - ancien_total, 'facture', facture_id)])
+    
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Valeurs chargées : l'écart de solde se calcule à la sauvegarde sans relire la facture
+        # (None si le champ est différé : only() / defer(), relu à la sauvegarde)
+        instance._solde_initial = tuple(
+            instance.__dict__.get(champ) for champ in ('client_id', 'montant_total', 'montant_paye')
+        )
+        return instance
+    
     def save(self, *args, **kwargs):
-        # Store the old total amount to calculate the difference
-        old_montant_total = 0
-        old_montant_paye = 0
-        if self.pk:
-            invoice = Invoice.objects.get(pk=self.pk)
-            old_montant_total = invoice.montant_total
-            old_montant_paye = invoice.montant_paye
+        from .ledger import enregistrer_mouvements
 
-        # Générer numéro de facture automatique
+        # Générer numéro de facture automatique (séquence annuelle, sans balayer les factures)
         if not self.numero_facture:
-            from django.utils import timezone
-            year = timezone.now().year
-            count = Invoice.objects.filter(numero_facture__startswith=f'FACT-{year}').count() + 1
-            self.numero_facture = f'FACT-{year}-{count:04d}'
+            from .numbering import allouer_numeros
+            self.numero_facture = allouer_numeros(1)[0]
         
-        super().save(*args, **kwargs)
-
-        # Update client balance
-        total_diff = self.montant_total - old_montant_total
-        paid_diff = self.montant_paye - old_montant_paye
-        self.client.solde += total_diff - paid_diff
-        self.client.save(update_fields=['solde'])
+        ancien_client, ancien_total, ancien_paye = getattr(self, '_solde_initial', (None, Decimal('0'), Decimal('0')))
+        if self.pk and None in (ancien_client, ancien_total, ancien_paye):
+            # Facture chargée avec des champs différés : valeurs enregistrées relues en base
+            ancien_client, ancien_total, ancien_paye = type(self).objects.filter(pk=self.pk).values_list(
+                'client_id', 'montant_total', 'montant_paye'
+            ).first() or (None, Decimal('0'), Decimal('0'))
+        mouvements = []
+        if ancien_client and ancien_client != self.client_id:
+            # Facture réattribuée : retirer sa contribution à l'ancien client
+            mouvements.append((ancien_client, ancien_paye - ancien_total, 'ajustement', self.pk))
+            ancien_total = ancien_paye = Decimal('0')
+        
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            
+            # Mouvements de solde écrits dans la même transaction que la facture
+            mouvements.append((self.client_id, self.montant_total - ancien_total, 'facture', self.pk))
+            mouvements.append((self.client_id, ancien_paye - self.montant_paye, 'paiement', self.pk))
+            enregistrer_mouvements(mouvements)
+        
+        self._solde_initial = (self.client_id, self.montant_total, self.montant_paye)
     
     def delete(self, *args, **kwargs):
-        # Adjust client balance before deleting
-        self.client.solde -= self.montant_total
-        self.client.save(update_fields=['solde'])
-        super().delete(*args, **kwargs)
+        from .ledger import enregistrer_mouvements
+
+        with transaction.atomic():
+            # Retirer le reste dû de la facture du solde client
+            enregistrer_mouvements([(self.client_id, self.montant_paye - self.montant_total, 'suppression', self.pk)])
+            return super().delete(*args, **kwargs)
     
     def __str__(self):
         return f"{self.numero_facture} - {self.client} - {self.montant_total} FCFA"
@@ -99,6 +153,73 @@ class Invoice(models.Model):
         """Montant restant à payer"""
         return self.montant_total - self.montant_paye
 
+class Payment(models.Model):
+    """Paiement reçu sur une facture ; montant_paye de la facture est la somme de ses paiements"""
+    MODE_CHOICES = [
+        ('cash', 'Cash'),
+        ('carte', 'Carte bancaire'),
+        ('mobile_money', 'Mobile Money'),
+        ('banque', 'Virement bancaire'),
+        ('reprise', 'Reprise (historique)'),
+    ]
+    
+    facture = models.ForeignKey(Invoice, on_delete=models.CASCADE, related_name='paiements', verbose_name="Facture")
+    montant = models.DecimalField(max_digits=12, decimal_places=2, verbose_name="Montant")
+    mode = models.CharField(max_length=20, choices=MODE_CHOICES, default='cash', verbose_name="Mode de paiement")
+    reference = models.CharField(max_length=100, blank=True, verbose_name="Référence de transaction")
+    # Clé fournie par le client (formulaire, terminal, webhook) : un paiement rejoué n'est pas compté deux fois
+    cle_idempotence = models.CharField(max_length=64, unique=True, null=True, blank=True, verbose_name="Clé d'idempotence")
+    date_paiement = models.DateField(default=timezone.localdate, verbose_name="Date du paiement")
+    created_by = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.SET_NULL, null=True, blank=True, verbose_name="Enregistré par")
+    created_at = models.DateTimeField(auto_now_add=True)
+    
+    class Meta:
+        ordering = ['-created_at']
+        verbose_name = "Paiement"
+        verbose_name_plural = "Paiements"
+    
+    def __str__(self):
+        return f"{self.montant} FCFA ({self.get_mode_display()}) - facture {self.facture_id}"
+
+class MouvementSolde(models.Model):
+    """Journal des mouvements du solde client (jamais modifié, seulement complété)"""
+    MOTIF_CHOICES = [
+        ('ouverture', "Solde d'ouverture"),
+        ('facture', 'Facture'),
+        ('paiement', 'Paiement'),
+        ('suppression', 'Suppression de facture'),
+        ('ajustement', 'Ajustement'),
+    ]
+    
+    client = models.ForeignKey(Client, on_delete=models.CASCADE, related_name='mouvements_solde', verbose_name="Client")
+    facture = models.ForeignKey(Invoice, on_delete=models.SET_NULL, null=True, blank=True, related_name='mouvements_solde', verbose_name="Facture")
+    montant = models.DecimalField(max_digits=12, decimal_places=2, verbose_name="Montant")
+    motif = models.CharField(max_length=20, choices=MOTIF_CHOICES, verbose_name="Motif")
+    created_at = models.DateTimeField(auto_now_add=True)
+    
+    class Meta:
+        ordering = ['-created_at']
+        verbose_name = "Mouvement de solde"
+        verbose_name_plural = "Mouvements de solde"
+        indexes = [
+            models.Index(fields=['client', 'created_at']),
+        ]
+    
+    def __str__(self):
+        return f"{self.client_id} : {self.montant} ({self.get_motif_display()})"
+
+class InvoiceSequence(models.Model):
+    """Compteur de numérotation des factures, une ligne par année"""
+    annee = models.PositiveIntegerField(unique=True, verbose_name="Année")
+    dernier_numero = models.PositiveIntegerField(default=0, verbose_name="Dernier numéro attribué")
+    
+    class Meta:
+        verbose_name = "Séquence de facturation"
+        verbose_name_plural = "Séquences de facturation"
+    
+    def __str__(self):
+        return f"FACT-{self.annee} : {self.dernier_numero}"
+
 class InvoiceLine(models.Model):
     """Ligne de facture"""
     facture = models.ForeignKey(Invoice, related_name='lines', on_delete=models.CASCADE, verbose_name="Facture")
@@ -109,37 +230,71 @@ class InvoiceLine(models.Model):
     prix_unitaire = models.DecimalField(max_digits=10, decimal_places=2, verbose_name="Prix unitaire", default=0)
     montant_total = models.DecimalField(max_digits=10, decimal_places=2, editable=False, verbose_name="Total", default=0)
     
+    # Clé structurée des nuitées : une seule ligne par (réservation, nuit)
+    reservation = models.ForeignKey(Reservation, on_delete=models.SET_NULL, null=True, blank=True, related_name='nuitees_facturees', verbose_name="Réservation (nuitée)")
+    date_nuitee = models.DateField(null=True, blank=True, verbose_name="Nuitée du")
+    
     class Meta:
         verbose_name = "Ligne de facture"
         verbose_name_plural = "Lignes de facture"
+        constraints = [
+            models.UniqueConstraint(fields=['reservation', 'date_nuitee'], name='unique_nuitee_par_reservation'),
+        ]
     
-    def save(self, *args, **kwargs):
+    def preparer(self):
+        """Complète la ligne depuis le service ou l'article de menu et calcule son total (sans requête si déjà chargés)"""
+        a_completer = not self.description or self.prix_unitaire == 0
+
         # Remplir automatiquement depuis le service ou l'article de menu
-        if self.service and not self.description:
-            self.description = self.service.name
-        if self.service and self.prix_unitaire == 0:
-            self.prix_unitaire = self.service.price
-            
-        if self.menu_item and not self.description:
-            self.description = self.menu_item.nom
-        if self.menu_item and self.prix_unitaire == 0:
-            self.prix_unitaire = self.menu_item.prix
+        if self.service_id and a_completer:
+            if not self.description:
+                self.description = self.service.name
+            if self.prix_unitaire == 0:
+                self.prix_unitaire = self.service.price
+
+        if self.menu_item_id and a_completer:
+            if not self.description:
+                self.description = self.menu_item.nom
+            if self.prix_unitaire == 0:
+                self.prix_unitaire = self.menu_item.prix
 
         # Calcul automatique du total de la ligne
-        self.montant_total = self.quantite * self.prix_unitaire
-        super().save(*args, **kwargs)
+        self.montant_total = (self.quantite * self.prix_unitaire).quantize(Decimal('0.01'), rounding=ROUND_HALF_UP)
+
+    def save(self, *args, **kwargs):
+        self.preparer()
+
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            
+            # Reporter l'écart sur la facture (et l'ancienne facture si la ligne a changé de facture)
+            ancienne_facture = getattr(self, '_facture_initiale', None)
+            ancien_montant = getattr(self, '_montant_initial', Decimal('0'))
+            if ancienne_facture and ancienne_facture != self.facture_id:
+                Invoice.appliquer_ecart_ligne(ancienne_facture, -ancien_montant)
+                ancien_montant = Decimal('0')
+            if self.facture_id:
+                Invoice.appliquer_ecart_ligne(self.facture_id, self.montant_total - ancien_montant)
         
-        # Recalculer les totaux de la facture
-        if self.facture_id:
-            self.facture.calculer_totaux()
-            self.facture.save(update_fields=['sous_total', 'montant_tva', 'montant_total', 'statut'])
+        self._facture_initiale = self.facture_id
+        self._montant_initial = self.montant_total
     
     def delete(self, *args, **kwargs):
-        facture = self.facture
-        super().delete(*args, **kwargs)
-        # Recalculer après suppression
-        facture.calculer_totaux()
-        facture.save(update_fields=['sous_total', 'montant_tva', 'montant_total', 'statut'])
+        facture_id = self.facture_id
+        montant = getattr(self, '_montant_initial', self.montant_total)
+        with transaction.atomic():
+            result = super().delete(*args, **kwargs)
+            # Retirer le montant de la ligne supprimée
+            Invoice.appliquer_ecart_ligne(facture_id, -montant)
+        return result
+    
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Mémoriser les valeurs chargées pour calculer l'écart à la sauvegarde sans relire la ligne
+        instance._facture_initiale = instance.__dict__.get('facture_id')
+        instance._montant_initial = instance.__dict__.get('montant_total', Decimal('0'))
+        return instance
     
     def __str__(self):
         return f"{self.description} - {self.montant_total} FCFA"
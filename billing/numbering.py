@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+"""
+Numérotation des factures (FACT-AAAA-NNNN) par séquence annuelle.
+
+Les numéros sont réservés atomiquement sur la ligne InvoiceSequence de l'année,
+sans compter ni balayer la table des factures. Avec INVOICE_NUMBER_BLOCK_SIZE > 1,
+chaque processus réserve un bloc de numéros et le consomme en mémoire : la ligne
+de séquence n'est alors verrouillée qu'une fois par bloc. Les numéros d'un bloc
+non consommé avant l'arrêt du processus sont perdus (trous dans la numérotation).
+"""
+import re
+import threading
+
+from django.conf import settings
+from django.db import transaction, IntegrityError
+from django.utils import timezone
+
+from .models import Invoice, InvoiceSequence
+
+_blocs = {}  # {annee: [prochain numéro, dernier numéro]} réservés par ce processus
+_verrou = threading.Lock()
+
+
+def formater_numero(annee, numero):
+    return f'FACT-{annee}-{numero:04d}'
+
+
+def _dernier_numero_existant(annee):
+    """Plus grand numéro déjà attribué pour l'année (lu une seule fois, à la création de la séquence)"""
+    motif = re.compile(rf'^FACT-{annee}-(\d+)$')
+    numeros = Invoice.objects.filter(numero_facture__startswith=f'FACT-{annee}-').values_list('numero_facture', flat=True)
+    return max((int(m.group(1)) for m in map(motif.match, numeros) if m), default=0)
+
+
+def _reserver(annee, quantite):
+    """Réserve `quantite` numéros consécutifs et retourne (premier, dernier)"""
+    with transaction.atomic():
+        sequence = InvoiceSequence.objects.select_for_update().filter(annee=annee).first()
+        if sequence is None:
+            try:
+                with transaction.atomic():
+                    InvoiceSequence.objects.create(annee=annee, dernier_numero=_dernier_numero_existant(annee))
+            except IntegrityError:
+                pass  # Créée en parallèle par un autre processus
+            sequence = InvoiceSequence.objects.select_for_update().get(annee=annee)
+        premier = sequence.dernier_numero + 1
+        dernier = sequence.dernier_numero + quantite
+        InvoiceSequence.objects.filter(pk=sequence.pk).update(dernier_numero=dernier)
+    return premier, dernier
+
+
+def allouer_numeros(nombre=1, annee=None):
+    """Retourne `nombre` numéros de facture uniques pour l'année (année courante par défaut)"""
+    annee = annee or timezone.now().year
+
+    with _verrou:
+        bloc = _blocs.get(annee)
+        if bloc and bloc[1] - bloc[0] + 1 >= nombre:
+            premier = bloc[0]
+            bloc[0] += nombre
+            return [formater_numero(annee, n) for n in range(premier, premier + nombre)]
+
+    taille_bloc = getattr(settings, 'INVOICE_NUMBER_BLOCK_SIZE', 1)
+    premier, dernier = _reserver(annee, max(nombre, taille_bloc))
+
+    reste = [premier + nombre, dernier]
+    if reste[0] <= reste[1]:
+        # Le reste du bloc n'est utilisable qu'une fois la réservation validée :
+        # en cas de rollback, ces numéros pourraient être réservés par un autre processus
+        transaction.on_commit(lambda: _blocs.__setitem__(annee, reste))
+
+    return [formater_numero(annee, n) for n in range(premier, premier + nombre)]
@@ -0,0 +1,212 @@
+# -*- coding: utf-8 -*-
+"""
+Enregistrement des paiements : montants en Decimal, clé d'idempotence unique
+(un formulaire soumis deux fois ou un webhook rejoué n'est compté qu'une fois)
+et mise à jour ensembliste des factures. montant_paye est toujours recalculé
+comme la somme des paiements de la facture, jamais incrémenté.
+"""
+from decimal import Decimal, InvalidOperation, ROUND_HALF_UP
+import datetime
+import uuid
+
+from django.core.exceptions import ValidationError
+from django.db import transaction, IntegrityError
+from django.db.models import Sum, Max, F, Case, When, Value, OuterRef, Subquery, DecimalField, CharField
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from .models import Invoice, Payment
+from .ledger import enregistrer_mouvements
+
+MODES_PAIEMENT = {mode for mode, libelle in Payment.MODE_CHOICES if mode != 'reprise'}
+MONTANT_MAX = Decimal('9999999999.99')
+
+
+def convertir_montant(valeur):
+    """Convertit un montant saisi (texte ou nombre) en Decimal à 2 décimales ; lève ValidationError"""
+    try:
+        montant = Decimal(str(valeur).strip().replace(',', '.')).quantize(Decimal('0.01'), rounding=ROUND_HALF_UP)
+    except (InvalidOperation, TypeError, ValueError):
+        raise ValidationError(f"Montant invalide : {valeur}")
+    if montant <= 0 or montant > MONTANT_MAX:
+        raise ValidationError(f"Le montant doit être positif : {valeur}")
+    return montant
+
+
+def _preparer(donnees, user):
+    """Valide toutes les entrées avant d'écrire quoi que ce soit ; retourne des Payment non enregistrés"""
+    factures_ids = set()
+    for d in donnees:
+        try:
+            factures_ids.add(int(d['facture']))
+        except (KeyError, TypeError, ValueError):
+            pass
+    factures = Invoice.objects.only('id').in_bulk(factures_ids)
+
+    paiements, erreurs = [], []
+    for index, d in enumerate(donnees, start=1):
+        try:
+            facture_id = int(d.get('facture'))
+        except (TypeError, ValueError):
+            erreurs.append(f"Paiement {index} : facture manquante")
+            continue
+        if facture_id not in factures:
+            erreurs.append(f"Paiement {index} : facture {facture_id} introuvable")
+            continue
+        mode = d.get('mode') or 'cash'
+        if not isinstance(mode, str) or mode not in MODES_PAIEMENT:
+            erreurs.append(f"Paiement {index} : mode de paiement inconnu ({mode})")
+            continue
+        cle = d.get('cle_idempotence')
+        if cle is not None and (isinstance(cle, bool) or not isinstance(cle, (str, int))):
+            erreurs.append(f"Paiement {index} : clé d'idempotence invalide")
+            continue
+        if cle is not None:
+            cle = str(cle).strip() or None
+        if cle and len(cle) > 64:
+            erreurs.append(f"Paiement {index} : clé d'idempotence trop longue (64 caractères max)")
+            continue
+        try:
+            montant = convertir_montant(d.get('montant'))
+            date_paiement = d.get('date_paiement') or timezone.localdate()
+            if not isinstance(date_paiement, datetime.date):
+                date_paiement = datetime.date.fromisoformat(str(date_paiement))
+        except ValidationError as e:
+            erreurs.append(f"Paiement {index} : {' '.join(e.messages)}")
+            continue
+        except ValueError:
+            erreurs.append(f"Paiement {index} : date invalide (YYYY-MM-DD)")
+            continue
+        paiements.append(Payment(
+            facture_id=facture_id,
+            montant=montant,
+            mode=mode,
+            reference=str(d.get('reference') or '')[:100],
+            cle_idempotence=cle,
+            date_paiement=date_paiement,
+            created_by=user,
+        ))
+
+    if erreurs:
+        raise ValidationError(erreurs)
+    return paiements
+
+
+def _doublons(paiements):
+    """Paiements déjà enregistrés sous la même clé : {clé: (id, facture_id, montant)}"""
+    cles = [p.cle_idempotence for p in paiements if p.cle_idempotence]
+    if not cles:
+        return {}
+    return {
+        cle: (pk, facture_id, montant)
+        for cle, pk, facture_id, montant in Payment.objects.filter(cle_idempotence__in=cles)
+        .values_list('cle_idempotence', 'id', 'facture_id', 'montant')
+    }
+
+
+def synchroniser_montants_payes(facture_ids):
+    """
+    Met à jour montant_paye, date_paiement et statut des factures par requêtes
+    ensemblistes (somme des paiements), et reporte les écarts sur les soldes clients.
+    """
+    facture_ids = set(facture_ids)
+    if not facture_ids:
+        return
+    with transaction.atomic():
+        anciens = list(
+            Invoice.objects.select_for_update().filter(pk__in=facture_ids)
+            .values_list('pk', 'client_id', 'montant_paye')
+        )
+        paiements = Payment.objects.filter(facture=OuterRef('pk')).order_by().values('facture')
+        factures = Invoice.objects.filter(pk__in=facture_ids)
+        factures.update(
+            montant_paye=Coalesce(
+                Subquery(paiements.annotate(somme=Sum('montant')).values('somme')),
+                Value(Decimal('0')),
+                output_field=DecimalField(max_digits=12, decimal_places=2),
+            ),
+            date_paiement=Subquery(paiements.annotate(derniere=Max('date_paiement')).values('derniere')),
+            updated_at=timezone.now(),
+        )
+        # Statut calculé sur le montant_paye qui vient d'être écrit (mêmes règles que Invoice.appliquer_sous_total)
+        factures.update(statut=Case(
+            When(montant_paye__gte=F('montant_total'), then=Value('paye')),
+            When(montant_paye__gt=0, then=Value('partiel')),
+            default=Value('impaye'),
+            output_field=CharField(),
+        ))
+
+        nouveaux = dict(factures.values_list('pk', 'montant_paye'))
+        enregistrer_mouvements([
+            (client_id, ancien - nouveaux[pk], 'paiement', pk)
+            for pk, client_id, ancien in anciens
+        ])
+
+
+def _inserer(paiements):
+    """
+    Une tentative d'enregistrement, dans sa propre transaction ; retourne (paiements
+    insérés, {clé: id}). Lève IntegrityError si une clé vient d'être prise par une
+    requête concurrente.
+    """
+    with transaction.atomic():
+        existants = _doublons(paiements)
+        nouveaux = []
+        for p in paiements:
+            deja = existants.get(p.cle_idempotence)
+            if deja and (deja[1] != p.facture_id or deja[2] != p.montant):
+                raise ValidationError(
+                    f"Clé d'idempotence {p.cle_idempotence} déjà utilisée pour un autre paiement"
+                )
+            if deja:
+                continue
+            # Même clé répétée dans le lot : seule la première occurrence est enregistrée
+            existants[p.cle_idempotence] = (None, p.facture_id, p.montant)
+            nouveaux.append(p)
+        Payment.objects.bulk_create(nouveaux)
+
+        synchroniser_montants_payes({p.facture_id for p in nouveaux})
+
+        # Identifiants relus par clé : tous les SGBD ne les renvoient pas après un bulk_create
+        ids = dict(
+            Payment.objects.filter(cle_idempotence__in=[p.cle_idempotence for p in paiements])
+            .values_list('cle_idempotence', 'id')
+        )
+    return nouveaux, ids
+
+
+def enregistrer_paiements(donnees, user=None):
+    """
+    Enregistre un lot de paiements en une transaction (tout ou rien).
+    donnees : liste de dicts {facture, montant, mode, reference, cle_idempotence, date_paiement}.
+    Un paiement dont la clé est déjà connue n'est pas recompté et revient marqué 'doublon'.
+    Retourne une liste de résultats {facture, montant, cle_idempotence, paiement_id, doublon}.
+    À appeler hors transaction : la relecture après un conflit de clé doit voir la ligne
+    validée par l'autre requête.
+    """
+    paiements = _preparer(donnees, user)
+    # Clé serveur pour les paiements qui n'en ont pas : sert à relire leur identifiant
+    generees = set()
+    for p in paiements:
+        if not p.cle_idempotence:
+            p.cle_idempotence = uuid.uuid4().hex
+            generees.add(id(p))
+
+    try:
+        nouveaux, ids = _inserer(paiements)
+    except IntegrityError:
+        # Même clé insérée entre-temps par une requête concurrente : nouvelle transaction, dont
+        # l'instantané voit la ligne validée (REPEATABLE READ), le paiement ressort en doublon
+        nouveaux, ids = _inserer(paiements)
+
+    crees = {id(p) for p in nouveaux}
+    return [
+        {
+            'facture': p.facture_id,
+            'montant': str(p.montant),
+            'cle_idempotence': None if id(p) in generees else p.cle_idempotence,
+            'paiement_id': ids[p.cle_idempotence],
+            'doublon': id(p) not in crees,
+        }
+        for p in paiements
+    ]
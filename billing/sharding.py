@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+"""
+Exécution parallèle des commandes de facturation : le travail est découpé en
+tranches d'identifiants de réservation, confiées à un pool de processus.
+Chaque processus ouvre sa propre connexion à la base ; les résultats de chaque
+tranche reviennent au processus parent. Une tranche en échec est relancée :
+les traitements confiés ici doivent être rejouables (la contrainte unique des
+nuitées écarte celles déjà postées).
+"""
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from django.db import connections
+
+
+def decouper_en_tranches(ids, nb_tranches):
+    """
+    Découpe une liste triée d'identifiants en au plus nb_tranches intervalles (min, max)
+    contenant à peu près le même nombre d'éléments.
+    """
+    ids = list(ids)
+    if not ids:
+        return []
+    nb_tranches = max(1, min(nb_tranches, len(ids)))
+    taille, reste = divmod(len(ids), nb_tranches)
+    tranches, debut = [], 0
+    for i in range(nb_tranches):
+        fin = debut + taille + (1 if i < reste else 0)
+        tranches.append((ids[debut], ids[fin - 1]))
+        debut = fin
+    return tranches
+
+
+def _initialiser_worker():
+    """Processus fils : Django prêt (démarrage 'spawn') et aucune connexion héritée du parent"""
+    import django
+    from django.apps import apps
+
+    if not apps.ready:
+        django.setup()
+    # Les connexions copiées par fork appartiennent au parent : les oublier sans les fermer
+    for alias in connections:
+        connections[alias].connection = None
+
+
+def _executer_tranche(fonction, tranche, kwargs):
+    try:
+        return fonction(tranche=tranche, **kwargs)
+    finally:
+        connections.close_all()
+
+
+def executer_par_tranches(fonction, tranches, workers=1, tentatives=2, **kwargs):
+    """
+    Appelle fonction(tranche=(min, max), **kwargs) pour chaque tranche, dans workers processus.
+    fonction doit être définie au niveau d'un module (sérialisable) et rejouable sans doublon.
+    Retourne (résultats {tranche: résultat}, échecs {tranche: exception}) ; les échecs sont
+    les tranches encore en erreur après toutes les tentatives.
+    """
+    resultats, echecs = {}, {}
+    a_faire = list(tranches)
+
+    for tentative in range(tentatives):
+        if not a_faire:
+            break
+        if workers <= 1:
+            for tranche in a_faire:
+                try:
+                    resultats[tranche] = fonction(tranche=tranche, **kwargs)
+                except Exception as e:
+                    echecs[tranche] = e
+        else:
+            # Fermer les connexions du parent avant de créer les processus fils
+            connections.close_all()
+            # Un nouveau pool à chaque tentative : un fils mort rend le précédent inutilisable
+            with ProcessPoolExecutor(max_workers=min(workers, len(a_faire)), initializer=_initialiser_worker) as pool:
+                futures = {pool.submit(_executer_tranche, fonction, tranche, kwargs): tranche for tranche in a_faire}
+                for future in as_completed(futures):
+                    tranche = futures[future]
+                    try:
+                        resultats[tranche] = future.result()
+                    except Exception as e:
+                        echecs[tranche] = e
+        a_faire = [tranche for tranche in a_faire if tranche not in resultats]
+
+    return resultats, {tranche: echecs[tranche] for tranche in a_faire}
@@ -1,3 +1,621 @@
-from django.test import TestCase
+import datetime
+import json
+import os
+import shutil
+import tempfile
+import zipfile
+from decimal import Decimal
+from io import BytesIO, StringIO
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth import get_user_model
+from django.core.management import CommandError, call_command
+from django.db import transaction
+from django.db.models import Sum
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from clients.models import Client
+from reservations.models import Reservation
+from rooms.models import Room, RoomCategory
+from . import documents, numbering
+from .folios import facturer_nuitees
+from .ledger import recalculer_soldes
+from .models import Invoice, InvoiceLine, InvoiceSequence, MouvementSolde, Payment
+from .sharding import decouper_en_tranches, executer_par_tranches
+from .views import InvoiceListView
+
+
+class InvoiceFormViewTests(TestCase):
+    """Création / modification d'une facture avec ses lignes depuis l'interface"""
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(username='caissier', password='secret')
+        self.client.force_login(self.user)
+        self.client_hotel = Client.objects.create(nom='Dupont', email='dupont@example.com')
+
+    def _formset(self, lignes, initiales=0):
+        donnees = {
+            'lines-TOTAL_FORMS': str(len(lignes)),
+            'lines-INITIAL_FORMS': str(initiales),
+            'lines-MIN_NUM_FORMS': '0',
+            'lines-MAX_NUM_FORMS': '1000',
+        }
+        for index, ligne in enumerate(lignes):
+            for champ, valeur in ligne.items():
+                donnees[f'lines-{index}-{champ}'] = valeur
+        return donnees
+
+    def assertCoherent(self, facture, total_attendu):
+        client = Client.objects.get(pk=self.client_hotel.pk)
+        journal = MouvementSolde.objects.filter(client=client).aggregate(s=Sum('montant'))['s']
+        self.assertEqual(facture.montant_total, total_attendu)
+        self.assertEqual(client.solde, facture.montant_total - facture.montant_paye)
+        self.assertEqual(journal, client.solde)
+
+    def test_creation_puis_modification(self):
+        donnees = {'client': self.client_hotel.pk, 'reservation': ''}
+        donnees.update(self._formset([
+            {'description': 'Blanchisserie', 'quantite': '2', 'prix_unitaire': '100', 'service': ''},
+            {'description': 'Minibar', 'quantite': '1', 'prix_unitaire': '50', 'service': ''},
+        ]))
+        response = self.client.post(reverse('invoice_add'), donnees)
+        self.assertRedirects(response, reverse('invoice_list'), fetch_redirect_response=False)
+
+        facture = Invoice.objects.get(client=self.client_hotel)
+        # 250 + TVA 18 %
+        self.assertEqual(facture.statut, 'impaye')
+        self.assertCoherent(facture, Decimal('295.00'))
+
+        ligne_1, ligne_2 = facture.lines.order_by('pk')
+        donnees = {'client': self.client_hotel.pk, 'reservation': ''}
+        donnees.update(self._formset([
+            {'id': ligne_1.pk, 'facture': facture.pk, 'description': 'Blanchisserie', 'quantite': '3', 'prix_unitaire': '100', 'service': ''},
+            {'id': ligne_2.pk, 'facture': facture.pk, 'description': 'Minibar', 'quantite': '1', 'prix_unitaire': '50', 'service': '', 'DELETE': 'on'},
+            {'description': 'Petit-déjeuner', 'quantite': '1', 'prix_unitaire': '200', 'service': ''},
+        ], initiales=2))
+        response = self.client.post(reverse('invoice_edit', args=[facture.pk]), donnees)
+        self.assertRedirects(response, reverse('invoice_list'), fetch_redirect_response=False)
+
+        # 300 + 200 = 500 + TVA 18 %
+        facture.refresh_from_db()
+        self.assertEqual(facture.lines.count(), 2)
+        self.assertCoherent(facture, Decimal('590.00'))
+
+
+class PaiementTests(TestCase):
+    """Paiements idempotents : API unitaire, lots et formulaire"""
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(username='caissier', password='secret')
+        self.client.force_login(self.user)
+        self.client_hotel = Client.objects.create(nom='Dupont', email='dupont@example.com')
+        self.facture = Invoice.objects.create(client=self.client_hotel)
+        InvoiceLine.objects.create(facture=self.facture, description='Nuitée', quantite=1, prix_unitaire=Decimal('10000'))
+        self.facture.refresh_from_db()
+
+    def post(self, url_name, corps):
+        return self.client.post(reverse(url_name), json.dumps(corps), content_type='application/json')
+
+    def assertSoldeCoherent(self):
+        client = Client.objects.get(pk=self.client_hotel.pk)
+        journal = MouvementSolde.objects.filter(client=client).aggregate(s=Sum('montant'))['s']
+        self.assertEqual(journal, client.solde)
+        return client.solde
+
+    def test_rejeu_renvoie_le_paiement_initial(self):
+        corps = {'facture': self.facture.pk, 'montant': '5000', 'mode': 'cash', 'cle_idempotence': 'cle-1'}
+        premiere = self.post('paiement_api', corps)
+        seconde = self.post('paiement_api', corps)
+
+        self.assertEqual((premiere.status_code, seconde.status_code), (201, 200))
+        self.assertTrue(seconde.json()['paiement']['doublon'])
+        self.assertEqual(seconde.json()['paiement']['paiement_id'], premiere.json()['paiement']['paiement_id'])
+        self.assertEqual(Payment.objects.count(), 1)
+        self.facture.refresh_from_db()
+        self.assertEqual(self.facture.montant_paye, Decimal('5000.00'))
+        self.assertEqual(self.assertSoldeCoherent(), Decimal('6800.00'))
+
+    def test_cle_reutilisee_pour_un_autre_montant(self):
+        self.post('paiement_api', {'facture': self.facture.pk, 'montant': '5000', 'cle_idempotence': 'cle-2'})
+        response = self.post('paiement_api', {'facture': self.facture.pk, 'montant': '4000', 'cle_idempotence': 'cle-2'})
+
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(Payment.objects.count(), 1)
+
+    def test_cle_et_reference_non_textuelles(self):
+        response = self.post('paiement_api', {'facture': self.facture.pk, 'montant': '100', 'cle_idempotence': 42, 'reference': 7})
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(Payment.objects.get().reference, '7')
+        # Même clé envoyée en texte : même paiement
+        response = self.post('paiement_api', {'facture': self.facture.pk, 'montant': '100', 'cle_idempotence': '42'})
+        self.assertEqual(response.status_code, 200)
+
+        response = self.post('paiement_api', {'facture': self.facture.pk, 'montant': '100', 'cle_idempotence': ['42']})
+        self.assertEqual(response.status_code, 400)
+        response = self.post('paiement_api', {'facture': self.facture.pk, 'montant': '100', 'mode': ['cash']})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(Payment.objects.count(), 1)
+
+    def test_lot_tout_ou_rien(self):
+        response = self.post('paiements_lot_api', {'paiements': [
+            {'facture': self.facture.pk, 'montant': '1000', 'cle_idempotence': 'lot-1'},
+            {'facture': self.facture.pk, 'montant': 'abc', 'cle_idempotence': 'lot-2'},
+        ]})
+
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(len(response.json()['erreurs']), 1)
+        self.assertFalse(Payment.objects.exists())
+        self.facture.refresh_from_db()
+        self.assertEqual(self.facture.montant_paye, Decimal('0'))
+        self.assertEqual(self.assertSoldeCoherent(), Decimal('11800.00'))
+
+    def test_double_soumission_du_formulaire(self):
+        formulaire = {'amount': '11800', 'mode': 'cash', 'reference': '', 'cle_idempotence': 'form-1'}
+        url = reverse('add_payment', args=[self.facture.pk])
+        self.client.post(url, formulaire)
+        self.client.post(url, formulaire)
+
+        self.assertEqual(Payment.objects.count(), 1)
+        self.facture.refresh_from_db()
+        self.assertEqual(self.facture.statut, 'paye')
+        self.assertEqual(self.assertSoldeCoherent(), Decimal('0'))
+
+
+class RebuildBillingTests(TestCase):
+    """Reconstruction des montants dérivés (rebuild_billing)"""
+
+    def setUp(self):
+        self.client_hotel = Client.objects.create(nom='Dupont', email='dupont@example.com')
+        self.facture = Invoice.objects.create(client=self.client_hotel)
+        InvoiceLine.objects.create(facture=self.facture, description='Blanchisserie', quantite=1, prix_unitaire=Decimal('20'))
+
+    def test_total_derive_corrige_sans_double_ajustement(self):
+        # Total faussé directement en base : le solde client, lui, est resté juste
+        Invoice.objects.filter(pk=self.facture.pk).update(montant_total=Decimal('46.20'))
+        mouvements = MouvementSolde.objects.count()
+
+        call_command('rebuild_billing', '--fix', stdout=StringIO())
+
+        self.facture.refresh_from_db()
+        client = Client.objects.get(pk=self.client_hotel.pk)
+        self.assertEqual(self.facture.montant_total, Decimal('23.60'))
+        self.assertEqual(client.solde, Decimal('23.60'))
+        self.assertEqual(MouvementSolde.objects.count(), mouvements)
+
+    def test_solde_derive_ajuste_une_fois(self):
+        Client.objects.filter(pk=self.client_hotel.pk).update(solde=Decimal('0'))
+        MouvementSolde.objects.filter(client=self.client_hotel).delete()
+
+        call_command('rebuild_billing', '--fix', stdout=StringIO())
+
+        client = Client.objects.get(pk=self.client_hotel.pk)
+        self.assertEqual(client.solde, Decimal('23.60'))
+        self.assertEqual(list(MouvementSolde.objects.values_list('montant', 'motif')), [(Decimal('23.60'), 'ajustement')])
+
+        sortie = StringIO()
+        call_command('rebuild_billing', '--check', stdout=sortie)
+        self.assertEqual(sortie.getvalue().count(', 0 écart(s)'), 2)
+
+
+    def test_mode_controle_sans_ecriture(self):
+        Invoice.objects.filter(pk=self.facture.pk).update(montant_total=Decimal('46.20'), statut='paye')
+
+        sortie = StringIO()
+        call_command('rebuild_billing', stdout=sortie)
+
+        self.assertIn('Factures : 1 contrôlé(s), 1 écart(s) détecté(s)', sortie.getvalue())
+        self.assertIn('montant_total 46.20 -> 23.60', sortie.getvalue())
+        self.assertEqual(Invoice.objects.get(pk=self.facture.pk).montant_total, Decimal('46.20'))
+
+    def test_paiements_et_statut_recalcules(self):
+        # Paiement inséré sans passer par le module de paiement : la facture ne le connaît pas
+        Payment.objects.create(facture=self.facture, montant=Decimal('10.00'))
+
+        call_command('rebuild_billing', '--fix', '--batch-size', '1', stdout=StringIO())
+
+        self.facture.refresh_from_db()
+        client = Client.objects.get(pk=self.client_hotel.pk)
+        journal = MouvementSolde.objects.filter(client=client).aggregate(s=Sum('montant'))['s']
+        self.assertEqual((self.facture.montant_paye, self.facture.statut), (Decimal('10.00'), 'partiel'))
+        self.assertEqual(client.solde, Decimal('13.60'))
+        self.assertEqual(journal, client.solde)
+
+class InvoiceLedgerTests(TestCase):
+    """Journal des soldes tenu par Invoice.save()"""
+
+    def setUp(self):
+        self.client_hotel = Client.objects.create(nom='Dupont', email='dupont@example.com')
+        self.facture = Invoice.objects.create(client=self.client_hotel)
+        InvoiceLine.objects.create(facture=self.facture, description='Nuitée', quantite=2, prix_unitaire=Decimal('50'))
+
+    def assertJournalEgalSolde(self, solde_attendu):
+        client = Client.objects.get(pk=self.client_hotel.pk)
+        journal = MouvementSolde.objects.filter(client=client).aggregate(s=Sum('montant'))['s']
+        self.assertEqual(client.solde, solde_attendu)
+        self.assertEqual(journal, client.solde)
+
+    def test_sauvegarde_avec_champs_differes(self):
+        mouvements = MouvementSolde.objects.count()
+        facture = Invoice.objects.only('notes').get(pk=self.facture.pk)
+        facture.notes = 'Client fidèle'
+        facture.save()
+
+        self.assertEqual(MouvementSolde.objects.exclude(montant=0).count(), mouvements)
+        self.assertJournalEgalSolde(Decimal('118.00'))
+
+    def test_paiement_et_remise(self):
+        facture = Invoice.objects.get(pk=self.facture.pk)
+        facture.remise = Decimal('10')
+        facture.calculer_totaux()
+        facture.save()
+        self.assertJournalEgalSolde(Decimal('106.20'))
+
+        facture = Invoice.objects.defer('montant_paye').get(pk=self.facture.pk)
+        facture.montant_paye = Decimal('6.20')
+        facture.save()
+        self.assertJournalEgalSolde(Decimal('100.00'))
+
+
+    def test_factures_concurrentes_du_meme_client(self):
+        # Deux caissiers sur deux factures du même client, chargées avant toute modification
+        autre = Invoice.objects.create(client=self.client_hotel)
+        premiere = Invoice.objects.get(pk=self.facture.pk)
+        seconde = Invoice.objects.get(pk=autre.pk)
+
+        premiere.montant_paye = Decimal('18.00')
+        premiere.save()
+        InvoiceLine.objects.create(facture=seconde, description='Minibar', quantite=1, prix_unitaire=Decimal('10'))
+
+        self.assertJournalEgalSolde(Decimal('111.80'))
+
+    def test_solde_reconstruit_depuis_le_journal(self):
+        Client.objects.filter(pk=self.client_hotel.pk).update(solde=Decimal('0'))
+
+        self.assertEqual(recalculer_soldes([self.client_hotel.pk]), 1)
+        self.assertJournalEgalSolde(Decimal('118.00'))
+        self.assertEqual(recalculer_soldes(), 0)
+
+class InvoiceListViewTests(TestCase):
+    """Liste des factures : pagination par clé et totaux de la sélection"""
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(username='comptable', password='secret')
+        self.client.force_login(self.user)
+        client_hotel = Client.objects.create(nom='Dupont', email='dupont@example.com')
+        for prix in ('100', '200', '300'):
+            facture = Invoice.objects.create(client=client_hotel)
+            InvoiceLine.objects.create(facture=facture, description='Minibar', quantite=1, prix_unitaire=Decimal(prix))
+
+    @mock.patch.object(InvoiceListView, 'par_page', 2)
+    def test_totaux_identiques_sur_chaque_page(self):
+        premiere = self.client.get(reverse('invoice_list'))
+        self.assertEqual(len(premiere.context['invoices']), 2)
+        totaux = premiere.context['totaux']
+        self.assertEqual(totaux['nombre'], 3)
+        self.assertEqual(totaux['total'], Decimal('708.00'))
+        self.assertEqual(totaux['du'], Decimal('708.00'))
+
+        seconde = self.client.get(reverse('invoice_list'), {'apres': premiere.context['curseur_suivant']})
+        self.assertEqual(len(seconde.context['invoices']), 1)
+        self.assertEqual(seconde.context['totaux'], totaux)
+
+        retour = self.client.get(reverse('invoice_list'), {'avant': seconde.context['curseur_precedent']})
+        self.assertEqual(
+            [f.pk for f in retour.context['invoices']], [f.pk for f in premiere.context['invoices']]
+        )
+        self.assertEqual(retour.context['totaux'], totaux)
+
+    def test_filtres_invalides_signales(self):
+        response = self.client.get(reverse('invoice_list'), {'date_debut': 'hier', 'statut': 'inconnu'})
+
+        self.assertEqual(response.context['invoices'], [])
+        self.assertEqual(response.context['totaux']['nombre'], 0)
+        self.assertContains(response, 'Filtres invalides')
+
+
+    @mock.patch.object(InvoiceListView, 'par_page', 1)
+    def test_parcours_complet_par_curseur(self):
+        # Deux factures émises le même jour : le départage se fait par identifiant
+        factures = list(Invoice.objects.order_by('pk'))
+        for facture, decalage in zip(factures, (3, 1, 1)):
+            Invoice.objects.filter(pk=facture.pk).update(date_emission=timezone.localdate() - datetime.timedelta(days=decalage))
+
+        vues, curseur = [], None
+        while True:
+            response = self.client.get(reverse('invoice_list'), {'apres': curseur} if curseur else {})
+            vues += [f.pk for f in response.context['invoices']]
+            curseur = response.context['curseur_suivant']
+            if curseur is None:
+                break
+
+        self.assertEqual(vues, [factures[2].pk, factures[1].pk, factures[0].pk])
+
+    def test_totaux_de_la_selection_filtree(self):
+        facture = Invoice.objects.get(montant_total=Decimal('236.00'))
+        facture.montant_paye = Decimal('236.00')
+        facture.save()
+
+        response = self.client.get(reverse('invoice_list'), {'impayees': 'on'})
+
+        self.assertEqual(len(response.context['invoices']), 2)
+        self.assertEqual(response.context['totaux'], {
+            'nombre': 2, 'total': Decimal('472.00'), 'paye': Decimal('0.00'), 'du': Decimal('472.00'),
+        })
+        # Curseur au-delà de la dernière facture : page vide, mêmes totaux
+        fin = self.client.get(reverse('invoice_list'), {'impayees': 'on', 'apres': '2000-01-01_1'})
+        self.assertEqual(fin.context['invoices'], [])
+        self.assertEqual(fin.context['totaux'], response.context['totaux'])
+
+class ChargeDailyRatesTestCase(TestCase):
+    """Deux séjours en cours, ouverts (check-in) il y a trois nuits"""
+
+    def setUp(self):
+        self.aujourdhui = timezone.now().date()
+        self.client_hotel = Client.objects.create(nom='Dupont', email='dupont@example.com')
+        categorie = RoomCategory.objects.create(nom='Standard', prix=Decimal('100.00'))
+        self.reservations = [
+            Reservation.objects.create(
+                client=self.client_hotel,
+                chambre=Room.objects.create(numero=numero, categorie=categorie),
+                date_debut=self.aujourdhui - datetime.timedelta(days=3),
+                date_fin=self.aujourdhui + datetime.timedelta(days=2),
+                statut='active',
+            )
+            for numero in ('101', '102')
+        ]
+
+    def charger(self, *args):
+        sortie = StringIO()
+        call_command('charge_daily_rates', *args, stdout=sortie)
+        return sortie.getvalue()
+
+    def nuitees(self):
+        return sorted(InvoiceLine.objects.filter(date_nuitee__isnull=False).values_list('reservation_id', 'date_nuitee'))
+
+    def assertFoliosCoherents(self):
+        for facture in Invoice.objects.filter(reservation__in=self.reservations):
+            self.assertEqual(facture.montant_total, Decimal('118.00') * facture.lines.count())
+        client = Client.objects.get(pk=self.client_hotel.pk)
+        journal = MouvementSolde.objects.filter(client=client).aggregate(s=Sum('montant'))['s']
+        self.assertEqual(client.solde, Invoice.objects.aggregate(s=Sum('montant_total'))['s'])
+        self.assertEqual(journal, client.solde)
+
+
+class ChargeDailyRatesTests(ChargeDailyRatesTestCase):
+    """Moteur de facturation des nuitées : rejouable sans doublon"""
+
+    def test_relance_ne_poste_rien(self):
+        self.assertIn('2 nuitée(s) facturée(s)', self.charger())
+        self.assertIn('0 nuitée(s) facturée(s)', self.charger())
+
+        self.assertEqual(InvoiceLine.objects.filter(date_nuitee=self.aujourdhui).count(), 2)
+        self.assertEqual(len(self.nuitees()), 4)
+        self.assertFoliosCoherents()
+
+    def test_nuitee_deja_postee_ignoree(self):
+        # Nuitée postée entre-temps par un autre processus : la contrainte (réservation, nuit) l'écarte
+        from .folios import nuitees_a_facturer, poster_nuitees
+
+        nuitees, _ = nuitees_a_facturer(self.aujourdhui, self.aujourdhui)
+        poster_nuitees(nuitees)
+        poster_nuitees(nuitees)
+
+        self.assertEqual(InvoiceLine.objects.filter(date_nuitee=self.aujourdhui).count(), 2)
+        self.assertFoliosCoherents()
+
+    def test_reservation_sans_facture_ouverte(self):
+        Invoice.objects.filter(reservation=self.reservations[1]).update(statut='paye')
+
+        sortie = self.charger()
+
+        self.assertIn(f"Aucune facture impayée trouvée pour la réservation active #{self.reservations[1].pk}", sortie)
+        self.assertEqual(InvoiceLine.objects.filter(date_nuitee=self.aujourdhui).count(), 1)
+
+
+class ChargeDailyRatesModesTests(ChargeDailyRatesTestCase):
+    """Périodes, rattrapage et simulation"""
+
+    def jour(self, decalage):
+        return self.aujourdhui + datetime.timedelta(days=decalage)
+
+    def test_rattrapage(self):
+        self.charger('--catch-up')
+
+        # Première nuit postée au check-in, puis les trois nuits manquantes jusqu'à aujourd'hui
+        for reservation in self.reservations:
+            self.assertEqual(
+                [nuit for pk, nuit in self.nuitees() if pk == reservation.pk],
+                [self.jour(-3), self.jour(-2), self.jour(-1), self.jour(0)],
+            )
+        self.assertIn('0 nuitée(s) facturée(s)', self.charger('--catch-up'))
+        self.assertFoliosCoherents()
+
+    def test_periode(self):
+        self.charger('--from', self.jour(-2).isoformat(), '--to', self.jour(-2).isoformat())
+
+        self.assertEqual(InvoiceLine.objects.filter(date_nuitee=self.jour(-2)).count(), 2)
+        self.assertFalse(InvoiceLine.objects.filter(date_nuitee__in=[self.jour(-1), self.jour(0)]).exists())
+        self.assertFoliosCoherents()
+
+    def test_simulation(self):
+        lignes = InvoiceLine.objects.count()
+        mouvements = MouvementSolde.objects.count()
+
+        sortie = self.charger('--catch-up', '--dry-run')
+
+        self.assertIn('[Simulation] 6 nuitée(s)', sortie)
+        self.assertEqual(InvoiceLine.objects.count(), lignes)
+        self.assertEqual(MouvementSolde.objects.count(), mouvements)
+
+    def test_parametres_refuses(self):
+        with self.assertRaises(CommandError):
+            self.charger('--to', self.jour(1).isoformat())
+        with self.assertRaises(CommandError):
+            self.charger('--from', self.jour(0).isoformat(), '--to', self.jour(-1).isoformat())
+        with self.assertRaises(CommandError):
+            self.charger('--from', '01/01/2026')
+
+
+class NumerotationTests(TestCase):
+    """Numéros de facture par séquence annuelle : ni trou ni doublon"""
+
+    def setUp(self):
+        self.annee = timezone.now().year
+        self.client_hotel = Client.objects.create(nom='Dupont', email='dupont@example.com')
+        numbering._blocs.clear()
+        self.addCleanup(numbering._blocs.clear)
+
+    def test_numeros_consecutifs(self):
+        for _ in range(3):
+            Invoice.objects.create(client=self.client_hotel)
+
+        self.assertEqual(
+            sorted(Invoice.objects.values_list('numero_facture', flat=True)),
+            [numbering.formater_numero(self.annee, n) for n in (1, 2, 3)],
+        )
+        # Lot réservé d'un coup (ouverture des folios) : la suite de la même séquence
+        self.assertEqual(numbering.allouer_numeros(2), [numbering.formater_numero(self.annee, n) for n in (4, 5)])
+        self.assertEqual(InvoiceSequence.objects.get(annee=self.annee).dernier_numero, 5)
+
+    def test_rollback_ne_laisse_pas_de_trou(self):
+        with self.assertRaises(RuntimeError), transaction.atomic():
+            Invoice.objects.create(client=self.client_hotel)
+            raise RuntimeError
+
+        facture = Invoice.objects.create(client=self.client_hotel)
+        self.assertEqual(facture.numero_facture, numbering.formater_numero(self.annee, 1))
+
+    def test_sequence_reprend_apres_les_factures_existantes(self):
+        Invoice.objects.create(client=self.client_hotel, numero_facture=numbering.formater_numero(self.annee, 41))
+        Invoice.objects.create(client=self.client_hotel, numero_facture='FACT-ANCIEN-7')
+
+        self.assertEqual(numbering.allouer_numeros(2), [
+            numbering.formater_numero(self.annee, 42), numbering.formater_numero(self.annee, 43),
+        ])
+
+    @override_settings(INVOICE_NUMBER_BLOCK_SIZE=10)
+    def test_bloc_consomme_en_memoire(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            premiers = numbering.allouer_numeros(2)
+        with self.assertNumQueries(0):
+            suivants = numbering.allouer_numeros(8)
+        dernier = numbering.allouer_numeros(1)
+
+        numeros = premiers + suivants + dernier
+        self.assertEqual(numeros, [numbering.formater_numero(self.annee, n) for n in range(1, 12)])
+        self.assertEqual(InvoiceSequence.objects.get(annee=self.annee).dernier_numero, 20)
+
+
+def _en_processus_courant(fonction, tranches, workers=1, **kwargs):
+    """executer_par_tranches sans pool de processus : les fils ne voient pas la transaction du test"""
+    return executer_par_tranches(fonction, tranches, workers=1, **kwargs)
+
+
+class ExecutionParTranchesTests(ChargeDailyRatesTestCase):
+    """Découpage en tranches d'identifiants et reprise des tranches en échec"""
+
+    def test_decoupage(self):
+        self.assertEqual(decouper_en_tranches(range(1, 11), 3), [(1, 4), (5, 7), (8, 10)])
+        self.assertEqual(decouper_en_tranches([3, 9], 8), [(3, 3), (9, 9)])
+        self.assertEqual(decouper_en_tranches([], 4), [])
+
+    def test_tranche_relancee(self):
+        appels = []
+
+        def traiter(tranche):
+            appels.append(tranche)
+            if appels.count(tranche) == 1 and tranche == (1, 1):
+                raise RuntimeError('connexion perdue')
+            return tranche[0]
+
+        resultats, echecs = executer_par_tranches(traiter, [(1, 1), (2, 2)])
+
+        self.assertEqual(resultats, {(1, 1): 1, (2, 2): 2})
+        self.assertEqual(echecs, {})
+        self.assertEqual(appels, [(1, 1), (2, 2), (1, 1)])
+
+    @mock.patch('billing.management.commands.charge_daily_rates.executer_par_tranches', _en_processus_courant)
+    def test_commande_par_tranches(self):
+        sortie = self.charger('--catch-up', '--workers', '2')
+
+        self.assertIn('6 nuitée(s) facturée(s) en 2 tranche(s)', sortie)
+        self.assertEqual(len(self.nuitees()), 8)
+        self.assertIn('0 nuitée(s) facturée(s)', self.charger('--catch-up', '--workers', '2'))
+        self.assertFoliosCoherents()
+
+    @mock.patch('billing.management.commands.charge_daily_rates.executer_par_tranches', _en_processus_courant)
+    def test_tranche_en_echec_rejouable(self):
+        premiere = self.reservations[0].pk
+
+        def facturer(tranche, **kwargs):
+            if tranche[0] == premiere:
+                raise RuntimeError('panne')
+            return facturer_nuitees(tranche=tranche, **kwargs)
+
+        with mock.patch('billing.management.commands.charge_daily_rates.facturer_nuitees', facturer):
+            with self.assertRaisesMessage(CommandError, '1 tranche(s) en échec'):
+                self.charger('--catch-up', '--workers', '2')
+        self.assertEqual([pk for pk, nuit in self.nuitees()].count(premiere), 1)
+
+        self.charger('--catch-up', '--workers', '2')
+        self.assertEqual(len(self.nuitees()), 8)
+        self.assertFoliosCoherents()
+
+
+class DocumentFactureTests(TestCase):
+    """Documents de facture en cache adressé par contenu"""
+
+    def setUp(self):
+        media = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media, ignore_errors=True)
+        reglages = override_settings(MEDIA_ROOT=media)
+        reglages.enable()
+        self.addCleanup(reglages.disable)
+        self.dossier = os.path.join(media, 'factures')
+
+        self.user = get_user_model().objects.create_user(username='caissier', password='secret')
+        self.client.force_login(self.user)
+        self.client_hotel = Client.objects.create(nom='Dupont', email='dupont@example.com')
+        self.facture = Invoice.objects.create(client=self.client_hotel)
+        InvoiceLine.objects.create(facture=self.facture, description='Blanchisserie', quantite=1, prix_unitaire=Decimal('20'))
+
+    def fichiers(self):
+        return sorted(os.listdir(os.path.join(self.dossier, str(self.facture.pk))))
+
+    def document(self, **entetes):
+        return self.client.get(reverse('invoice_document', args=[self.facture.pk]), {'format': 'html'}, **entetes)
+
+    def test_rendu_une_seule_fois(self):
+        with mock.patch('billing.documents._rendre', wraps=documents._rendre) as rendre:
+            premiere = self.document()
+            seconde = self.document()
+
+        self.assertEqual(rendre.call_count, 1)
+        self.assertEqual(premiere.content, seconde.content)
+        self.assertIn(b'Blanchisserie', premiere.content)
+        self.assertEqual(self.fichiers(), [premiere['ETag'].strip('"')])
+        self.assertEqual(self.document(HTTP_IF_NONE_MATCH=premiere['ETag']).status_code, 304)
+
+    def test_facture_modifiee_rendue_et_ancien_document_purge(self):
+        ancien = self.document()['ETag']
+        InvoiceLine.objects.create(facture=self.facture, description='Minibar', quantite=1, prix_unitaire=Decimal('5'))
+
+        response = self.document(HTTP_IF_NONE_MATCH=ancien)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], ancien)
+        self.assertIn(b'Minibar', response.content)
+        self.assertEqual(self.fichiers(), [response['ETag'].strip('"')])
+
+    def test_export_zip(self):
+        autre = Invoice.objects.create(client=self.client_hotel)
+
+        response = self.client.get(reverse('invoice_export'), {'format': 'html'})
+
+        archive = zipfile.ZipFile(BytesIO(b''.join(response.streaming_content)))
+        self.assertEqual(
+            sorted(archive.namelist()), sorted(f'{f.numero_facture}.html' for f in (self.facture, autre))
+        )
+        self.assertIn(b'Blanchisserie', archive.read(f'{self.facture.numero_facture}.html'))
@@ -1,9 +1,13 @@
 from django.urls import path
-from .views import InvoiceListView, InvoiceCreateView, InvoiceUpdateView, add_payment
+from .views import InvoiceListView, InvoiceCreateView, InvoiceUpdateView, add_payment, paiement_api, paiements_lot_api, invoice_document, invoice_export
 
 urlpatterns = [
     path('', InvoiceListView.as_view(), name='invoice_list'),
     path('add/', InvoiceCreateView.as_view(), name='invoice_add'),
     path('<int:pk>/edit/', InvoiceUpdateView.as_view(), name='invoice_edit'),
     path('<int:invoice_id>/add_payment/', add_payment, name='add_payment'),
+    path('<int:pk>/document/', invoice_document, name='invoice_document'),
+    path('export/', invoice_export, name='invoice_export'),
+    path('paiements/', paiement_api, name='paiement_api'),
+    path('paiements/lot/', paiements_lot_api, name='paiements_lot_api'),
 ]
@@ -1,12 +1,25 @@
 from django.shortcuts import render, redirect, get_object_or_404
-from django.utils import timezone
 from django.contrib import messages
 from django.views.generic import ListView, CreateView, UpdateView
 from django.urls import reverse_lazy
-from django.forms import inlineformset_factory
+from django.db import transaction
+from django.db.models import Count, Sum, Max, F, Q, Window, DecimalField
+from django.core.exceptions import ValidationError
+from django.http import JsonResponse, HttpResponse, HttpResponseNotModified, StreamingHttpResponse
+from django.views.decorators.http import require_POST, require_GET
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth.mixins import LoginRequiredMixin
-from .models import Invoice, InvoiceLine
+from .models import Invoice, Payment
+from .forms import InvoiceLineFormSet, InvoiceFilterForm
+from .payments import enregistrer_paiements, MODES_PAIEMENT
+from .documents import document_facture, empreinte, factures_a_rendre, formats_disponibles, nom_fichier, zip_factures
+from settings.models import AppSettings
+from datetime import datetime
+from decimal import Decimal
+import json
+import uuid
+
+PAIEMENTS_LOT_MAX = 1000
 
 @login_required
 def add_payment(request, invoice_id):
@@ -14,26 +27,261 @@ def add_payment(request, invoice_id):
     if request.method == 'POST':
         amount = request.POST.get('amount')
         if amount:
-            invoice.montant_paye += float(amount)
-            invoice.date_paiement = timezone.now().date()
-            invoice.calculer_totaux()
-            invoice.save()
-            messages.success(request, f"Paiement de {amount} ajouté à la facture {invoice.numero_facture}.")
-            return redirect('invoice_list')
-    return render(request, 'billing/add_payment.html', {'invoice': invoice})
+            try:
+                # Clé générée à l'affichage du formulaire : une double soumission n'est comptée qu'une fois
+                resultat = enregistrer_paiements([{
+                    'facture': invoice.pk,
+                    'montant': amount,
+                    'mode': request.POST.get('mode') or 'cash',
+                    'reference': request.POST.get('reference', ''),
+                    'cle_idempotence': request.POST.get('cle_idempotence'),
+                }], user=request.user)[0]
+            except ValidationError as e:
+                messages.error(request, ' '.join(e.messages))
+            else:
+                if resultat['doublon']:
+                    messages.info(request, f"Ce paiement a déjà été enregistré sur la facture {invoice.numero_facture}.")
+                else:
+                    messages.success(request, f"Paiement de {resultat['montant']} ajouté à la facture {invoice.numero_facture}.")
+                return redirect('invoice_list')
+    return render(request, 'billing/add_payment.html', {
+        'invoice': invoice,
+        'modes': [choix for choix in Payment.MODE_CHOICES if choix[0] in MODES_PAIEMENT],
+        'cle_idempotence': uuid.uuid4().hex,
+    })
+
+
+def _etat_facture(facture_id):
+    facture = Invoice.objects.only('numero_facture', 'montant_total', 'montant_paye', 'statut').get(pk=facture_id)
+    return {
+        'id': facture.pk,
+        'numero_facture': facture.numero_facture,
+        'montant_total': str(facture.montant_total),
+        'montant_paye': str(facture.montant_paye),
+        'reste_a_payer': str(facture.reste_a_payer),
+        'statut': facture.statut,
+    }
+
+
+@login_required
+@require_POST
+def paiement_api(request):
+    """
+    Enregistre un paiement. Corps JSON :
+    {"facture": id, "montant": "15000.00", "mode": "mobile_money", "reference": "...",
+     "cle_idempotence": "..."} ; la clé peut aussi être passée dans l'en-tête Idempotency-Key.
+    Répond 201 si le paiement est créé, 200 s'il avait déjà été reçu.
+    """
+    try:
+        data = json.loads(request.body)
+        if not isinstance(data, dict):
+            raise ValueError
+    except ValueError:
+        return JsonResponse({'success': False, 'error': 'Corps JSON invalide'}, status=400)
+    data.setdefault('cle_idempotence', request.headers.get('Idempotency-Key'))
+
+    try:
+        resultat = enregistrer_paiements([data], user=request.user)[0]
+    except ValidationError as e:
+        return JsonResponse({'success': False, 'error': ' '.join(e.messages)}, status=400)
+
+    return JsonResponse({
+        'success': True,
+        'paiement': resultat,
+        'facture': _etat_facture(resultat['facture']),
+    }, status=200 if resultat['doublon'] else 201)
+
+
+@login_required
+@require_POST
+def paiements_lot_api(request):
+    """
+    Enregistre un lot de paiements (règlements carte / mobile money de fin de journée)
+    en une transaction : {"paiements": [{...}, ...]}. Si une entrée est invalide, rien n'est enregistré.
+    """
+    try:
+        data = json.loads(request.body)
+        paiements = data['paiements']
+        if not isinstance(paiements, list) or not all(isinstance(p, dict) for p in paiements):
+            raise TypeError
+    except (ValueError, KeyError, TypeError):
+        return JsonResponse({'success': False, 'error': 'Corps JSON invalide : {"paiements": [...]}'}, status=400)
+    if not paiements:
+        return JsonResponse({'success': False, 'error': 'Aucun paiement'}, status=400)
+    if len(paiements) > PAIEMENTS_LOT_MAX:
+        return JsonResponse({'success': False, 'error': f'{PAIEMENTS_LOT_MAX} paiements maximum par lot'}, status=400)
+
+    try:
+        resultats = enregistrer_paiements(paiements, user=request.user)
+    except ValidationError as e:
+        return JsonResponse({'success': False, 'error': ' '.join(e.messages), 'erreurs': e.messages}, status=400)
+
+    return JsonResponse({
+        'success': True,
+        'enregistres': sum(1 for r in resultats if not r['doublon']),
+        'doublons': sum(1 for r in resultats if r['doublon']),
+        'resultats': resultats,
+    }, status=201)
+
+
+def _extension_demandee(request):
+    extension = request.GET.get('format') or formats_disponibles()[0]
+    # PDF indisponible (xhtml2pdf non installé) : repli sur le HTML imprimable
+    return extension if extension in formats_disponibles() else 'html'
+
+
+@login_required
+@require_GET
+def invoice_document(request, pk):
+    """Facture au format PDF (ou HTML), servie depuis le cache tant qu'elle n'a pas changé"""
+    facture = get_object_or_404(factures_a_rendre(Invoice.objects.all()), pk=pk)
+    extension = _extension_demandee(request)
+    parametres = AppSettings.load()
+
+    etag = f'"{empreinte(facture, parametres)}.{extension}"'
+    if request.headers.get('If-None-Match') == etag:
+        return HttpResponseNotModified()
+
+    cle, contenu = document_facture(facture, extension, parametres)
+    response = HttpResponse(
+        contenu,
+        content_type='application/pdf' if extension == 'pdf' else 'text/html; charset=utf-8',
+    )
+    response['ETag'] = etag
+    if extension == 'pdf':
+        response['Content-Disposition'] = f'inline; filename="{nom_fichier(facture, extension)}"'
+    return response
+
+
+@login_required
+@require_GET
+def invoice_export(request):
+    """
+    Archive ZIP des factures filtrées (mêmes filtres que la liste : statut, client,
+    date_debut / date_fin d'émission, impayees), envoyée au fil du rendu.
+    """
+    filtres = InvoiceFilterForm(request.GET)
+    if not filtres.is_valid():
+        return JsonResponse({'success': False, 'error': 'Filtres invalides : dates YYYY-MM-DD'}, status=400)
+    factures = filtres.filtrer(Invoice.objects.order_by('pk'))
+
+    extension = _extension_demandee(request)
+    response = StreamingHttpResponse(zip_factures(factures, extension), content_type='application/zip')
+    response['Content-Disposition'] = f'attachment; filename="factures_{datetime.now():%Y%m%d_%H%M}.zip"'
+    return response
+
+
+def _lire_curseur(valeur):
+    """Curseur de pagination 'YYYY-MM-DD_id' -> (date, id), ou None s'il est absent ou invalide"""
+    try:
+        date_emission, pk = valeur.split('_')
+        return datetime.strptime(date_emission, '%Y-%m-%d').date(), int(pk)
+    except (AttributeError, ValueError):
+        return None
+
+
+def _curseur(facture):
+    return f"{facture.date_emission:%Y-%m-%d}_{facture.pk}"
 
 
 class InvoiceListView(LoginRequiredMixin, ListView):
+    """
+    Liste paginée par clé (date d'émission, id) : chaque page coûte une requête bornée,
+    quel que soit son rang. Les totaux de la sélection sont lus dans la même requête
+    (fonctions de fenêtre sur les factures filtrées). Des filtres invalides ne renvoient
+    aucune facture et sont signalés.
+    """
     model = Invoice
     template_name = 'billing/invoice_list.html'
     context_object_name = 'invoices'
+    par_page = 50
+
+    def get(self, request, *args, **kwargs):
+        self.filtres = InvoiceFilterForm(request.GET)
+        return super().get(request, *args, **kwargs)
+
+    def factures_filtrees(self):
+        if not self.filtres.is_valid():
+            return Invoice.objects.none()
+        return self.filtres.filtrer(Invoice.objects.all())
+
+    def get_queryset(self):
+        montant = DecimalField(max_digits=14, decimal_places=2)
+        factures = self.factures_filtrees().select_related('client').annotate(
+            reste_du=F('montant_total') - F('montant_paye'),
+            # Fenêtres sur toute la sélection, calculées avant la condition de page
+            total_nombre=Window(Count('id')),
+            total_montant=Window(Sum('montant_total'), output_field=montant),
+            total_paye=Window(Sum('montant_paye'), output_field=montant),
+            total_du=Window(Sum(F('montant_total') - F('montant_paye')), output_field=montant),
+            # Copie de la date d'émission en fenêtre : la condition de page qui la référence
+            # est alors appliquée après le calcul des totaux (requête englobante)
+            emission=Window(Max('date_emission'), partition_by=F('pk')),
+        )
+        apres = _lire_curseur(self.request.GET.get('apres'))
+        avant = _lire_curseur(self.request.GET.get('avant'))
+
+        if avant:
+            # Page précédente : lire vers les factures plus récentes puis remettre dans l'ordre d'affichage
+            date_emission, pk = avant
+            page = list(factures.filter(
+                Q(emission__gt=date_emission) | Q(emission=date_emission, pk__gt=pk)
+            ).order_by('date_emission', 'pk')[:self.par_page + 1])
+            self.page_precedente = len(page) > self.par_page
+            self.page_suivante = True
+            page = page[:self.par_page][::-1]
+        else:
+            if apres:
+                date_emission, pk = apres
+                factures = factures.filter(
+                    Q(emission__lt=date_emission) | Q(emission=date_emission, pk__lt=pk)
+                )
+            page = list(factures.order_by('-date_emission', '-pk')[:self.par_page + 1])
+            self.page_precedente = apres is not None
+            self.page_suivante = len(page) > self.par_page
+            page = page[:self.par_page]
+        return page
+
+    def totaux(self, page):
+        """Totaux de la sélection, lus sur la première facture de la page"""
+        if page:
+            facture = page[0]
+            totaux = {
+                'nombre': facture.total_nombre,
+                'total': facture.total_montant,
+                'paye': facture.total_paye,
+                'du': facture.total_du,
+            }
+        else:
+            # Page vide (curseur au-delà de la fin) : agrégation séparée
+            totaux = self.factures_filtrees().aggregate(
+                nombre=Count('id'),
+                total=Sum('montant_total'),
+                paye=Sum('montant_paye'),
+                du=Sum(F('montant_total') - F('montant_paye')),
+            )
+        centime = Decimal('0.01')
+        return {
+            cle: valeur if cle == 'nombre' else Decimal(valeur or 0).quantize(centime)
+            for cle, valeur in totaux.items()
+        }
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        page = context['invoices']
+
+        parametres = self.request.GET.copy()
+        for cle in ('apres', 'avant'):
+            parametres.pop(cle, None)
 
-InvoiceLineFormSet = inlineformset_factory(
-    Invoice, InvoiceLine,
-    fields=('service', 'description', 'quantite', 'prix_unitaire'),
-    extra=1,
-    can_delete=True
-)
+        context.update({
+            'filtres': self.filtres,
+            'filtres_query': parametres.urlencode(),
+            'curseur_suivant': _curseur(page[-1]) if page and self.page_suivante else None,
+            'curseur_precedent': _curseur(page[0]) if page and self.page_precedente else None,
+            'totaux': self.totaux(page),
+        })
+        return context
 
 class InvoiceCreateView(LoginRequiredMixin, CreateView):
     model = Invoice
@@ -53,10 +301,14 @@ class InvoiceCreateView(LoginRequiredMixin, CreateView):
         context = self.get_context_data()
         lines = context['lines']
         if lines.is_valid():
-            self.object = form.save()
-            lines.instance = self.object
-            lines.save()
-            return super().form_valid(form)
+            # Facture et lignes dans la même transaction, lignes enregistrées en lot
+            with transaction.atomic():
+                self.object = form.save()
+                lines.instance = self.object
+                lines.save()
+            # Pas de super().form_valid() : il réenregistrerait la facture en mémoire, dont les
+            # totaux sont périmés depuis que les lignes les ont mis à jour en base
+            return redirect(self.get_success_url())
         else:
             return self.render_to_response(self.get_context_data(form=form))
 
@@ -78,9 +330,13 @@ class InvoiceUpdateView(LoginRequiredMixin, UpdateView):
         context = self.get_context_data()
         lines = context['lines']
         if lines.is_valid():
-            self.object = form.save()
-            lines.instance = self.object
-            lines.save()
-            return super().form_valid(form)
+            # Facture et lignes dans la même transaction, lignes enregistrées en lot
+            with transaction.atomic():
+                self.object = form.save()
+                lines.instance = self.object
+                lines.save()
+            # Pas de super().form_valid() : il réenregistrerait la facture en mémoire, dont les
+            # totaux sont périmés depuis que les lignes les ont mis à jour en base
+            return redirect(self.get_success_url())
         else:
             return self.render_to_response(self.get_context_data(form=form))
@@ -108,6 +108,35 @@ DATABASES = {
 }
 
 
+# Cache
+# Partagé entre tous les workers : les jetons de version (disponibilités, changements de
+# commandes) doivent être vus par chaque processus. Cache en base par défaut
+# (créer la table une fois : python manage.py createcachetable) ; Redis / Memcached possibles
+# via CACHE_BACKEND et CACHE_LOCATION. Ne pas utiliser LocMemCache avec plusieurs workers.
+
+CACHES = {
+    'default': {
+        'BACKEND': config('CACHE_BACKEND', default='django.core.cache.backends.db.DatabaseCache'),
+        'LOCATION': config('CACHE_LOCATION', default='hotel_cache'),
+    }
+}
+
+
+# Facturation
+# Nombre de numéros de facture réservés d'un coup par processus (1 = numérotation sans trous)
+INVOICE_NUMBER_BLOCK_SIZE = config('INVOICE_NUMBER_BLOCK_SIZE', default=1, cast=int)
+
+
+# POS / écran cuisine
+# Durée maximale (secondes, 25 au plus) pendant laquelle une requête de suivi des commandes
+# reste ouverte en attendant un changement. Chaque écran POS ou cuisine occupe un worker
+# pendant cette attente : à garder sous le délai d'expiration des workers WSGI synchrones, à 0
+# s'ils sont trop peu nombreux (les écrans relancent alors toutes les 15 s, comme l'ancien
+# rafraîchissement). Les attentes plus longues demandent des workers threadés ou asynchrones,
+# et le cache partagé ci-dessus (compteur de réveil).
+POS_CHANGES_MAX_WAIT = config('POS_CHANGES_MAX_WAIT', default=10, cast=int)
+
+
 # Password validation
 # https://docs.djangoproject.com/en/5.1/ref/settings/#auth-password-validators
 
@@ -24,6 +24,20 @@ DATABASES = {
     }
 }
 
+# Cache partagé entre les workers (jetons de version des disponibilités et des commandes) :
+# cache en base, sans service supplémentaire sur PythonAnywhere.
+# Créer la table au déploiement : python manage.py createcachetable
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.db.DatabaseCache',
+        'LOCATION': 'hotel_cache',
+    }
+}
+
+# Suivi des commandes POS / cuisine : attente de 10 s au plus par requête, bien en dessous du
+# délai d'expiration des workers WSGI. Prévoir un worker de plus par écran POS ou cuisine ouvert.
+POS_CHANGES_MAX_WAIT = 10
+
 # Application definition
 INSTALLED_APPS = [
     'django.contrib.admin',
@@ -26,13 +26,9 @@ class POSView(TemplateView):
     template_name = "pos.html"
 
     def get_context_data(self, **kwargs):
-        from restaurant.models import MenuItem
         from reservations.models import Reservation
-        from services.models import Service
         
         context = super().get_context_data(**kwargs)
-        context['menu_items'] = MenuItem.objects.all().order_by('categorie', 'nom')
-        context['categories'] = MenuItem.objects.values_list('categorie', flat=True).distinct()
-        context['active_reservations'] = Reservation.objects.filter(statut='active')
-        context['services'] = Service.objects.all()
+        # Menu, catégories et services : chargés par le POS depuis le catalogue versionné
+        context['active_reservations'] = Reservation.objects.filter(statut='active').select_related('client', 'chambre')
         return context
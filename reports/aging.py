@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+"""
+Balance âgée des créances clients : reste dû (montant_total - montant_paye) des
+factures ouvertes, réparti par ancienneté depuis l'échéance (ou l'émission si
+aucune échéance n'est fixée). Une seule requête groupée avec agrégation
+conditionnelle par vue ; le résultat est mis en cache quelques minutes.
+"""
+import datetime
+from decimal import Decimal
+
+from django.core.cache import cache
+from django.db.models import Sum, Count, Case, When, Value, F, DecimalField
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from billing.models import Invoice
+
+DUREE_CACHE = 120
+TRANCHES = [
+    ('a_0_30', '0-30 jours'),
+    ('a_31_60', '31-60 jours'),
+    ('a_61_90', '61-90 jours'),
+    ('a_90_plus', '90+ jours'),
+]
+# Regroupements disponibles : (champ identifiant, champ libellé)
+REGROUPEMENTS = {
+    'client': ('client_id', 'client__nom'),
+    'entreprise': ('reservation__affiliation__nom_entreprise', 'reservation__affiliation__nom_entreprise'),
+}
+
+
+def _reste_du_si(**conditions):
+    reste_du = F('montant_total') - F('montant_paye')
+    champ = DecimalField(max_digits=12, decimal_places=2)
+    if not conditions:
+        return Coalesce(Sum(reste_du, output_field=champ), Value(Decimal('0')), output_field=champ)
+    return Coalesce(
+        Sum(Case(When(then=reste_du, **conditions), default=Value(Decimal('0')), output_field=champ)),
+        Value(Decimal('0')),
+        output_field=champ,
+    )
+
+
+def calculer_balance_agee(par='client', date_reference=None):
+    """Lignes de la balance âgée groupées par client ou par entreprise affiliée, en une requête"""
+    date_reference = date_reference or timezone.localdate()
+    limite = {jours: date_reference - datetime.timedelta(days=jours) for jours in (30, 60, 90)}
+    identifiant, libelle = REGROUPEMENTS[par]
+
+    factures = Invoice.objects.filter(montant_total__gt=F('montant_paye')).annotate(
+        date_ancienne=Coalesce('date_echeance', 'date_emission')
+    )
+    if par == 'entreprise':
+        factures = factures.filter(reservation__affiliation__isnull=False)
+
+    colonnes = {identifiant, libelle}
+    lignes = factures.values(*colonnes).annotate(
+        # Factures non encore échues comprises dans la première tranche
+        a_0_30=_reste_du_si(date_ancienne__gte=limite[30]),
+        a_31_60=_reste_du_si(date_ancienne__lt=limite[30], date_ancienne__gte=limite[60]),
+        a_61_90=_reste_du_si(date_ancienne__lt=limite[60], date_ancienne__gte=limite[90]),
+        a_90_plus=_reste_du_si(date_ancienne__lt=limite[90]),
+        total=_reste_du_si(),
+        factures=Count('id'),
+    ).order_by('-total')
+
+    centime = Decimal('0.01')
+    montants = [tranche for tranche, libelle in TRANCHES] + ['total']
+    return [
+        dict(
+            ligne,
+            identifiant=ligne[identifiant],
+            libelle=ligne[libelle],
+            **{champ: Decimal(ligne[champ]).quantize(centime) for champ in montants},
+        )
+        for ligne in lignes
+    ]
+
+
+def balance_agee(par='client'):
+    """Balance âgée mise en cache DUREE_CACHE secondes ; retourne (lignes, totaux par tranche)"""
+    date_reference = timezone.localdate()
+    cle = f"reports:balance_agee:{par}:{date_reference.isoformat()}"
+    lignes = cache.get(cle)
+    if lignes is None:
+        lignes = calculer_balance_agee(par, date_reference)
+        cache.set(cle, lignes, DUREE_CACHE)
+
+    totaux = {
+        champ: sum((ligne[champ] for ligne in lignes), Decimal('0'))
+        for champ in [tranche for tranche, libelle in TRANCHES] + ['total']
+    }
+    return lignes, totaux
@@ -0,0 +1,53 @@
+import datetime
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from reports.night_audit import ETAPES, NOMS_ETAPES, date_affaires_courante, ouvrir_audit, executer_etape, cloturer_audit
+
+
+def parse_date(value):
+    try:
+        return datetime.datetime.strptime(value, '%Y-%m-%d').date()
+    except ValueError:
+        raise CommandError(f"Date invalide : {value}. Utilisez YYYY-MM-DD")
+
+
+class Command(BaseCommand):
+    help = (
+        "Runs the night audit for the business date: room charges, no-shows, expired pending "
+        "reservations, KPI snapshot and business date roll. Resumes at the first unfinished stage."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--date', dest='date_affaires', type=parse_date, help="Date d'affaires à auditer (YYYY-MM-DD, date courante par défaut)")
+        parser.add_argument('--relancer', nargs='+', choices=NOMS_ETAPES, default=[], metavar='ETAPE', help=f"Rejouer ces étapes même si elles sont terminées ({', '.join(NOMS_ETAPES)})")
+        parser.add_argument('--delai-attente', type=int, default=48, help="Heures avant expiration d'une réservation en attente (0 = seulement si l'arrivée est passée)")
+        parser.add_argument('--batch-size', type=int, default=500, help="Nombre de nuitées postées par transaction")
+
+    def handle(self, *args, **options):
+        date_affaires = options['date_affaires'] or date_affaires_courante()
+        if date_affaires > timezone.localdate():
+            raise CommandError(f"La date d'affaires {date_affaires.strftime('%d/%m/%Y')} n'est pas encore écoulée.")
+        if options['delai_attente'] < 0 or options['batch_size'] < 1:
+            raise CommandError("--delai-attente doit être positif ou nul et --batch-size positif.")
+
+        audit = ouvrir_audit(date_affaires, relancer=options['relancer'])
+        if audit.statut == 'terminee':
+            self.stdout.write(self.style.WARNING(
+                f"L'audit du {date_affaires.strftime('%d/%m/%Y')} est déjà terminé. Utilisez --relancer pour rejouer une étape."
+            ))
+            return
+
+        self.stdout.write(f"Audit de nuit du {date_affaires.strftime('%d/%m/%Y')}")
+        for ordre, (nom, fonction) in enumerate(ETAPES, start=1):
+            prefixe = f"[{ordre}/{len(ETAPES)}] {nom}"
+            try:
+                etape, executee = executer_etape(audit, ordre, nom, fonction, options)
+            except Exception as e:
+                raise CommandError(f"{prefixe} : échec ({e}). Relancez la commande pour reprendre à cette étape.")
+            if executee:
+                self.stdout.write(f"{prefixe} : terminée en {etape.duree:.2f} s {etape.resultat}")
+            else:
+                self.stdout.write(f"{prefixe} : déjà terminée (point de reprise), ignorée")
+
+        cloturer_audit(date_affaires)
+        self.stdout.write(self.style.SUCCESS(f"\nAudit terminé. Date d'affaires : {date_affaires_courante().strftime('%d/%m/%Y')}."))
@@ -0,0 +1,78 @@
+# Generated by Django 4.2.27 on 2026-10-18 16:32
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailyKPI',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField(unique=True, verbose_name='Date')),
+                ('chambres_total', models.PositiveIntegerField(default=0, verbose_name='Chambres')),
+                ('chambres_occupees', models.PositiveIntegerField(default=0, verbose_name='Chambres occupées')),
+                ('taux_occupation', models.DecimalField(decimal_places=2, default=0, max_digits=5, verbose_name="Taux d'occupation (%)")),
+                ('revenu_hebergement', models.DecimalField(decimal_places=2, default=0, max_digits=12, verbose_name='Revenu hébergement HT')),
+                ('adr', models.DecimalField(decimal_places=2, default=0, max_digits=12, verbose_name='Prix moyen par chambre (ADR)')),
+                ('revpar', models.DecimalField(decimal_places=2, default=0, max_digits=12, verbose_name='Revenu par chambre disponible (RevPAR)')),
+                ('encaissements', models.DecimalField(decimal_places=2, default=0, max_digits=12, verbose_name='Encaissements')),
+                ('arrivees', models.PositiveIntegerField(default=0, verbose_name='Arrivées')),
+                ('departs', models.PositiveIntegerField(default=0, verbose_name='Départs')),
+                ('no_shows', models.PositiveIntegerField(default=0, verbose_name='No-shows')),
+                ('created_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'verbose_name': 'KPI journalier',
+                'verbose_name_plural': 'KPI journaliers',
+                'ordering': ['-date'],
+            },
+        ),
+        migrations.CreateModel(
+            name='NightAudit',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date_affaires', models.DateField(unique=True, verbose_name="Date d'affaires")),
+                ('statut', models.CharField(choices=[('en_cours', 'En cours'), ('terminee', 'Terminé'), ('echec', 'En échec')], default='en_cours', max_length=20, verbose_name='Statut')),
+                ('debut', models.DateTimeField(auto_now_add=True, verbose_name='Début')),
+                ('fin', models.DateTimeField(blank=True, null=True, verbose_name='Fin')),
+            ],
+            options={
+                'verbose_name': 'Audit de nuit',
+                'verbose_name_plural': 'Audits de nuit',
+                'ordering': ['-date_affaires'],
+            },
+        ),
+        migrations.CreateModel(
+            name='NightAuditStage',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('nom', models.CharField(max_length=50, verbose_name='Étape')),
+                ('ordre', models.PositiveSmallIntegerField(verbose_name='Ordre')),
+                ('statut', models.CharField(choices=[('terminee', 'Terminée'), ('echec', 'En échec')], max_length=20, verbose_name='Statut')),
+                ('debut', models.DateTimeField(verbose_name='Début')),
+                ('fin', models.DateTimeField(verbose_name='Fin')),
+                ('duree', models.FloatField(verbose_name='Durée (s)')),
+                ('resultat', models.JSONField(blank=True, default=dict, verbose_name='Résultat')),
+                ('erreur', models.TextField(blank=True, verbose_name='Erreur')),
+                ('audit', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='etapes', to='reports.nightaudit', verbose_name='Audit')),
+            ],
+            options={
+                'verbose_name': "Étape d'audit",
+                'verbose_name_plural': "Étapes d'audit",
+                'ordering': ['audit', 'ordre'],
+                'indexes': [models.Index(fields=['nom', 'debut'], name='reports_nig_nom_b8794b_idx')],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='nightauditstage',
+            constraint=models.UniqueConstraint(fields=('audit', 'nom'), name='unique_etape_par_audit'),
+        ),
+    ]
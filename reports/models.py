@@ -1,3 +1,79 @@
 from django.db import models
 
-# Create your models here.
+
+class NightAudit(models.Model):
+    """Audit de nuit d'une date d'affaires ; ses étapes servent de points de reprise"""
+    STATUT_CHOICES = [
+        ('en_cours', 'En cours'),
+        ('terminee', 'Terminé'),
+        ('echec', 'En échec'),
+    ]
+
+    date_affaires = models.DateField(unique=True, verbose_name="Date d'affaires")
+    statut = models.CharField(max_length=20, choices=STATUT_CHOICES, default='en_cours', verbose_name="Statut")
+    debut = models.DateTimeField(auto_now_add=True, verbose_name="Début")
+    fin = models.DateTimeField(null=True, blank=True, verbose_name="Fin")
+
+    class Meta:
+        ordering = ['-date_affaires']
+        verbose_name = "Audit de nuit"
+        verbose_name_plural = "Audits de nuit"
+
+    def __str__(self):
+        return f"Audit du {self.date_affaires.strftime('%d/%m/%Y')} ({self.get_statut_display()})"
+
+
+class NightAuditStage(models.Model):
+    """Point de reprise d'une étape de l'audit, avec sa durée pour le suivi des tendances"""
+    STATUT_CHOICES = [
+        ('terminee', 'Terminée'),
+        ('echec', 'En échec'),
+    ]
+
+    audit = models.ForeignKey(NightAudit, on_delete=models.CASCADE, related_name='etapes', verbose_name="Audit")
+    nom = models.CharField(max_length=50, verbose_name="Étape")
+    ordre = models.PositiveSmallIntegerField(verbose_name="Ordre")
+    statut = models.CharField(max_length=20, choices=STATUT_CHOICES, verbose_name="Statut")
+    debut = models.DateTimeField(verbose_name="Début")
+    fin = models.DateTimeField(verbose_name="Fin")
+    duree = models.FloatField(verbose_name="Durée (s)")
+    resultat = models.JSONField(default=dict, blank=True, verbose_name="Résultat")
+    erreur = models.TextField(blank=True, verbose_name="Erreur")
+
+    class Meta:
+        ordering = ['audit', 'ordre']
+        verbose_name = "Étape d'audit"
+        verbose_name_plural = "Étapes d'audit"
+        constraints = [
+            models.UniqueConstraint(fields=['audit', 'nom'], name='unique_etape_par_audit'),
+        ]
+        indexes = [
+            models.Index(fields=['nom', 'debut']),
+        ]
+
+    def __str__(self):
+        return f"{self.audit.date_affaires} - {self.nom} : {self.get_statut_display()} ({self.duree:.2f} s)"
+
+
+class DailyKPI(models.Model):
+    """Indicateurs d'occupation et de revenu figés par l'audit de nuit"""
+    date = models.DateField(unique=True, verbose_name="Date")
+    chambres_total = models.PositiveIntegerField(default=0, verbose_name="Chambres")
+    chambres_occupees = models.PositiveIntegerField(default=0, verbose_name="Chambres occupées")
+    taux_occupation = models.DecimalField(max_digits=5, decimal_places=2, default=0, verbose_name="Taux d'occupation (%)")
+    revenu_hebergement = models.DecimalField(max_digits=12, decimal_places=2, default=0, verbose_name="Revenu hébergement HT")
+    adr = models.DecimalField(max_digits=12, decimal_places=2, default=0, verbose_name="Prix moyen par chambre (ADR)")
+    revpar = models.DecimalField(max_digits=12, decimal_places=2, default=0, verbose_name="Revenu par chambre disponible (RevPAR)")
+    encaissements = models.DecimalField(max_digits=12, decimal_places=2, default=0, verbose_name="Encaissements")
+    arrivees = models.PositiveIntegerField(default=0, verbose_name="Arrivées")
+    departs = models.PositiveIntegerField(default=0, verbose_name="Départs")
+    no_shows = models.PositiveIntegerField(default=0, verbose_name="No-shows")
+    created_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        ordering = ['-date']
+        verbose_name = "KPI journalier"
+        verbose_name_plural = "KPI journaliers"
+
+    def __str__(self):
+        return f"{self.date.strftime('%d/%m/%Y')} : {self.taux_occupation} % - RevPAR {self.revpar}"
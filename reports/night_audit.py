@@ -0,0 +1,233 @@
+# -*- coding: utf-8 -*-
+"""
+Audit de nuit : étapes nommées exécutées dans l'ordre pour une date d'affaires.
+Chaque étape tourne dans sa propre transaction et enregistre son point de reprise
+(NightAuditStage) dans cette même transaction : après un arrêt brutal, l'audit
+reprend à la première étape non terminée. La durée de chaque étape est conservée.
+"""
+import datetime
+import time
+from decimal import Decimal, ROUND_HALF_UP
+
+from django.db import transaction
+from django.db.models import Sum, Count, Q
+from django.utils import timezone
+
+from .models import NightAudit, NightAuditStage, DailyKPI
+
+
+def date_affaires_courante():
+    """Date d'affaires à auditer : celle des paramètres, ou aujourd'hui si aucun audit n'a encore tourné"""
+    from settings.models import AppSettings
+    return AppSettings.load().date_affaires or timezone.localdate()
+
+
+def _liberer(reservations, statut):
+    """Passe les réservations au statut donné et libère leurs nuits (même logique que le check-out de groupe)"""
+    from reservations.models import Reservation, RoomNight
+    from reservations.availability import nuits_entre
+    from reservations.availability_cache import invalider_nuits
+
+    pks = [r.pk for r in reservations]
+    if not pks:
+        return 0
+    Reservation.objects.filter(pk__in=pks).update(statut=statut)
+    RoomNight.objects.filter(reservation_id__in=pks).delete()
+    invalider_nuits(nuit for r in reservations for nuit in nuits_entre(r.date_debut, r.date_fin))
+    return len(pks)
+
+
+def _journaliser(action, reservations):
+    from logs.models import ActivityLog
+
+    if reservations:
+        ActivityLog.log_event(
+            user=None,
+            event_type='system',
+            module='reservations',
+            action=action,
+            details=f"Réservations {', '.join(str(r.pk) for r in reservations)}",
+            object_type='Reservation',
+            severity='info'
+        )
+
+
+def poster_charges(date_affaires, options):
+    """Étape 1 : facture la nuitée de la date d'affaires pour toutes les réservations actives"""
+    from billing.folios import nuitees_a_facturer, poster_nuitees
+
+    nuitees, ignorees = nuitees_a_facturer(date_affaires, date_affaires)
+    postees = poster_nuitees(nuitees, batch_size=options.get('batch_size', 500))
+    return {
+        'nuitees': postees,
+        'ignorees': [{'reservation': reservation_id, 'motif': motif} for reservation_id, motif in ignorees],
+    }
+
+
+def marquer_no_shows(date_affaires, options):
+    """Étape 2 : réservations confirmées dont l'arrivée est passée sans check-in"""
+    from reservations.models import Reservation
+
+    reservations = list(
+        Reservation.objects.select_for_update()
+        .filter(statut='confirmee', date_debut__lte=date_affaires)
+        .only('id', 'date_debut', 'date_fin')
+    )
+    _liberer(reservations, 'no_show')
+    _journaliser(f"Audit de nuit : {len(reservations)} no-show(s)", reservations)
+    return {'no_shows': len(reservations)}
+
+
+def expirer_attentes(date_affaires, options):
+    """
+    Étape 3 : annule les réservations en attente dont l'arrivée est passée ou qui
+    n'ont pas été confirmées dans le délai (--delai-attente, en heures ; 0 = sans limite).
+    """
+    from reservations.models import Reservation
+
+    perimees = Q(date_debut__lte=date_affaires)
+    delai = options.get('delai_attente') or 0
+    if delai:
+        perimees |= Q(created_at__lt=timezone.now() - datetime.timedelta(hours=delai))
+
+    reservations = list(
+        Reservation.objects.select_for_update()
+        .filter(perimees, statut='en_attente')
+        .only('id', 'date_debut', 'date_fin')
+    )
+    _liberer(reservations, 'annulee')
+    _journaliser(f"Audit de nuit : {len(reservations)} réservation(s) en attente expirée(s)", reservations)
+    return {'expirees': len(reservations)}
+
+
+def _ratio(numerateur, denominateur, facteur=1):
+    if not denominateur:
+        return Decimal('0')
+    return (Decimal(numerateur) * facteur / denominateur).quantize(Decimal('0.01'), rounding=ROUND_HALF_UP)
+
+
+def figer_kpis(date_affaires, options):
+    """Étape 4 : occupation, ADR, RevPAR, encaissements et mouvements du jour"""
+    from billing.models import InvoiceLine, Payment
+    from reservations.models import Reservation, RoomNight
+    from rooms.models import Room
+
+    chambres_total = Room.objects.exclude(statut='maintenance').count()
+    chambres_occupees = RoomNight.objects.filter(date=date_affaires, statut='active').count()
+    revenu = (InvoiceLine.objects.filter(date_nuitee=date_affaires).aggregate(
+        total=Sum('montant_total'))['total'] or Decimal('0')).quantize(Decimal('0.01'))
+    encaissements = Payment.objects.filter(date_paiement=date_affaires).exclude(mode='reprise').aggregate(
+        total=Sum('montant'))['total'] or Decimal('0')
+    mouvements = Reservation.objects.aggregate(
+        arrivees=Count('id', filter=Q(date_debut=date_affaires, statut__in=['active', 'terminee'])),
+        departs=Count('id', filter=Q(date_fin=date_affaires, statut='terminee')),
+        no_shows=Count('id', filter=Q(date_debut=date_affaires, statut='no_show')),
+    )
+
+    kpi, created = DailyKPI.objects.update_or_create(
+        date=date_affaires,
+        defaults={
+            'chambres_total': chambres_total,
+            'chambres_occupees': chambres_occupees,
+            'taux_occupation': _ratio(chambres_occupees, chambres_total, 100),
+            'revenu_hebergement': revenu,
+            'adr': _ratio(revenu, chambres_occupees),
+            'revpar': _ratio(revenu, chambres_total),
+            'encaissements': encaissements,
+            **mouvements,
+        }
+    )
+    return {
+        'taux_occupation': str(kpi.taux_occupation),
+        'revenu_hebergement': str(kpi.revenu_hebergement),
+        'adr': str(kpi.adr),
+        'revpar': str(kpi.revpar),
+    }
+
+
+def avancer_date(date_affaires, options):
+    """Étape 5 : passe à la date d'affaires suivante et clôture l'audit"""
+    from settings.models import AppSettings
+
+    parametres = AppSettings.load()
+    suivante = date_affaires + datetime.timedelta(days=1)
+    # Un audit rejoué sur une date passée ne fait pas reculer la date d'affaires
+    if parametres.date_affaires is None or parametres.date_affaires < suivante:
+        parametres.date_affaires = suivante
+        parametres.save(update_fields=['date_affaires'])
+    cloturer_audit(date_affaires)
+    return {'date_affaires': parametres.date_affaires.isoformat()}
+
+
+ETAPES = [
+    ('nuitees', poster_charges),
+    ('no_shows', marquer_no_shows),
+    ('expirations', expirer_attentes),
+    ('kpis', figer_kpis),
+    ('date_affaires', avancer_date),
+]
+NOMS_ETAPES = [nom for nom, fonction in ETAPES]
+
+
+def ouvrir_audit(date_affaires, relancer=()):
+    """Audit de la date (créé au besoin) ; les étapes de relancer perdent leur point de reprise"""
+    audit, created = NightAudit.objects.get_or_create(date_affaires=date_affaires)
+    if relancer:
+        audit.etapes.filter(nom__in=relancer).delete()
+    if audit.statut != 'en_cours' and (relancer or audit.statut == 'echec'):
+        audit.statut = 'en_cours'
+        audit.fin = None
+        audit.save(update_fields=['statut', 'fin'])
+    return audit
+
+
+def cloturer_audit(date_affaires):
+    """Marque l'audit terminé (aussi après une relance partielle d'un audit déjà clôturé)"""
+    NightAudit.objects.filter(date_affaires=date_affaires).update(statut='terminee', fin=timezone.now())
+
+
+def executer_etape(audit, ordre, nom, fonction, options):
+    """
+    Exécute une étape si elle n'a pas encore de point de reprise.
+    Retourne (NightAuditStage, True si exécutée maintenant / False si déjà faite).
+    """
+    debut = timezone.now()
+    chrono = time.monotonic()
+    try:
+        with transaction.atomic():
+            # Verrou sur l'audit : deux exécutions simultanées ne rejouent pas la même étape
+            NightAudit.objects.select_for_update().get(pk=audit.pk)
+            etape = audit.etapes.filter(nom=nom, statut='terminee').first()
+            if etape:
+                return etape, False
+
+            resultat = fonction(audit.date_affaires, options)
+            etape, created = NightAuditStage.objects.update_or_create(
+                audit=audit, nom=nom,
+                defaults={
+                    'ordre': ordre,
+                    'statut': 'terminee',
+                    'debut': debut,
+                    'fin': timezone.now(),
+                    'duree': time.monotonic() - chrono,
+                    'resultat': resultat,
+                    'erreur': '',
+                }
+            )
+        return etape, True
+    except Exception as e:
+        # Le travail de l'étape est annulé ; seul l'échec est consigné
+        NightAuditStage.objects.update_or_create(
+            audit=audit, nom=nom,
+            defaults={
+                'ordre': ordre,
+                'statut': 'echec',
+                'debut': debut,
+                'fin': timezone.now(),
+                'duree': time.monotonic() - chrono,
+                'resultat': {},
+                'erreur': f"{type(e).__name__}: {e}",
+            }
+        )
+        NightAudit.objects.filter(pk=audit.pk).update(statut='echec')
+        raise
@@ -1,3 +1,175 @@
+import datetime
+from decimal import Decimal
+from io import StringIO
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.management import CommandError, call_command
 from django.test import TestCase
+from django.urls import reverse
+from django.utils import timezone
+
+from affiliations.models import Affiliation
+from billing.models import Invoice, InvoiceLine
+from clients.models import Client
+from reservations.models import Reservation, RoomNight
+from rooms.models import Room, RoomCategory
+from settings.models import AppSettings
+from .aging import TRANCHES, calculer_balance_agee
+from .models import DailyKPI, NightAudit, NightAuditStage
+from .night_audit import NOMS_ETAPES
+
+
+class NightAuditTests(TestCase):
+    """Audit de nuit : étapes avec point de reprise"""
+
+    def setUp(self):
+        self.date = timezone.localdate() - datetime.timedelta(days=1)
+        hote = Client.objects.create(nom='Dupont', email='dupont@example.com')
+        categorie = RoomCategory.objects.create(nom='Standard', prix=Decimal('100.00'))
+        chambres = [Room.objects.create(numero=numero, categorie=categorie) for numero in ('101', '102', '103')]
+
+        def reserver(chambre, debut, statut):
+            return Reservation.objects.create(
+                client=hote, chambre=chambre, statut=statut,
+                date_debut=self.date + datetime.timedelta(days=debut),
+                date_fin=self.date + datetime.timedelta(days=3),
+            )
+
+        self.sejour = reserver(chambres[0], -2, 'active')
+        self.absent = reserver(chambres[1], 0, 'confirmee')
+        self.en_attente = reserver(chambres[2], -1, 'en_attente')
+
+    def auditer(self, *args):
+        sortie = StringIO()
+        call_command('night_audit', '--date', self.date.isoformat(), *args, stdout=sortie)
+        return sortie.getvalue()
+
+    def test_audit_complet(self):
+        self.auditer()
+
+        self.assertEqual(InvoiceLine.objects.filter(reservation=self.sejour, date_nuitee=self.date).count(), 1)
+        self.absent.refresh_from_db()
+        self.en_attente.refresh_from_db()
+        self.assertEqual((self.absent.statut, self.en_attente.statut), ('no_show', 'annulee'))
+        self.assertEqual(set(RoomNight.objects.values_list('reservation_id', flat=True)), {self.sejour.pk})
+
+        kpi = DailyKPI.objects.get(date=self.date)
+        self.assertEqual((kpi.chambres_occupees, kpi.chambres_total), (1, 3))
+        self.assertEqual(kpi.revenu_hebergement, Decimal('100.00'))
+        self.assertEqual(AppSettings.load().date_affaires, self.date + datetime.timedelta(days=1))
+
+        audit = NightAudit.objects.get(date_affaires=self.date)
+        self.assertEqual(audit.statut, 'terminee')
+        self.assertEqual(list(audit.etapes.values_list('nom', flat=True)), NOMS_ETAPES)
+        self.assertIn('déjà terminé', self.auditer())
+
+    def test_reprise_apres_echec(self):
+        with mock.patch.object(DailyKPI.objects, 'update_or_create', side_effect=RuntimeError('panne')):
+            with self.assertRaises(CommandError):
+                self.auditer()
+
+        audit = NightAudit.objects.get(date_affaires=self.date)
+        self.assertEqual(audit.statut, 'echec')
+        self.assertEqual(
+            dict(audit.etapes.values_list('nom', 'statut')),
+            {'nuitees': 'terminee', 'no_shows': 'terminee', 'expirations': 'terminee', 'kpis': 'echec'},
+        )
+        self.assertIn('RuntimeError: panne', NightAuditStage.objects.get(audit=audit, nom='kpis').erreur)
+        self.assertIsNone(AppSettings.load().date_affaires)
+
+        sortie = self.auditer()
+
+        # Les étapes terminées ne sont pas rejouées : la nuitée n'est postée qu'une fois
+        self.assertEqual(sortie.count('point de reprise'), 3)
+        self.assertEqual(InvoiceLine.objects.filter(reservation=self.sejour, date_nuitee=self.date).count(), 1)
+        self.assertTrue(DailyKPI.objects.filter(date=self.date).exists())
+        self.assertEqual(NightAudit.objects.get(pk=audit.pk).statut, 'terminee')
+
+    def test_relance_d_une_etape(self):
+        self.auditer()
+        InvoiceLine.objects.filter(reservation=self.sejour, date_nuitee=self.date).delete()
+
+        sortie = self.auditer('--relancer', 'nuitees')
+
+        self.assertEqual(sortie.count('point de reprise'), 4)
+        self.assertEqual(InvoiceLine.objects.filter(reservation=self.sejour, date_nuitee=self.date).count(), 1)
+        self.assertEqual(NightAudit.objects.get(date_affaires=self.date).statut, 'terminee')
+
+    def test_date_future_refusee(self):
+        with self.assertRaises(CommandError):
+            call_command('night_audit', '--date', (timezone.localdate() + datetime.timedelta(days=1)).isoformat(), stdout=StringIO())
+        self.assertFalse(NightAudit.objects.exists())
+
+
+class BalanceAgeeTests(TestCase):
+    """Balance âgée des créances, groupée en SQL"""
+
+    def setUp(self):
+        cache.clear()
+        self.aujourdhui = timezone.localdate()
+        self.user = get_user_model().objects.create_user(username='comptable', password='secret')
+        self.client.force_login(self.user)
+        self.dupont = Client.objects.create(nom='Dupont', email='dupont@example.com')
+        self.martin = Client.objects.create(nom='Martin', email='martin@example.com')
+
+    def facture(self, client, total, paye='0', jours=None, emise_il_y_a=0, reservation=None):
+        facture = Invoice.objects.create(client=client, reservation=reservation)
+        Invoice.objects.filter(pk=facture.pk).update(
+            montant_total=Decimal(total),
+            montant_paye=Decimal(paye),
+            date_emission=self.aujourdhui - datetime.timedelta(days=emise_il_y_a),
+            date_echeance=None if jours is None else self.aujourdhui - datetime.timedelta(days=jours),
+        )
+        return facture
+
+    def test_tranches_par_client(self):
+        self.facture(self.dupont, '100', jours=-10)   # pas encore échue
+        self.facture(self.dupont, '200', paye='50', jours=45)
+        self.facture(self.dupont, '300', jours=75)
+        self.facture(self.dupont, '400', emise_il_y_a=120)  # sans échéance : date d'émission
+        self.facture(self.dupont, '999', paye='999', jours=200)  # soldée
+        self.facture(self.martin, '80', jours=30)
+
+        lignes = {ligne['libelle']: ligne for ligne in calculer_balance_agee()}
+
+        dupont = lignes['Dupont']
+        self.assertEqual(
+            [dupont[tranche] for tranche, libelle in TRANCHES],
+            [Decimal('100.00'), Decimal('150.00'), Decimal('300.00'), Decimal('400.00')],
+        )
+        self.assertEqual((dupont['total'], dupont['factures']), (Decimal('950.00'), 4))
+        self.assertEqual(lignes['Martin']['a_0_30'], Decimal('80.00'))
+        # Trié par reste dû décroissant
+        self.assertEqual([ligne['libelle'] for ligne in calculer_balance_agee()], ['Dupont', 'Martin'])
+
+    def test_regroupement_par_entreprise(self):
+        chambre = Room.objects.create(numero='101', categorie=RoomCategory.objects.create(nom='Standard', prix=Decimal('100')))
+        debut = self.aujourdhui + datetime.timedelta(days=10)
+        for client, duree in ((self.dupont, 1), (self.martin, 2)):
+            reservation = Reservation.objects.create(
+                client=client, chambre=chambre, statut='annulee',
+                date_debut=debut, date_fin=debut + datetime.timedelta(days=duree),
+            )
+            Affiliation.objects.create(reservation=reservation, nom_entreprise='Voyages Sahel', contact_entreprise='M. Diallo')
+            self.facture(client, '100', jours=40, reservation=reservation)
+        self.facture(self.dupont, '500', jours=5)
+
+        lignes = calculer_balance_agee('entreprise')
+
+        self.assertEqual(len(lignes), 1)
+        self.assertEqual(lignes[0]['libelle'], 'Voyages Sahel')
+        self.assertEqual((lignes[0]['a_31_60'], lignes[0]['total'], lignes[0]['factures']), (Decimal('200.00'), Decimal('200.00'), 2))
+
+    def test_export_csv(self):
+        self.facture(self.dupont, '200', paye='50', jours=45)
+        self.facture(self.martin, '80', jours=100)
+
+        response = self.client.get(reverse('ar_aging_csv'))
 
-# Create your tests here.
+        lignes = response.content.decode('utf-8-sig').strip().splitlines()
+        self.assertEqual(len(lignes), 4)
+        self.assertEqual(lignes[1], 'Dupont;1;0.00;150.00;0.00;0.00;150.00')
+        self.assertEqual(lignes[-1], 'Total;2;0.00;150.00;0.00;80.00;230.00')
+        self.assertEqual(self.client.get(reverse('ar_aging'), {'par': 'entreprise'}).status_code, 200)
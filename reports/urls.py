@@ -3,4 +3,6 @@ from . import views
 
 urlpatterns = [
     path('', views.report_view, name='report'),
+    path('balance-agee/', views.aging_report_view, name='ar_aging'),
+    path('balance-agee/csv/', views.aging_report_csv, name='ar_aging_csv'),
 ]
@@ -1,7 +1,11 @@
+import csv
 from django.shortcuts import render
 from django.contrib.auth.decorators import login_required
+from django.http import HttpResponse
+from django.utils import timezone
 from billing.models import Invoice
 from django.db.models import Sum
+from .aging import balance_agee, TRANCHES, REGROUPEMENTS
 
 @login_required
 def report_view(request):
@@ -16,3 +20,39 @@ def report_view(request):
         'total_due': total_due,
     }
     return render(request, 'reports/report.html', context)
+
+
+def _regroupement(request):
+    par = request.GET.get('par', 'client')
+    return par if par in REGROUPEMENTS else 'client'
+
+
+@login_required
+def aging_report_view(request):
+    """Balance âgée des créances par client ou par entreprise affiliée"""
+    par = _regroupement(request)
+    lignes, totaux = balance_agee(par)
+    return render(request, 'reports/aging.html', {
+        'par': par,
+        'lignes': lignes,
+        'totaux': totaux,
+        'tranches': TRANCHES,
+    })
+
+
+@login_required
+def aging_report_csv(request):
+    """Balance âgée complète (toute la clientèle) au format CSV"""
+    par = _regroupement(request)
+    lignes, totaux = balance_agee(par)
+
+    response = HttpResponse(content_type='text/csv; charset=utf-8')
+    response['Content-Disposition'] = f'attachment; filename="balance_agee_{par}_{timezone.localdate():%Y%m%d}.csv"'
+    # BOM pour l'ouverture directe dans Excel (accents)
+    response.write('\ufeff')
+    writer = csv.writer(response, delimiter=';')
+    writer.writerow(['Client' if par == 'client' else 'Entreprise', 'Factures'] + [libelle for tranche, libelle in TRANCHES] + ['Total'])
+    for ligne in lignes:
+        writer.writerow([ligne['libelle'], ligne['factures']] + [ligne[tranche] for tranche, libelle in TRANCHES] + [ligne['total']])
+    writer.writerow(['Total', sum(ligne['factures'] for ligne in lignes)] + [totaux[tranche] for tranche, libelle in TRANCHES] + [totaux['total']])
+    return response
@@ -0,0 +1,153 @@
+# -*- coding: utf-8 -*-
+"""
+Index d'occupation des chambres (une ligne RoomNight par chambre et par nuit).
+
+Toutes les questions de disponibilité passent par ici : on interroge l'index
+(clé unique chambre/date) au lieu de rebalayer la table des réservations avec
+des conditions de chevauchement date_debut/date_fin.
+"""
+import datetime
+
+from django.db import transaction
+
+from rooms.models import Room
+
+
+def nuits_entre(date_debut, date_fin):
+    """Liste des nuits occupées par un séjour (la nuit du départ n'est pas comptée)"""
+    return [date_debut + datetime.timedelta(days=i) for i in range((date_fin - date_debut).days)]
+
+
+def chambres_occupees(date_debut, date_fin, exclude_reservation=None):
+    """Identifiants des chambres ayant au moins une nuit bloquée dans la période"""
+    from .models import RoomNight
+
+    nuits = RoomNight.objects.filter(date__gte=date_debut, date__lt=date_fin)
+    if exclude_reservation:
+        nuits = nuits.exclude(reservation_id=exclude_reservation)
+    return nuits.values_list('chambre_id', flat=True).distinct()
+
+
+def nuit_en_conflit(chambre_id, date_debut, date_fin, exclude_reservation=None):
+    """Première nuit déjà bloquée pour cette chambre dans la période, ou None si elle est libre"""
+    from .models import RoomNight
+
+    nuits = RoomNight.objects.filter(chambre_id=chambre_id, date__gte=date_debut, date__lt=date_fin)
+    if exclude_reservation:
+        nuits = nuits.exclude(reservation_id=exclude_reservation)
+    return nuits.select_related('reservation').order_by('date').first()
+
+
+def chambre_est_libre(chambre_id, date_debut, date_fin, exclude_reservation=None):
+    return nuit_en_conflit(chambre_id, date_debut, date_fin, exclude_reservation) is None
+
+
+def chambres_disponibles(date_debut, date_fin, exclude_reservation=None):
+    """Chambres prêtes à la vente (disponibles, inspectées) et libres sur toute la période"""
+    return Room.objects.filter(
+        statut='disponible',
+        cleaning_status='inspectee'
+    ).exclude(
+        id__in=chambres_occupees(date_debut, date_fin, exclude_reservation)
+    )
+
+
+def grille_occupation(date_debut, nb_jours):
+    """
+    Matrice chambres x dates sur nb_jours à partir de date_debut, en deux requêtes
+    quelle que soit la largeur de la fenêtre.
+
+    Chaque ligne est encodée par plages (run-length) : [décalage, longueur, statut, reservation_id],
+    le décalage étant compté en jours depuis date_debut. Les nuits hors plage sont libres.
+    """
+    from .models import RoomNight
+
+    date_fin = date_debut + datetime.timedelta(days=nb_jours)
+    chambres = list(
+        Room.objects.order_by('numero').values('id', 'numero', 'categorie__nom', 'statut', 'cleaning_status')
+    )
+    nuits = RoomNight.objects.filter(
+        date__gte=date_debut, date__lt=date_fin
+    ).order_by('chambre_id', 'date').values_list('chambre_id', 'date', 'statut', 'reservation_id')
+
+    plages = {}
+    for chambre_id, date, statut, reservation_id in nuits:
+        decalage = (date - date_debut).days
+        lignes = plages.setdefault(chambre_id, [])
+        derniere = lignes[-1] if lignes else None
+        # Prolonger la plage en cours si la nuit suit immédiatement la même réservation
+        if derniere and derniere[3] == reservation_id and derniere[0] + derniere[1] == decalage:
+            derniere[1] += 1
+        else:
+            lignes.append([decalage, 1, statut, reservation_id])
+
+    return [
+        {
+            'id': chambre['id'],
+            'numero': chambre['numero'],
+            'categorie': chambre['categorie__nom'] or 'Sans catégorie',
+            'statut': chambre['statut'],
+            'cleaning_status': chambre['cleaning_status'],
+            'occupation': plages.get(chambre['id'], []),
+        }
+        for chambre in chambres
+    ]
+
+
+def construire_nuits(reservation):
+    """Lignes d'index correspondant à l'état courant d'une réservation"""
+    from .models import Reservation, RoomNight
+
+    if reservation.statut not in Reservation.STATUTS_BLOQUANTS:
+        return []
+    return [
+        RoomNight(
+            chambre_id=reservation.chambre_id,
+            date=nuit,
+            reservation_id=reservation.pk,
+            statut=reservation.statut,
+        )
+        for nuit in nuits_entre(reservation.date_debut, reservation.date_fin)
+    ]
+
+
+def synchroniser_nuits(reservation):
+    """
+    Remplace les nuits indexées d'une réservation par son état courant.
+    Lève IntegrityError si une des nuits est déjà prise par une autre réservation.
+    """
+    from .models import RoomNight
+    from .availability_cache import invalider_nuits
+
+    anciennes = RoomNight.objects.filter(reservation_id=reservation.pk)
+    nuits_modifiees = set(anciennes.values_list('date', flat=True))
+    anciennes.delete()
+    nouvelles = RoomNight.objects.bulk_create(construire_nuits(reservation))
+    nuits_modifiees.update(nuit.date for nuit in nouvelles)
+    invalider_nuits(nuits_modifiees)
+
+
+@transaction.atomic
+def reconstruire_index(batch_size=1000):
+    """Reconstruit entièrement l'index à partir des réservations (réparation)"""
+    from .models import Reservation, RoomNight
+
+    from .availability_cache import invalider_chambres
+
+    RoomNight.objects.all().delete()
+    invalider_chambres()
+    reservations = Reservation.objects.filter(statut__in=Reservation.STATUTS_BLOQUANTS).only(
+        'pk', 'chambre_id', 'date_debut', 'date_fin', 'statut'
+    )
+    total = 0
+    batch = []
+    for reservation in reservations.iterator(chunk_size=batch_size):
+        batch.extend(construire_nuits(reservation))
+        if len(batch) >= batch_size:
+            RoomNight.objects.bulk_create(batch, ignore_conflicts=True)
+            total += len(batch)
+            batch = []
+    if batch:
+        RoomNight.objects.bulk_create(batch, ignore_conflicts=True)
+        total += len(batch)
+    return total
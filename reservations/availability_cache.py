@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+"""
+Cache des chambres disponibles par période (date_debut, date_fin).
+
+Chaque nuit possède un jeton de version, ainsi que l'ensemble des chambres
+(statut / état de nettoyage). La clé d'une entrée intègre les jetons des nuits
+de sa période : modifier une réservation ne renouvelle que les jetons de ses
+nuits, et seules les entrées dont la période chevauche ces nuits deviennent
+introuvables. Les entrées orphelines expirent d'elles-mêmes.
+"""
+import hashlib
+import uuid
+
+from django.core.cache import cache
+from django.db import transaction
+
+from .availability import chambres_disponibles, nuits_entre
+
+DUREE_ENTREE = 300  # secondes
+
+CLE_CHAMBRES = 'dispo:version:chambres'
+CLE_HITS = 'dispo:stats:hits'
+CLE_MISSES = 'dispo:stats:misses'
+
+
+def _cle_nuit(nuit):
+    return f'dispo:version:nuit:{nuit.isoformat()}'
+
+
+def _incrementer(cle):
+    try:
+        cache.incr(cle)
+    except ValueError:
+        cache.set(cle, 1, None)
+
+
+def chambres_disponibles_ids(date_debut, date_fin):
+    """Identifiants des chambres disponibles sur la période, servis depuis le cache si possible"""
+    cles_versions = [CLE_CHAMBRES] + [_cle_nuit(nuit) for nuit in nuits_entre(date_debut, date_fin)]
+    versions = cache.get_many(cles_versions)
+    signature = hashlib.sha1(
+        '|'.join(str(versions.get(cle, '0')) for cle in cles_versions).encode()
+    ).hexdigest()
+    cle = f'dispo:{date_debut.isoformat()}:{date_fin.isoformat()}:{signature}'
+
+    ids = cache.get(cle)
+    if ids is not None:
+        _incrementer(CLE_HITS)
+        return ids
+
+    _incrementer(CLE_MISSES)
+    ids = list(chambres_disponibles(date_debut, date_fin).values_list('id', flat=True))
+    cache.set(cle, ids, DUREE_ENTREE)
+    return ids
+
+
+def invalider_nuits(nuits):
+    """Périme les entrées dont la période contient au moins une de ces nuits (après commit)"""
+    nuits = set(nuits)
+    if not nuits:
+        return
+    transaction.on_commit(
+        lambda: cache.set_many({_cle_nuit(nuit): uuid.uuid4().hex for nuit in nuits}, None)
+    )
+
+
+def invalider_chambres():
+    """Périme toutes les entrées (statut ou nettoyage d'une chambre modifié, après commit)"""
+    transaction.on_commit(lambda: cache.set(CLE_CHAMBRES, uuid.uuid4().hex, None))
+
+
+def statistiques():
+    hits = cache.get(CLE_HITS, 0)
+    misses = cache.get(CLE_MISSES, 0)
+    total = hits + misses
+    return {
+        'hits': hits,
+        'misses': misses,
+        'taux_hit': round(hits / total, 4) if total else None,
+    }
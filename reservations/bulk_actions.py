@@ -0,0 +1,124 @@
+# -*- coding: utf-8 -*-
+"""
+Check-in / check-out en lot (groupes). Les vérifications et les mises à jour
+se font par requêtes ensemblistes ; chaque réservation reçoit un résultat.
+"""
+from django.db import transaction
+
+from rooms.models import Room
+from services.models import RoomCleaning
+from .availability import nuits_entre
+from .availability_cache import invalider_chambres, invalider_nuits
+
+
+def _resultat(reservation_id, succes, message):
+    return {'id': reservation_id, 'success': succes, 'message': message}
+
+
+def _introuvables(ids, reservations):
+    return [_resultat(pk, False, "Réservation introuvable.") for pk in ids if pk not in reservations]
+
+
+@transaction.atomic
+def check_in_groupe(ids, user=None):
+    """Passe en 'active' les réservations confirmées, occupe leurs chambres et ouvre leurs factures"""
+    from billing.folios import ouvrir_folios
+    from logs.models import ActivityLog
+    from .models import Reservation, RoomNight
+
+    reservations = Reservation.objects.select_for_update().select_related(
+        'client', 'chambre__categorie'
+    ).in_bulk(ids)
+
+    resultats = _introuvables(ids, reservations)
+    a_traiter = []
+    for reservation in reservations.values():
+        if reservation.statut == 'confirmee':
+            a_traiter.append(reservation)
+            resultats.append(_resultat(reservation.pk, True, f"Le client {reservation.client.nom} a été enregistré (check-in) en chambre {reservation.chambre.numero}."))
+        else:
+            resultats.append(_resultat(reservation.pk, False, "Cette réservation ne peut pas être enregistrée (check-in)."))
+
+    if a_traiter:
+        pks = [r.pk for r in a_traiter]
+        Reservation.objects.filter(pk__in=pks).update(statut='active')
+        RoomNight.objects.filter(reservation_id__in=pks).update(statut='active')
+        Room.objects.filter(pk__in=[r.chambre_id for r in a_traiter]).update(statut='occupee')
+        invalider_chambres()
+
+        for reservation in a_traiter:
+            reservation.statut = 'active'
+        ouvrir_folios(a_traiter)
+
+        ActivityLog.log_event(
+            user=user,
+            event_type='update',
+            module='reservations',
+            action=f"Check-in de groupe : {len(a_traiter)} réservation(s)",
+            details=f"Réservations {', '.join(map(str, pks))}",
+            object_type='Reservation',
+            severity='info'
+        )
+
+    return sorted(resultats, key=lambda r: r['id'])
+
+
+@transaction.atomic
+def check_out_groupe(ids, user=None):
+    """
+    Termine les réservations actives dont le client a un solde nul ou dont l'affiliation
+    est validée, libère les chambres et crée les demandes de nettoyage.
+    """
+    from logs.models import ActivityLog
+    from .models import Reservation, RoomNight
+
+    reservations = Reservation.objects.select_for_update().select_related(
+        'client', 'chambre', 'affiliation'
+    ).in_bulk(ids)
+
+    resultats = _introuvables(ids, reservations)
+    a_traiter = []
+    for reservation in reservations.values():
+        if reservation.statut != 'active':
+            resultats.append(_resultat(reservation.pk, False, "Cette réservation ne peut pas être libérée (check-out)."))
+            continue
+
+        affiliation = getattr(reservation, 'affiliation', None)
+        if reservation.client.solde == 0 or (affiliation and affiliation.statut_validation == 'validee'):
+            a_traiter.append(reservation)
+            resultats.append(_resultat(reservation.pk, True, f"Le client {reservation.client.nom} a été libéré (check-out) de la chambre {reservation.chambre.numero}."))
+        else:
+            resultats.append(_resultat(reservation.pk, False, "Le check-out a échoué. Le solde du client n'est pas nul ou l'affiliation n'est pas validée."))
+
+    if a_traiter:
+        pks = [r.pk for r in a_traiter]
+        Reservation.objects.filter(pk__in=pks).update(statut='terminee')
+
+        # Une réservation terminée ne bloque plus ses nuits
+        RoomNight.objects.filter(reservation_id__in=pks).delete()
+        invalider_nuits(nuit for r in a_traiter for nuit in nuits_entre(r.date_debut, r.date_fin))
+
+        Room.objects.filter(pk__in=[r.chambre_id for r in a_traiter]).update(statut='disponible', cleaning_status='sale')
+        invalider_chambres()
+
+        RoomCleaning.objects.bulk_create([
+            RoomCleaning(
+                chambre_id=reservation.chambre_id,
+                statut='a_faire',
+                priorite='normal',
+                notes=f"Nettoyage automatique après checkout de la réservation #{reservation.pk}"
+            )
+            for reservation in a_traiter
+        ])
+
+        ActivityLog.log_event(
+            user=user,
+            event_type='update',
+            module='reservations',
+            action=f"Check-out de groupe : {len(a_traiter)} réservation(s)",
+            details=f"Réservations {', '.join(map(str, pks))}",
+            object_type='Reservation',
+            severity='info'
+        )
+
+    return sorted(resultats, key=lambda r: r['id'])
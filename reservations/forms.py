@@ -50,8 +50,7 @@ class ReservationForm(forms.ModelForm):
             
             if date_debut and date_fin:
                 # Filtrer les chambres disponibles pour ces dates
-                from .models import Reservation
-                from rooms.models import Room
+                from .availability import chambres_disponibles as chambres_libres
                 
                 # Convertir les dates en objets date
                 from datetime import datetime
@@ -59,19 +58,10 @@ class ReservationForm(forms.ModelForm):
                     date_debut_obj = datetime.strptime(date_debut, '%Y-%m-%d').date()
                     date_fin_obj = datetime.strptime(date_fin, '%Y-%m-%d').date()
                     
-                    # Trouver les chambres déjà réservées pour ces dates
-                    chambres_occupees = Reservation.objects.filter(
-                        date_debut__lt=date_fin_obj,
-                        date_fin__gt=date_debut_obj,
-                        statut__in=['en_attente', 'confirmee', 'active']
-                    ).values_list('chambre_id', flat=True)
-                    
-                    # Filtrer les chambres disponibles (non occupées, statut disponible et statut de nettoyage inspectée)
-                    chambres_disponibles = Room.objects.filter(
-                        statut='disponible',
-                        cleaning_status='inspectee'
-                    ).exclude(
-                        id__in=chambres_occupees
+                    # Chambres libres sur toute la période (index d'occupation), prêtes à la vente.
+                    # En modification, les nuits de la réservation elle-même ne bloquent pas sa chambre.
+                    chambres_disponibles = chambres_libres(
+                        date_debut_obj, date_fin_obj, exclude_reservation=self.instance.pk
                     )
                     
                     # Mettre à jour le queryset du champ chambre
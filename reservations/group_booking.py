@@ -0,0 +1,159 @@
+# -*- coding: utf-8 -*-
+"""
+Réservations de groupe (tour-opérateurs) : un bloc de chambres pour un même
+client ou une même entreprise, vérifié en une passe et inséré en une seule
+transaction. Si une seule chambre est prise, rien n'est enregistré.
+Une demande invalide lève ValueError ; un conflit de chambres, ValidationError.
+"""
+import uuid
+
+from django.core.exceptions import ValidationError
+from django.db import transaction, IntegrityError
+
+from rooms.models import Room
+from .availability import chambres_occupees, nuits_entre
+from .availability_cache import invalider_nuits
+
+STATUTS_GROUPE = ['en_attente', 'confirmee']
+
+
+def _choisir_chambres(date_debut, date_fin, chambres_ids, par_categorie):
+    """
+    Résout la liste des chambres demandées ; lève ValueError pour une chambre inconnue,
+    ValidationError si le bloc est incomplet
+    """
+    occupees = set(chambres_occupees(date_debut, date_fin))
+    chambres = []
+
+    if chambres_ids:
+        demandees = Room.objects.in_bulk(chambres_ids)
+        inconnues = [pk for pk in chambres_ids if pk not in demandees]
+        if inconnues:
+            raise ValueError(f"Chambre(s) introuvable(s) : {', '.join(map(str, inconnues))}")
+        prises = [demandees[pk].numero for pk in chambres_ids if pk in occupees]
+        if prises:
+            raise ValidationError(f"Chambre(s) déjà réservée(s) sur la période : {', '.join(prises)}")
+        chambres.extend(demandees[pk] for pk in chambres_ids)
+
+    if par_categorie:
+        # Une seule requête pour toutes les catégories : chambres hors maintenance, libres et non déjà choisies
+        candidates = Room.objects.filter(
+            categorie_id__in=par_categorie.keys()
+        ).exclude(
+            statut='maintenance'
+        ).exclude(
+            id__in=occupees | set(chambres_ids)
+        ).order_by('categorie_id', 'numero')
+
+        libres = {}
+        for chambre in candidates:
+            libres.setdefault(chambre.categorie_id, []).append(chambre)
+
+        manquantes = []
+        for categorie_id, nombre in par_categorie.items():
+            disponibles = libres.get(categorie_id, [])
+            if len(disponibles) < nombre:
+                manquantes.append(f"catégorie {categorie_id} ({len(disponibles)}/{nombre})")
+            chambres.extend(disponibles[:nombre])
+        if manquantes:
+            raise ValidationError(f"Pas assez de chambres libres : {', '.join(manquantes)}")
+
+    return chambres
+
+
+def _valider_demande(date_debut, date_fin, chambres_ids, par_categorie, statut, mode_paiement, entreprise):
+    """Contrôle la demande avant toute requête ; lève ValueError avec le message d'erreur"""
+    from .models import Reservation
+
+    if date_fin <= date_debut:
+        raise ValueError("La date de fin doit être après la date de début")
+    if not chambres_ids and not par_categorie:
+        raise ValueError("Aucune chambre demandée")
+    if statut not in STATUTS_GROUPE:
+        raise ValueError("Une réservation de groupe doit être en attente ou confirmée")
+    modes = {mode for mode, libelle in Reservation._meta.get_field('mode_paiement').choices}
+    if mode_paiement not in modes:
+        raise ValueError(f"Mode de paiement inconnu ({mode_paiement})")
+    if entreprise is not None:
+        if not isinstance(entreprise, dict) or not str(entreprise.get('nom') or '').strip():
+            raise ValueError("Entreprise invalide : nom requis")
+        if len(str(entreprise['nom']).strip()) > 100 or len(str(entreprise.get('contact') or '')) > 100:
+            raise ValueError("Entreprise invalide : nom et contact limités à 100 caractères")
+
+
+def reserver_groupe(client, date_debut, date_fin, chambres_ids=(), par_categorie=None,
+                    statut='confirmee', mode_paiement='cash', entreprise=None, user=None):
+    """
+    Réserve un bloc de chambres pour un client.
+
+    chambres_ids : liste d'identifiants de chambres précises ;
+    par_categorie : {categorie_id: nombre de chambres} attribuées automatiquement ;
+    entreprise : {'nom': ..., 'contact': ...} pour créer l'affiliation de chaque réservation.
+    Retourne (reference_groupe, liste des réservations créées) ; lève ValueError si la
+    demande est invalide, ValidationError si les chambres ne sont pas disponibles.
+    """
+    from affiliations.models import Affiliation
+    from logs.models import ActivityLog
+    from .models import Reservation, RoomNight
+
+    chambres_ids = list(dict.fromkeys(chambres_ids))
+    _valider_demande(date_debut, date_fin, chambres_ids, par_categorie, statut, mode_paiement, entreprise)
+    reference = f"GRP-{uuid.uuid4().hex[:10].upper()}"
+    nuits = nuits_entre(date_debut, date_fin)
+
+    try:
+        with transaction.atomic():
+            chambres = _choisir_chambres(date_debut, date_fin, chambres_ids, par_categorie or {})
+
+            Reservation.objects.bulk_create([
+                Reservation(
+                    client=client,
+                    chambre=chambre,
+                    date_debut=date_debut,
+                    date_fin=date_fin,
+                    statut=statut,
+                    mode_paiement=mode_paiement,
+                    reference_groupe=reference,
+                )
+                for chambre in chambres
+            ])
+            # Relire par référence : tous les SGBD ne renvoient pas les clés après un bulk_create
+            reservations = list(
+                Reservation.objects.filter(reference_groupe=reference).select_related('chambre').order_by('chambre__numero')
+            )
+
+            # L'index d'occupation sert de verrou : une nuit prise entre-temps fait tout annuler
+            RoomNight.objects.bulk_create([
+                RoomNight(chambre_id=reservation.chambre_id, date=nuit, reservation=reservation, statut=statut)
+                for reservation in reservations
+                for nuit in nuits
+            ])
+
+            if entreprise:
+                Affiliation.objects.bulk_create([
+                    Affiliation(
+                        reservation=reservation,
+                        nom_entreprise=str(entreprise['nom']).strip(),
+                        contact_entreprise=str(entreprise.get('contact') or ''),
+                    )
+                    for reservation in reservations
+                ])
+
+            invalider_nuits(nuits)
+
+            # Une seule entrée de journal pour tout le bloc (bulk_create ne déclenche pas les signaux)
+            ActivityLog.log_event(
+                user=user,
+                event_type='create',
+                module='reservations',
+                action=f"Réservation de groupe {reference}: {len(reservations)} chambre(s) pour {client.nom}",
+                details=f"Du {date_debut} au {date_fin} - Chambres {', '.join(r.chambre.numero for r in reservations)}",
+                object_type='Reservation',
+                object_id=reference,
+                object_repr=reference,
+                severity='info'
+            )
+    except IntegrityError:
+        raise ValidationError("Une des chambres vient d'être réservée par une autre réservation. Aucune chambre n'a été réservée.")
+
+    return reference, reservations
@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+from reservations.availability import reconstruire_index
+
+
+class Command(BaseCommand):
+    help = "Reconstruit l'index d'occupation des chambres (RoomNight) à partir des réservations."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000, help="Nombre de nuits insérées par lot")
+
+    def handle(self, *args, **options):
+        total = reconstruire_index(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f"Index d'occupation reconstruit : {total} nuit(s) indexée(s)."))
@@ -0,0 +1,58 @@
+# Generated by Django 4.2.27 on 2026-10-18 16:20
+
+from django.db import migrations, models
+import datetime
+import django.db.models.deletion
+
+
+def indexer_reservations(apps, schema_editor):
+    """Remplit l'index d'occupation à partir des réservations existantes"""
+    Reservation = apps.get_model('reservations', 'Reservation')
+    RoomNight = apps.get_model('reservations', 'RoomNight')
+
+    batch = []
+    reservations = Reservation.objects.filter(statut__in=['en_attente', 'confirmee', 'active'])
+    for reservation in reservations.iterator():
+        for i in range((reservation.date_fin - reservation.date_debut).days):
+            batch.append(RoomNight(
+                chambre_id=reservation.chambre_id,
+                date=reservation.date_debut + datetime.timedelta(days=i),
+                reservation_id=reservation.pk,
+                statut=reservation.statut,
+            ))
+        if len(batch) >= 1000:
+            # Les chevauchements historiques éventuels sont ignorés (la première réservation garde la nuit)
+            RoomNight.objects.bulk_create(batch, ignore_conflicts=True)
+            batch = []
+    RoomNight.objects.bulk_create(batch, ignore_conflicts=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rooms', '0004_remove_room_groupe_alter_room_categorie_and_more'),
+        ('reservations', '0005_add_info_fields'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RoomNight',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField(verbose_name='Nuit du')),
+                ('statut', models.CharField(choices=[('en_attente', 'En attente'), ('confirmee', 'Confirmée'), ('active', 'Active'), ('annulee', 'Annulée'), ('terminee', 'Terminée')], max_length=20, verbose_name='Statut')),
+                ('chambre', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='nuits', to='rooms.room', verbose_name='Chambre')),
+                ('reservation', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='nuits', to='reservations.reservation', verbose_name='Réservation')),
+            ],
+            options={
+                'verbose_name': 'Nuit réservée',
+                'verbose_name_plural': 'Nuits réservées',
+                'indexes': [models.Index(fields=['date', 'chambre'], name='reservation_date_56df4a_idx')],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='roomnight',
+            constraint=models.UniqueConstraint(fields=('chambre', 'date'), name='unique_nuit_par_chambre'),
+        ),
+        migrations.RunPython(indexer_reservations, migrations.RunPython.noop),
+    ]
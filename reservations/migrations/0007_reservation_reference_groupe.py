@@ -0,0 +1,18 @@
+# Generated by Django 4.2.27 on 2026-10-18 16:23
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('reservations', '0006_roomnight'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='reservation',
+            name='reference_groupe',
+            field=models.CharField(blank=True, db_index=True, max_length=20, verbose_name='Référence de groupe'),
+        ),
+    ]
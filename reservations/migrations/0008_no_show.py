@@ -0,0 +1,23 @@
+# Generated by Django 4.2.27 on 2026-10-18 16:32
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('reservations', '0007_reservation_reference_groupe'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='reservation',
+            name='statut',
+            field=models.CharField(choices=[('en_attente', 'En attente'), ('confirmee', 'Confirmée'), ('active', 'Active'), ('annulee', 'Annulée'), ('terminee', 'Terminée'), ('no_show', 'No-show')], default='en_attente', max_length=20),
+        ),
+        migrations.AlterField(
+            model_name='roomnight',
+            name='statut',
+            field=models.CharField(choices=[('en_attente', 'En attente'), ('confirmee', 'Confirmée'), ('active', 'Active'), ('annulee', 'Annulée'), ('terminee', 'Terminée'), ('no_show', 'No-show')], max_length=20, verbose_name='Statut'),
+        ),
+    ]
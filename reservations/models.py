@@ -1,4 +1,4 @@
-from django.db import models
+from django.db import models, transaction, IntegrityError
 from clients.models import Client
 from rooms.models import Room
 from django.core.exceptions import ValidationError
@@ -11,8 +11,12 @@ class Reservation(models.Model):
         ('active', 'Active'),
         ('annulee', 'Annulée'),
         ('terminee', 'Terminée'),
+        ('no_show', 'No-show'),
     ]
 
+    # Statuts qui bloquent la chambre (indexés dans RoomNight)
+    STATUTS_BLOQUANTS = ['en_attente', 'confirmee', 'active']
+
     PAYMENT_MODE_CHOICES = [
         ('cash', 'Cash'),
         ('banque', 'Banque'),
@@ -33,6 +37,7 @@ class Reservation(models.Model):
     statut = models.CharField(max_length=20, choices=STATUS_CHOICES, default='en_attente')
     mode_paiement = models.CharField(max_length=20, choices=PAYMENT_MODE_CHOICES, default='cash')
     cash = models.DecimalField(max_digits=10, decimal_places=2, default=0.00, verbose_name="Montant Payé (Cash)")
+    reference_groupe = models.CharField(max_length=20, blank=True, db_index=True, verbose_name="Référence de groupe")
     created_at = models.DateTimeField(auto_now_add=True)
 
     def __str__(self):
@@ -46,27 +51,19 @@ class Reservation(models.Model):
         super().clean()
         
         # Vérifier les chevauchements seulement si la chambre et les dates sont définies
-        if self.chambre and self.date_debut and self.date_fin:
+        if self.chambre_id and self.date_debut and self.date_fin:
             # Vérifier que la date de fin est après la date de début
             if self.date_fin <= self.date_debut:
                 raise ValidationError("La date de fin doit être après la date de début")
             
-            # Vérifier les chevauchements avec d'autres réservations
-            chevauchements = Reservation.objects.filter(
-                chambre=self.chambre,
-                statut__in=['en_attente', 'confirmee', 'active'],  # Seulement les réservations actives
-                date_debut__lt=self.date_fin,
-                date_fin__gt=self.date_debut
-            )
-            
-            # Exclure la réservation actuelle si elle existe déjà
-            if self.pk:
-                chevauchements = chevauchements.exclude(pk=self.pk)
+            # Vérifier les chevauchements via l'index d'occupation (en excluant la réservation actuelle)
+            from .availability import nuit_en_conflit
+            conflit = nuit_en_conflit(self.chambre_id, self.date_debut, self.date_fin, exclude_reservation=self.pk)
             
-            if chevauchements.exists():
+            if conflit:
                 raise ValidationError(
-                    f"Cette chambre est déjà réservée du {chevauchements.first().date_debut} "
-                    f"au {chevauchements.first().date_fin}"
+                    f"Cette chambre est déjà réservée du {conflit.reservation.date_debut} "
+                    f"au {conflit.reservation.date_fin}"
                 )
 
     def save(self, *args, **kwargs):
@@ -77,30 +74,65 @@ class Reservation(models.Model):
         if not is_new:
             old_instance = Reservation.objects.get(pk=self.pk)
             old_status = old_instance.statut
+            nuits_modifiees = (
+                (old_instance.chambre_id, old_instance.date_debut, old_instance.date_fin, old_instance.statut)
+                != (self.chambre_id, self.date_debut, self.date_fin, self.statut)
+            )
         else:
             old_status = None
+            nuits_modifiees = True
 
-        super().save(*args, **kwargs)  # Sauvegarder d'abord
+        with transaction.atomic():
+            super().save(*args, **kwargs)  # Sauvegarder d'abord
 
-        # Si le statut vient de passer à 'active'
-        if self.statut == 'active' and old_status != 'active':
-            from billing.models import Invoice, InvoiceLine
+            # Maintenir l'index d'occupation des chambres
+            if nuits_modifiees:
+                from .availability import synchroniser_nuits
+                try:
+                    with transaction.atomic():
+                        synchroniser_nuits(self)
+                except IntegrityError:
+                    raise ValidationError("Cette chambre vient d'être réservée pour ces dates par une autre réservation")
 
-            # Créer la facture principale pour cette réservation
-            invoice, created = Invoice.objects.get_or_create(
-                client=self.client,
-                reservation=self,
-                defaults={'statut': 'impaye'}
-            )
+            # Si le statut vient de passer à 'active'
+            if self.statut == 'active' and old_status != 'active':
+                from billing.models import Invoice, InvoiceLine
 
-            # Si la facture vient d'être créée, ajouter la première nuitée
-            if created:
-                InvoiceLine.objects.create(
-                    facture=invoice,
-                    description=f"Nuitée du {self.date_debut.strftime('%d/%m/%Y')} - Chambre {self.chambre.numero}",
-                    quantite=1,
-                    prix_unitaire=self.chambre.categorie.prix
+                # Créer la facture principale pour cette réservation
+                invoice, created = Invoice.objects.get_or_create(
+                    client=self.client,
+                    reservation=self,
+                    defaults={'statut': 'impaye'}
                 )
-                invoice.calculer_totaux()
-                invoice.save()
 
+                # Si la facture vient d'être créée, ajouter la première nuitée
+                if created:
+                    InvoiceLine.objects.create(
+                        facture=invoice,
+                        description=f"Nuitée du {self.date_debut.strftime('%d/%m/%Y')} - Chambre {self.chambre.numero}",
+                        quantite=1,
+                        prix_unitaire=self.chambre.categorie.prix,
+                        reservation=self,
+                        date_nuitee=self.date_debut
+                    )
+
+
+class RoomNight(models.Model):
+    """Index d'occupation : une ligne par chambre et par nuit bloquée par une réservation"""
+    chambre = models.ForeignKey(Room, on_delete=models.CASCADE, related_name='nuits', verbose_name="Chambre")
+    date = models.DateField(verbose_name="Nuit du")
+    reservation = models.ForeignKey(Reservation, on_delete=models.CASCADE, related_name='nuits', verbose_name="Réservation")
+    statut = models.CharField(max_length=20, choices=Reservation.STATUS_CHOICES, verbose_name="Statut")
+
+    class Meta:
+        verbose_name = "Nuit réservée"
+        verbose_name_plural = "Nuits réservées"
+        constraints = [
+            models.UniqueConstraint(fields=['chambre', 'date'], name='unique_nuit_par_chambre'),
+        ]
+        indexes = [
+            models.Index(fields=['date', 'chambre']),
+        ]
+
+    def __str__(self):
+        return f"Chambre {self.chambre_id} - {self.date} (Resa {self.reservation_id})"
@@ -0,0 +1,26 @@
+# -*- coding: utf-8 -*-
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from rooms.models import Room
+from .models import Reservation
+from .availability import nuits_entre
+from .availability_cache import invalider_chambres, invalider_nuits
+
+
+@receiver(post_save, sender=Room)
+def invalider_disponibilites_chambre(sender, instance, created, **kwargs):
+    """Une chambre créée ou dont le statut / nettoyage change modifie les disponibilités"""
+    if created or instance.etat_modifie:
+        invalider_chambres()
+
+
+@receiver(post_delete, sender=Room)
+def invalider_disponibilites_suppression(sender, instance, **kwargs):
+    invalider_chambres()
+
+
+@receiver(post_delete, sender=Reservation)
+def invalider_disponibilites_reservation(sender, instance, **kwargs):
+    """Les nuits d'une réservation supprimée (index supprimé en cascade) redeviennent libres"""
+    if instance.statut in Reservation.STATUTS_BLOQUANTS:
+        invalider_nuits(nuits_entre(instance.date_debut, instance.date_fin))
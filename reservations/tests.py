@@ -1,3 +1,318 @@
+import datetime
+import json
+from decimal import Decimal
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from django.db import IntegrityError, connection, transaction
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from clients.models import Client
+from rooms.models import Room, RoomCategory
+from .availability import chambres_disponibles, grille_occupation, reconstruire_index
+from .availability_cache import chambres_disponibles_ids, statistiques
+from .models import Reservation, RoomNight
+
+
+class ReservationTestCase(TestCase):
+    """Un client et trois chambres prêtes à la vente"""
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(username='reception', password='secret')
+        self.client.force_login(self.user)
+        self.categorie = RoomCategory.objects.create(nom='Standard', prix=Decimal('25000.00'))
+        self.chambres = [
+            Room.objects.create(numero=numero, categorie=self.categorie, cleaning_status='inspectee')
+            for numero in ('101', '102', '103')
+        ]
+        self.hote = Client.objects.create(nom='Dupont', email='dupont@example.com')
+        self.jour = datetime.date(2026, 3, 10)
+
+    def date(self, decalage):
+        return self.jour + datetime.timedelta(days=decalage)
+
+    def reserver(self, chambre, debut, fin, statut='confirmee'):
+        return Reservation.objects.create(
+            client=self.hote, chambre=chambre, date_debut=self.date(debut), date_fin=self.date(fin), statut=statut
+        )
+
+
+class OccupationIndexTests(ReservationTestCase):
+    """Index d'occupation : une nuit par chambre et par date"""
+
+    def test_nuits_indexees(self):
+        reservation = self.reserver(self.chambres[0], 0, 3)
+
+        # La nuit du départ n'est pas bloquée
+        self.assertEqual(
+            list(RoomNight.objects.filter(reservation=reservation).order_by('date').values_list('date', flat=True)),
+            [self.date(0), self.date(1), self.date(2)],
+        )
+
+    def test_chevauchement_refuse(self):
+        self.reserver(self.chambres[0], 0, 3)
+
+        with self.assertRaises(ValidationError):
+            self.reserver(self.chambres[0], 2, 5)
+        # Arrivée le jour du départ précédent : autorisée
+        self.reserver(self.chambres[0], 3, 5)
+        self.assertEqual(Reservation.objects.count(), 2)
+        self.assertEqual(RoomNight.objects.count(), 5)
+
+    def test_contrainte_unique_en_base(self):
+        reservation = self.reserver(self.chambres[0], 0, 2)
+
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            RoomNight.objects.create(chambre=self.chambres[0], date=self.date(1), reservation=reservation, statut='confirmee')
+
+    def test_nuits_liberees(self):
+        reservation = self.reserver(self.chambres[0], 0, 3)
+        reservation.statut = 'annulee'
+        reservation.save()
+
+        self.assertFalse(RoomNight.objects.exists())
+        self.assertIn(self.chambres[0], chambres_disponibles(self.date(0), self.date(3)))
+        self.reserver(self.chambres[0], 1, 2)
+
+    def test_reconstruction(self):
+        self.reserver(self.chambres[0], 0, 3)
+        self.reserver(self.chambres[1], 1, 2)
+        self.reserver(self.chambres[2], 0, 2, statut='annulee')
+        RoomNight.objects.all().delete()
+
+        self.assertEqual(reconstruire_index(batch_size=2), 4)
+        self.assertEqual(set(chambres_disponibles(self.date(0), self.date(3))), {self.chambres[2]})
+
+
+class GrilleDisponibilitesTests(ReservationTestCase):
+    """Grille chambres x dates du planning"""
+
+    def grille(self, **params):
+        return self.client.get(reverse('grille_disponibilites_api'), params)
+
+    def test_plages_encodees(self):
+        premiere = self.reserver(self.chambres[0], 1, 4)
+        seconde = self.reserver(self.chambres[0], 4, 5, statut='en_attente')
+        hors_fenetre = self.reserver(self.chambres[1], 10, 12)
+
+        response = self.grille(date_debut=self.date(0).isoformat(), jours=7)
+
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual(data['jours'], 7)
+        lignes = {ligne['numero']: ligne['occupation'] for ligne in data['chambres']}
+        # Deux réservations contiguës restent deux plages distinctes
+        self.assertEqual(lignes['101'], [[1, 3, 'confirmee', premiere.pk], [4, 1, 'en_attente', seconde.pk]])
+        self.assertEqual(lignes['102'], [])
+        self.assertEqual(lignes['103'], [])
+        self.assertNotIn(hors_fenetre.pk, [plage[3] for plages in lignes.values() for plage in plages])
+
+    def test_nombre_de_requetes_constant(self):
+        for i, chambre in enumerate(self.chambres):
+            self.reserver(chambre, i, i + 2)
+        debut = self.date(0).isoformat()
+
+        with self.assertNumQueries(2):
+            grille_occupation(self.date(0), 30)
+        self.assertEqual(self.grille(date_debut=debut, date_fin=self.date(30).isoformat()).json()['jours'], 30)
+
+    def test_parametres_invalides(self):
+        debut = self.date(0).isoformat()
+        self.assertEqual(self.grille().status_code, 400)
+        self.assertEqual(self.grille(date_debut='10/03/2026').status_code, 400)
+        self.assertEqual(self.grille(date_debut=debut, jours=0).status_code, 400)
+        self.assertEqual(self.grille(date_debut=debut, jours=91).status_code, 400)
+        self.assertEqual(self.grille(date_debut=debut, date_fin=self.date(-1).isoformat()).status_code, 400)
+
+
+class CacheDisponibilitesTests(ReservationTestCase):
+    """Cache des chambres disponibles, invalidé par nuit"""
+
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+
+    def disponibles(self, debut, fin):
+        return set(chambres_disponibles_ids(self.date(debut), self.date(fin)))
+
+    def test_lecture_en_cache(self):
+        tous = {chambre.pk for chambre in self.chambres}
+        self.assertEqual(self.disponibles(0, 3), tous)
+
+        with CaptureQueriesContext(connection) as requetes:
+            self.assertEqual(self.disponibles(0, 3), tous)
+        # Servi par le cache : aucune requête sur les chambres ni sur l'index
+        self.assertFalse([q for q in requetes if 'rooms_room' in q['sql'] or 'roomnight' in q['sql']])
+        self.assertEqual(statistiques()['hits'], 1)
+        self.assertEqual(statistiques()['misses'], 1)
+
+    def test_reservation_invalide_les_periodes_chevauchantes(self):
+        self.disponibles(0, 3)
+        self.disponibles(5, 7)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.reserver(self.chambres[0], 2, 4)
+
+        self.assertNotIn(self.chambres[0].pk, self.disponibles(0, 3))
+        self.assertEqual(statistiques()['misses'], 3)
+        # Une période sans nuit commune reste servie par le cache
+        self.disponibles(5, 7)
+        self.assertEqual(statistiques()['hits'], 1)
+
+    def test_annulation_libere_la_chambre(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            reservation = self.reserver(self.chambres[0], 0, 2)
+        self.assertNotIn(self.chambres[0].pk, self.disponibles(0, 2))
+
+        reservation.statut = 'annulee'
+        with self.captureOnCommitCallbacks(execute=True):
+            reservation.save()
+        self.assertIn(self.chambres[0].pk, self.disponibles(0, 2))
+
+    def test_etat_chambre_invalide_tout(self):
+        self.disponibles(0, 3)
+        chambre = self.chambres[1]
+        chambre.cleaning_status = 'sale'
+        with self.captureOnCommitCallbacks(execute=True):
+            chambre.save()
+
+        self.assertNotIn(chambre.pk, self.disponibles(0, 3))
+        self.assertEqual(statistiques()['hits'], 0)
+
+
+class ReservationGroupeTests(ReservationTestCase):
+    """Réservation de groupe : tout le bloc ou rien"""
+
+    def demande(self, **donnees):
+        corps = {
+            'client_id': self.hote.pk,
+            'date_debut': self.date(0).isoformat(),
+            'date_fin': self.date(2).isoformat(),
+        }
+        corps.update(donnees)
+        return self.client.post(reverse('reservation_groupe_api'), json.dumps(corps), content_type='application/json')
+
+    def test_bloc_reserve(self):
+        response = self.demande(
+            chambres=[self.chambres[2].pk],
+            categories={str(self.categorie.pk): 2},
+            entreprise={'nom': 'Voyages Sahel', 'contact': 'M. Diallo'},
+        )
+
+        self.assertEqual(response.status_code, 201)
+        data = response.json()
+        self.assertEqual(len(data['reservations']), 3)
+        reservations = Reservation.objects.filter(reference_groupe=data['reference_groupe'])
+        self.assertEqual(reservations.count(), 3)
+        self.assertEqual(RoomNight.objects.count(), 6)
+        self.assertEqual(
+            set(reservations.values_list('affiliation__nom_entreprise', flat=True)), {'Voyages Sahel'}
+        )
+
+    def test_conflit_aucune_chambre_reservee(self):
+        self.reserver(self.chambres[1], 1, 3)
+
+        response = self.demande(
+            chambres=[self.chambres[0].pk, self.chambres[1].pk],
+            client={'nom': 'Tour Opérateur', 'email': 'to@example.com'},
+            client_id=None,
+        )
+
+        self.assertEqual(response.status_code, 409)
+        self.assertFalse(response.json()['success'])
+        self.assertEqual(Reservation.objects.count(), 1)
+        self.assertEqual(RoomNight.objects.count(), 2)
+        # Le nouveau client n'est pas conservé quand le bloc échoue
+        self.assertFalse(Client.objects.filter(email='to@example.com').exists())
+
+    def test_categorie_insuffisante(self):
+        response = self.demande(categories={str(self.categorie.pk): 4})
+
+        self.assertEqual(response.status_code, 409)
+        self.assertFalse(Reservation.objects.exists())
+
+    def test_demandes_invalides(self):
+        cas = [
+            {'date_debut': '10/03/2026'},
+            {'date_fin': self.date(0).isoformat(), 'chambres': [self.chambres[0].pk]},
+            {'chambres': ['abc']},
+            {'chambres': []},
+            {'chambres': [999999]},
+            {'chambres': [self.chambres[0].pk], 'statut': 'active'},
+            {'chambres': [self.chambres[0].pk], 'mode_paiement': 'troc'},
+            {'chambres': [self.chambres[0].pk], 'entreprise': {'contact': 'sans nom'}},
+            {'chambres': [self.chambres[0].pk], 'client_id': 'x'},
+        ]
+        for donnees in cas:
+            with self.subTest(donnees=donnees):
+                response = self.demande(**donnees)
+                self.assertEqual(response.status_code, 400)
+                self.assertFalse(response.json()['success'])
+        self.assertFalse(Reservation.objects.exists())
+
+
+class ActionsDeGroupeTests(ReservationTestCase):
+    """Check-in / check-out en lot"""
+
+    def setUp(self):
+        super().setUp()
+        self.reservations = [self.reserver(chambre, 0, 2) for chambre in self.chambres[:2]]
+        Reservation.objects.filter(pk__in=[r.pk for r in self.reservations]).update(reference_groupe='GRP-TEST')
+        self.en_attente = self.reserver(self.chambres[2], 0, 2, statut='en_attente')
+
+    def action(self, url_name, **corps):
+        return self.client.post(reverse(url_name), json.dumps(corps), content_type='application/json')
+
+    def test_check_in_par_reference(self):
+        from billing.models import Invoice
+
+        data = self.action(
+            'reservation_check_in_groupe', reference_groupe='GRP-TEST', reservations=[self.en_attente.pk, 999999]
+        ).json()
+
+        self.assertEqual(data['traitees'], 2)
+        echecs = {r['id'] for r in data['resultats'] if not r['success']}
+        self.assertEqual(echecs, {self.en_attente.pk, 999999})
+        self.assertEqual(set(Reservation.objects.filter(statut='active')), set(self.reservations))
+        self.assertEqual(RoomNight.objects.filter(statut='active').count(), 4)
+        self.assertEqual(Room.objects.filter(statut='occupee').count(), 2)
+
+        factures = Invoice.objects.filter(reservation__in=self.reservations)
+        self.assertEqual(factures.count(), 2)
+        self.assertTrue(all(facture.lines.count() == 1 for facture in factures))
+        self.hote.refresh_from_db()
+        self.assertEqual(self.hote.solde, sum(f.montant_total for f in factures))
+
+        # Relancer le check-in ne rouvre pas de facture
+        data = self.action('reservation_check_in_groupe', reference_groupe='GRP-TEST').json()
+        self.assertEqual(data['traitees'], 0)
+        self.assertEqual(Invoice.objects.count(), 2)
+
+    def test_check_out_solde_non_nul(self):
+        self.action('reservation_check_in_groupe', reference_groupe='GRP-TEST')
+
+        data = self.action('reservation_check_out_groupe', reference_groupe='GRP-TEST').json()
+
+        self.assertEqual(data['traitees'], 0)
+        self.assertEqual(Reservation.objects.filter(statut='active').count(), 2)
+
+    def test_check_out_libere_les_chambres(self):
+        from services.models import RoomCleaning
+
+        self.action('reservation_check_in_groupe', reference_groupe='GRP-TEST')
+        Client.objects.filter(pk=self.hote.pk).update(solde=0)
+
+        data = self.action('reservation_check_out_groupe', reservations=[r.pk for r in self.reservations]).json()
+
+        self.assertEqual(data['traitees'], 2)
+        self.assertEqual(Reservation.objects.filter(statut='terminee').count(), 2)
+        self.assertEqual(list(RoomNight.objects.values_list('reservation_id', flat=True).distinct()), [self.en_attente.pk])
+        self.assertEqual(Room.objects.filter(statut='disponible', cleaning_status='sale').count(), 2)
+        self.assertEqual(RoomCleaning.objects.filter(statut='a_faire').count(), 2)
 
-# Create your tests here.
+    def test_lot_invalide(self):
+        self.assertEqual(self.action('reservation_check_in_groupe').status_code, 400)
+        self.assertEqual(self.action('reservation_check_in_groupe', reservations=['abc']).status_code, 400)
@@ -1,5 +1,9 @@
 from django.urls import path
-from .views import ReservationListView, ReservationCreateView, ReservationUpdateView, ReservationDeleteView, check_in_reservation, check_out_reservation, chambres_disponibles_api
+from .views import (
+    ReservationListView, ReservationCreateView, ReservationUpdateView, ReservationDeleteView,
+    check_in_reservation, check_out_reservation, chambres_disponibles_api, chambres_disponibles_stats_api,
+    grille_disponibilites_api, reservation_groupe_api, check_in_groupe_api, check_out_groupe_api,
+)
 
 urlpatterns = [
     path('', ReservationListView.as_view(), name='reservation_list'),
@@ -9,4 +13,9 @@ urlpatterns = [
     path('<int:pk>/check-in/', check_in_reservation, name='reservation_check_in'),
     path('<int:pk>/check-out/', check_out_reservation, name='reservation_check_out'),
     path('chambres-disponibles/', chambres_disponibles_api, name='chambres_disponibles_api'),
+    path('chambres-disponibles/stats/', chambres_disponibles_stats_api, name='chambres_disponibles_stats_api'),
+    path('groupe/', reservation_groupe_api, name='reservation_groupe_api'),
+    path('groupe/check-in/', check_in_groupe_api, name='reservation_check_in_groupe'),
+    path('groupe/check-out/', check_out_groupe_api, name='reservation_check_out_groupe'),
+    path('grille-disponibilites/', grille_disponibilites_api, name='grille_disponibilites_api'),
 ]
@@ -3,6 +3,10 @@ from django.urls import reverse_lazy
 from django.contrib.auth.mixins import LoginRequiredMixin
 from .models import Reservation
 from .forms import ReservationForm
+from .availability import grille_occupation
+from .availability_cache import chambres_disponibles_ids, statistiques
+from .group_booking import reserver_groupe
+from .bulk_actions import check_in_groupe, check_out_groupe
 from clients.models import Client
 from rooms.models import Room
 from django import forms
@@ -63,8 +67,12 @@ class ReservationCreateView(LoginRequiredMixin, CreateView):
 from django.shortcuts import get_object_or_404, redirect
 from django.contrib import messages
 from django.http import JsonResponse
+from django.core.exceptions import ValidationError
+from django.db import transaction
+from django.views.decorators.http import require_POST
 from datetime import datetime
 from django.contrib.auth.decorators import login_required
+import json
 
 from affiliations.models import Affiliation
 from services.models import RoomCleaning
@@ -107,27 +115,14 @@ def chambres_disponibles_api(request):
         if date_fin <= date_debut:
             return JsonResponse({'error': 'La date de fin doit être après la date de début'}, status=400)
         
-        # Trouver les chambres déjà réservées pour ces dates
-        from .models import Reservation
-        from rooms.models import Room
-        
-        chambres_occupees = Reservation.objects.filter(
-            date_debut__lt=date_fin,
-            date_fin__gt=date_debut,
-            statut__in=['en_attente', 'confirmee', 'active']
-        ).values_list('chambre_id', flat=True)
-        
-        # Filtrer les chambres disponibles (non occupées, statut disponible et statut de nettoyage inspectée)
-        chambres_disponibles = Room.objects.filter(
-            statut='disponible',
-            cleaning_status='inspectee'
-        ).exclude(
-            id__in=chambres_occupees
+        # Chambres libres sur toute la période (cache invalidé par nuit, sinon index d'occupation)
+        chambres = Room.objects.filter(
+            id__in=chambres_disponibles_ids(date_debut, date_fin)
         ).select_related('categorie')
         
         # Préparer les données de réponse
         chambres_data = []
-        for chambre in chambres_disponibles:
+        for chambre in chambres:
             chambres_data.append({
                 'id': chambre.id,
                 'numero': chambre.numero,
@@ -142,6 +137,169 @@ def chambres_disponibles_api(request):
     except Exception as e:
         return JsonResponse({'error': f'Erreur serveur: {str(e)}'}, status=500)
 
+@login_required
+def chambres_disponibles_stats_api(request):
+    """Compteurs hit / miss du cache des chambres disponibles"""
+    return JsonResponse(statistiques())
+
+
+@login_required
+@require_POST
+def reservation_groupe_api(request):
+    """
+    API de réservation de groupe. Corps JSON :
+    {"client_id": 1 | "client": {"nom", "email", "telephone", "adresse"},
+     "entreprise": {"nom", "contact"} (optionnel),
+     "date_debut": "YYYY-MM-DD", "date_fin": "YYYY-MM-DD",
+     "chambres": [ids] et/ou "categories": {"categorie_id": nombre},
+     "statut": "confirmee", "mode_paiement": "cash"}
+    """
+    try:
+        data = json.loads(request.body)
+        if not isinstance(data, dict):
+            raise TypeError
+        date_debut = datetime.strptime(data['date_debut'], '%Y-%m-%d').date()
+        date_fin = datetime.strptime(data['date_fin'], '%Y-%m-%d').date()
+        chambres_ids = [int(pk) for pk in data.get('chambres', [])]
+        par_categorie = {int(cat): int(nombre) for cat, nombre in data.get('categories', {}).items() if int(nombre) > 0}
+    except (ValueError, KeyError, TypeError, AttributeError):
+        return JsonResponse({'success': False, 'error': 'Requête invalide : dates YYYY-MM-DD, chambres et catégories numériques'}, status=400)
+
+    # Client existant ou nouveau client (même logique que le formulaire de réservation)
+    infos = None
+    if data.get('client_id'):
+        try:
+            client = Client.objects.filter(pk=int(data['client_id'])).first()
+        except (ValueError, TypeError):
+            return JsonResponse({'success': False, 'error': 'client_id invalide'}, status=400)
+        if client is None:
+            return JsonResponse({'success': False, 'error': 'Client introuvable'}, status=404)
+    else:
+        infos = data.get('client') or {}
+        if not isinstance(infos, dict) or not infos.get('nom') or not (infos.get('email') or infos.get('telephone')):
+            return JsonResponse({'success': False, 'error': 'Client requis : client_id, ou nom avec e-mail ou téléphone'}, status=400)
+
+    try:
+        # Un nouveau client n'est conservé que si le bloc est réservé
+        with transaction.atomic():
+            if infos is not None:
+                lookup = {'email': infos['email']} if infos.get('email') else {'telephone': infos['telephone']}
+                client, created = Client.objects.get_or_create(
+                    **lookup,
+                    defaults={
+                        'nom': infos['nom'],
+                        'email': infos.get('email', ''),
+                        'telephone': infos.get('telephone'),
+                        'adresse': infos.get('adresse'),
+                    }
+                )
+            reference, reservations = reserver_groupe(
+                client,
+                date_debut,
+                date_fin,
+                chambres_ids=chambres_ids,
+                par_categorie=par_categorie,
+                statut=data.get('statut', 'confirmee'),
+                mode_paiement=data.get('mode_paiement', 'cash'),
+                entreprise=data.get('entreprise'),
+                user=request.user,
+            )
+    except ValueError as e:
+        # Demande invalide (statut, mode de paiement, entreprise, chambre inconnue...)
+        return JsonResponse({'success': False, 'error': str(e)}, status=400)
+    except ValidationError as e:
+        # Conflit : chambres déjà prises ou bloc incomplet sur la période
+        return JsonResponse({'success': False, 'error': ' '.join(e.messages)}, status=409)
+
+    return JsonResponse({
+        'success': True,
+        'reference_groupe': reference,
+        'client_id': client.pk,
+        'reservations': [
+            {'id': r.pk, 'chambre_id': r.chambre_id, 'chambre': r.chambre.numero}
+            for r in reservations
+        ],
+    }, status=201)
+
+
+def _reservations_du_lot(request):
+    """Identifiants ciblés par une action de groupe : liste explicite et/ou référence de groupe"""
+    data = json.loads(request.body) if request.content_type == 'application/json' else {
+        'reservations': request.POST.getlist('reservations'),
+        'reference_groupe': request.POST.get('reference_groupe'),
+    }
+    ids = [int(pk) for pk in data.get('reservations') or []]
+    if data.get('reference_groupe'):
+        ids += Reservation.objects.filter(reference_groupe=data['reference_groupe']).values_list('pk', flat=True)
+    return list(dict.fromkeys(ids))
+
+
+def _action_de_groupe(request, action):
+    try:
+        ids = _reservations_du_lot(request)
+    except (ValueError, TypeError, AttributeError):
+        return JsonResponse({'success': False, 'error': 'Liste de réservations invalide'}, status=400)
+    if not ids:
+        return JsonResponse({'success': False, 'error': 'Aucune réservation sélectionnée'}, status=400)
+
+    resultats = action(ids, user=request.user)
+    return JsonResponse({
+        'success': True,
+        'traitees': sum(1 for r in resultats if r['success']),
+        'resultats': resultats,
+    })
+
+
+@login_required
+@require_POST
+def check_in_groupe_api(request):
+    """Check-in en lot : {"reservations": [ids]} et/ou {"reference_groupe": "GRP-..."}"""
+    return _action_de_groupe(request, check_in_groupe)
+
+
+@login_required
+@require_POST
+def check_out_groupe_api(request):
+    """Check-out en lot : {"reservations": [ids]} et/ou {"reference_groupe": "GRP-..."}"""
+    return _action_de_groupe(request, check_out_groupe)
+
+
+GRILLE_MAX_JOURS = 90
+
+@login_required
+def grille_disponibilites_api(request):
+    """API endpoint renvoyant la grille d'occupation chambres x dates (planning de la réception)"""
+    date_debut_str = request.GET.get('date_debut')
+    
+    if not date_debut_str:
+        return JsonResponse({'error': 'Le paramètre date_debut est requis'}, status=400)
+    
+    try:
+        date_debut = datetime.strptime(date_debut_str, '%Y-%m-%d').date()
+        
+        # La fenêtre est donnée soit par date_fin, soit par un nombre de jours
+        date_fin_str = request.GET.get('date_fin')
+        if date_fin_str:
+            nb_jours = (datetime.strptime(date_fin_str, '%Y-%m-%d').date() - date_debut).days
+        else:
+            nb_jours = int(request.GET.get('jours', 30))
+        
+        if nb_jours <= 0:
+            return JsonResponse({'error': 'La date de fin doit être après la date de début'}, status=400)
+        if nb_jours > GRILLE_MAX_JOURS:
+            return JsonResponse({'error': f'La fenêtre ne peut pas dépasser {GRILLE_MAX_JOURS} jours'}, status=400)
+        
+        return JsonResponse({
+            'date_debut': date_debut.isoformat(),
+            'jours': nb_jours,
+            'chambres': grille_occupation(date_debut, nb_jours),
+        })
+        
+    except ValueError:
+        return JsonResponse({'error': 'Paramètres invalides. Dates au format YYYY-MM-DD, jours entier'}, status=400)
+    except Exception as e:
+        return JsonResponse({'error': f'Erreur serveur: {str(e)}'}, status=500)
+
 from affiliations.models import Affiliation
 
 @login_required
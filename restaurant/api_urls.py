@@ -4,5 +4,11 @@ from . import views
 urlpatterns = [
     path('order/<int:order_id>/', views.order_details_api, name='order_details_api'),
     path('pending-orders/', views.get_pending_orders_api, name='get_pending_orders_api'),
+    path('orders/deliver/', views.deliver_orders_api, name='deliver_orders_api'),
+    path('orders/changes/', views.order_changes_api, name='order_changes_api'),
+    path('kitchen/tickets/', views.kitchen_tickets_api, name='kitchen_tickets_api'),
+    path('kitchen/tickets/<int:item_id>/bump/', views.kitchen_bump_api, name='kitchen_bump_api'),
+    path('menu/catalogue/', views.menu_catalog_api, name='menu_catalog_api'),
     path('place-order/', views.place_order_api, name='place_order_api'),
+    path('place-orders/batch/', views.place_orders_batch_api, name='place_orders_batch_api'),
 ]
@@ -0,0 +1,10 @@
+from django.apps import AppConfig
+
+
+class RestaurantConfig(AppConfig):
+    default_auto_field = 'django.db.models.BigAutoField'
+    name = 'restaurant'
+
+    def ready(self):
+        """Import signals when app is ready"""
+        import restaurant.signals
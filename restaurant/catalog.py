@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+"""
+Catalogue du menu pour les terminaux POS : plats, catégories et services
+sérialisés une seule fois en JSON et gardés en cache sous leur numéro de version.
+La version est une ligne en base (CatalogueVersion), incrémentée dans la
+transaction qui modifie un plat, une catégorie ou un service (signaux) : tous
+les workers voient la même. Elle sert d'ETag, un terminal à jour reçoit un 304.
+"""
+import json
+
+from django.core.cache import cache
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction, IntegrityError
+from django.db.models import F
+
+from services.models import Service
+from .models import CatalogueVersion, DishCategory, MenuItem
+
+DUREE_ENTREE = 24 * 3600  # secondes ; une nouvelle version rend l'ancienne entrée introuvable
+
+
+def version_catalogue():
+    """Numéro de version courant, lu en base (une requête sur la ligne unique)"""
+    numero = CatalogueVersion.objects.filter(pk=1).values_list('numero', flat=True).first()
+    return str(numero or 0)
+
+
+def construire_catalogue():
+    """Contenu du catalogue (trois requêtes, quel que soit le nombre de plats)"""
+    return {
+        'categories': [
+            {'id': categorie.pk, 'nom': categorie.nom}
+            for categorie in DishCategory.objects.order_by('nom')
+        ],
+        'plats': [
+            {
+                'id': plat.pk,
+                'nom': plat.nom,
+                'prix': plat.prix,
+                'categorie': plat.categorie_id,
+                'image': plat.image.url if plat.image else None,
+                'description': plat.description or '',
+                'temps_cuisson': plat.temps_cuisson,
+            }
+            for plat in MenuItem.objects.order_by('categorie__nom', 'nom')
+        ],
+        'services': [
+            {'id': service.pk, 'nom': service.name, 'prix': service.price, 'categorie': service.category.name}
+            for service in Service.objects.select_related('category').order_by('category__name', 'name')
+        ],
+    }
+
+
+def catalogue():
+    """Retourne (version, JSON du catalogue en octets), sérialisé une fois par version"""
+    version = version_catalogue()
+    cle = f'catalogue:{version}'
+    contenu = cache.get(cle)
+    if contenu is None:
+        contenu = json.dumps(
+            dict(construire_catalogue(), version=version), cls=DjangoJSONEncoder, ensure_ascii=False
+        ).encode('utf-8')
+        cache.set(cle, contenu, DUREE_ENTREE)
+    return version, contenu
+
+
+def invalider_catalogue():
+    """Nouvelle version du catalogue, validée avec la modification qui la déclenche"""
+    if CatalogueVersion.objects.filter(pk=1).update(numero=F('numero') + 1):
+        return
+    try:
+        with transaction.atomic():
+            CatalogueVersion.objects.create(pk=1, numero=1)
+    except IntegrityError:
+        # Créée en parallèle par un autre processus
+        CatalogueVersion.objects.filter(pk=1).update(numero=F('numero') + 1)
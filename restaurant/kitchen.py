@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+"""
+Écran cuisine : chaque ligne d'une commande en préparation est un ticket, servi
+par ordre d'heure promise (file de priorité tenue par l'index
+statut_cuisine/heure_promise). L'écran charge la file une fois puis ne relit
+que les tickets des commandes modifiées depuis son dernier curseur.
+"""
+from datetime import timedelta
+
+from django.db import transaction
+from django.utils import timezone
+
+from .models import Order, OrderItem, signaler_changement_commandes
+
+# Recouvrement du curseur : couvre les transactions validées pendant la lecture
+RECOUVREMENT = timedelta(seconds=2)
+
+
+def _tickets():
+    return OrderItem.objects.select_related('plat', 'commande').order_by('heure_promise', 'pk')
+
+
+def ticket_json(ligne, maintenant):
+    commande = ligne.commande
+    return {
+        'id': ligne.pk,
+        'commande': commande.pk,
+        'plat': ligne.plat.nom,
+        'quantite': ligne.quantite,
+        'table': commande.numero_table or '',
+        'chambre': commande.chambre_id,
+        'heure_commande': commande.date.isoformat(),
+        'heure_promise': ligne.heure_promise.isoformat() if ligne.heure_promise else None,
+        'en_retard': bool(ligne.heure_promise and ligne.heure_promise < maintenant),
+        # Ticket à afficher : plat à préparer d'une commande toujours en préparation
+        'ouvert': ligne.statut_cuisine == 'a_preparer' and commande.statut == 'en_prepa',
+    }
+
+
+def file_cuisine(depuis=None):
+    """
+    Tickets de l'écran cuisine triés par heure promise.
+    Sans curseur : tous les tickets ouverts. Avec curseur : toutes les lignes des
+    commandes modifiées depuis (y compris fermées, pour les retirer de l'écran).
+    Retourne (tickets, curseur suivant).
+    """
+    maintenant = timezone.now()
+    if depuis is None:
+        lignes = _tickets().filter(statut_cuisine='a_preparer', commande__statut='en_prepa')
+    else:
+        lignes = _tickets().filter(commande__modifie_le__gt=depuis - RECOUVREMENT)
+    return [ticket_json(ligne, maintenant) for ligne in lignes], maintenant
+
+
+def terminer_ticket(ligne_id):
+    """
+    Marque un ticket prêt (idempotent) et avance modifie_le de la commande pour que les
+    écrans le retirent. Retourne (ticket modifié ?, commande entièrement prête ?) ;
+    OrderItem.DoesNotExist si la ligne n'existe pas.
+    """
+    maintenant = timezone.now()
+    with transaction.atomic():
+        commande_id = OrderItem.objects.values_list('commande_id', flat=True).get(pk=ligne_id)
+        modifie = OrderItem.objects.filter(pk=ligne_id, statut_cuisine='a_preparer').update(
+            statut_cuisine='pret', termine_le=maintenant
+        )
+        if modifie:
+            Order.objects.filter(pk=commande_id).update(modifie_le=maintenant)
+            signaler_changement_commandes()
+        reste = OrderItem.objects.filter(commande_id=commande_id, statut_cuisine='a_preparer').exists()
+    return bool(modifie), not reste
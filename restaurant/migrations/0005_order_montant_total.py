@@ -0,0 +1,33 @@
+# Generated by Django 4.2.27 on 2026-10-18 16:50
+
+from django.db import migrations, models
+from django.db.models import DecimalField, ExpressionWrapper, F, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+
+
+def calculer_totaux(apps, schema_editor):
+    """Reprend le total de chaque commande existante depuis ses lignes, en une requête"""
+    Order = apps.get_model('restaurant', 'Order')
+    OrderItem = apps.get_model('restaurant', 'OrderItem')
+    montant = DecimalField(max_digits=10, decimal_places=2)
+
+    somme = OrderItem.objects.filter(commande=OuterRef('pk')).values('commande').annotate(
+        s=Sum(ExpressionWrapper(F('prix_unitaire') * F('quantite'), output_field=montant))
+    ).values('s')
+    Order.objects.update(montant_total=Coalesce(Subquery(somme, output_field=montant), Value(0), output_field=montant))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('restaurant', '0004_dishcategory_alter_menuitem_categorie'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='order',
+            name='montant_total',
+            field=models.DecimalField(decimal_places=2, default=0, editable=False, max_digits=10, verbose_name='Total'),
+        ),
+        migrations.RunPython(calculer_totaux, migrations.RunPython.noop),
+    ]
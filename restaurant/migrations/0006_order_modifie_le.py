@@ -0,0 +1,26 @@
+# Generated by Django 4.2.27 on 2026-10-18 16:51
+
+from django.db import migrations, models
+from django.db.models import F
+
+
+def reprendre_dates(apps, schema_editor):
+    """Commandes existantes : dernière modification connue = date de création"""
+    Order = apps.get_model('restaurant', 'Order')
+    Order.objects.update(modifie_le=F('date'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('restaurant', '0005_order_montant_total'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='order',
+            name='modifie_le',
+            field=models.DateTimeField(auto_now=True, db_index=True, verbose_name='Modifiée le'),
+        ),
+        migrations.RunPython(reprendre_dates, migrations.RunPython.noop),
+    ]
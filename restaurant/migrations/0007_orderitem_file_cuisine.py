@@ -0,0 +1,51 @@
+# Generated by Django 4.2.27 on 2026-10-18 16:52
+
+from datetime import timedelta
+
+from django.db import migrations, models
+from django.db.models import Max, OuterRef, Subquery
+
+
+def reprendre_file_cuisine(apps, schema_editor):
+    """Lignes des commandes déjà servies : prêtes ; commandes en préparation : heure promise calculée"""
+    Order = apps.get_model('restaurant', 'Order')
+    OrderItem = apps.get_model('restaurant', 'OrderItem')
+
+    modifiee_le = Order.objects.filter(pk=OuterRef('commande_id')).values('modifie_le')[:1]
+    OrderItem.objects.exclude(commande__statut='en_prepa').update(statut_cuisine='pret', termine_le=Subquery(modifiee_le))
+
+    en_cours = Order.objects.filter(statut='en_prepa').annotate(cuisson=Max('items__plat__temps_cuisson'))
+    for commande in en_cours.iterator():
+        OrderItem.objects.filter(commande_id=commande.pk).update(
+            heure_promise=commande.date + timedelta(minutes=commande.cuisson or 0)
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('restaurant', '0006_order_modifie_le'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='orderitem',
+            name='heure_promise',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='Heure promise'),
+        ),
+        migrations.AddField(
+            model_name='orderitem',
+            name='statut_cuisine',
+            field=models.CharField(choices=[('a_preparer', 'À préparer'), ('pret', 'Prêt')], default='a_preparer', max_length=20, verbose_name='Statut cuisine'),
+        ),
+        migrations.AddField(
+            model_name='orderitem',
+            name='termine_le',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='Terminé le'),
+        ),
+        migrations.AddIndex(
+            model_name='orderitem',
+            index=models.Index(fields=['statut_cuisine', 'heure_promise'], name='restaurant_file_cuisine_idx'),
+        ),
+        migrations.RunPython(reprendre_file_cuisine, migrations.RunPython.noop),
+    ]
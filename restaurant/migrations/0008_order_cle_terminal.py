@@ -0,0 +1,18 @@
+# Generated by Django 4.2.27 on 2026-10-18 16:55
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('restaurant', '0007_orderitem_file_cuisine'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='order',
+            name='cle_terminal',
+            field=models.CharField(blank=True, editable=False, max_length=64, null=True, unique=True, verbose_name='Clé terminal'),
+        ),
+    ]
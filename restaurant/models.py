@@ -1,4 +1,9 @@
-from django.db import models
+from datetime import timedelta
+from decimal import Decimal
+from django.core.cache import cache
+from django.db import models, transaction
+from django.db.models import F, OuterRef, Subquery
+from django.utils import timezone
 from clients.models import Client
 from rooms.models import Room
 from django.conf import settings
@@ -25,6 +30,44 @@ class MenuItem(models.Model):
     def __str__(self):
         return self.nom
 
+class CatalogueVersion(models.Model):
+    """Version du catalogue du menu (ligne unique), incrémentée à chaque changement de plat, catégorie ou service"""
+    numero = models.PositiveBigIntegerField(default=0, verbose_name="Numéro de version")
+
+    def __str__(self):
+        return f"Catalogue v{self.numero}"
+
+    class Meta:
+        verbose_name = "Version du catalogue"
+        verbose_name_plural = "Versions du catalogue"
+
+# Compteur incrémenté à chaque changement de commande : réveille les attentes longues du POS
+CLE_VERSION_COMMANDES = 'restaurant:commandes:version'
+
+
+def signaler_changement_commandes():
+    """Incrémente le compteur de changements une fois la transaction validée"""
+    def incrementer():
+        try:
+            cache.incr(CLE_VERSION_COMMANDES)
+        except ValueError:
+            cache.set(CLE_VERSION_COMMANDES, 1, None)
+    transaction.on_commit(incrementer)
+
+
+class OrderQuerySet(models.QuerySet):
+    def avec_client(self):
+        """
+        Charge agent et client, et annote le nom du client de la réservation active de
+        la chambre : get_client_name() ne fait alors plus aucune requête.
+        """
+        from reservations.models import Reservation
+        client_actif = Reservation.objects.filter(
+            chambre=OuterRef('chambre'), statut='active'
+        ).order_by('pk').values('client__nom')[:1]
+        return self.select_related('agent', 'client').annotate(nom_client_actif=Subquery(client_actif))
+
+
 class Order(models.Model):
     STATUS_CHOICES = [
         ('en_prepa', 'En préparation'),
@@ -56,48 +99,68 @@ class Order(models.Model):
         ('chambre', 'Sur la chambre'),
         ('abonnee', 'Abonné'),
     ], default='cash', verbose_name="Mode de paiement")
+    # Somme des lignes, tenue à jour par OrderItem.save()/delete()
+    montant_total = models.DecimalField(max_digits=10, decimal_places=2, default=0, editable=False, verbose_name="Total")
+    # Curseur des changements (création, statut, total) suivis par le POS
+    modifie_le = models.DateTimeField(auto_now=True, db_index=True, verbose_name="Modifiée le")
+    # Identifiant généré par le terminal POS : une commande renvoyée après une coupure n'est créée qu'une fois
+    cle_terminal = models.CharField(max_length=64, unique=True, null=True, blank=True, editable=False, verbose_name="Clé terminal")
+
+    objects = OrderQuerySet.as_manager()
     
     @property
     def total(self):
-        return sum(item.total for item in self.items.all())
+        return self.montant_total
+
+    @classmethod
+    def appliquer_ecart(cls, order_id, ecart):
+        """Reporte l'écart de montant d'une ligne sur le total de la commande, sans relire les lignes"""
+        if ecart:
+            cls.objects.filter(pk=order_id).update(montant_total=F('montant_total') + ecart, modifie_le=timezone.now())
+            signaler_changement_commandes()
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Statut chargé : le passage à 'livre' se détecte à la sauvegarde sans relire la commande
+        instance._statut_initial = instance.__dict__.get('statut')
+        return instance
 
     def save(self, *args, **kwargs):
-        # Automatically trigger billing for residents when status is 'livre'
-        if self.pk:
-            old_order = Order.objects.get(pk=self.pk)
-            if old_order.statut != 'livre' and self.statut == 'livre':
-                if self.type_commande == 'resident' and self.chambre:
-                    # Logic to integrate into existing invoice for active reservation
-                    from billing.models import Invoice, InvoiceLine
-                    if self.chambre.reservation_set.filter(statut='active').exists():
-                        reservation = self.chambre.reservation_set.filter(statut='active').first()
-                        client = reservation.client
-                        
-                        invoice, created = Invoice.objects.get_or_create(
-                            client=client,
-                            statut='impaye',
-                            defaults={'reservation': reservation}
-                        )
-                        
-                        for item in self.items.all():
-                            InvoiceLine.objects.create(
-                                facture=invoice,
-                                description=f"Restaurant: {item.plat.nom}",
-                                quantite=item.quantite,
-                                prix_unitaire=item.plat.prix
-                            )
-                        
-                        invoice.calculer_totaux()
-                        invoice.save()
-
-        super().save(*args, **kwargs)
+        # Passage à 'livre' d'une commande résident : facturation sur le folio de la chambre
+        a_poster = (
+            self.statut == 'livre'
+            and not self._state.adding
+            and getattr(self, '_statut_initial', None) not in (None, 'livre')
+            and self.type_commande == 'resident'
+            and self.chambre_id is not None
+        )
+
+        if not self._state.adding and kwargs.get('update_fields') is None and not kwargs.get('force_insert'):
+            # Total tenu par les lignes (F()) : ne pas l'écraser avec une valeur en mémoire périmée
+            kwargs['update_fields'] = [
+                f.name for f in self._meta.concrete_fields if not f.primary_key and f.name != 'montant_total'
+            ]
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            if a_poster:
+                from billing.folios import poster_commandes
+                poster_commandes([self.pk])
+        self._statut_initial = self.statut
+        signaler_changement_commandes()
 
     def get_client_name(self):
         if self.type_commande == 'resident':
-            if self.chambre and self.chambre.reservation_set.filter(statut='active').exists():
-                return self.chambre.reservation_set.filter(statut='active').first().client.get_full_name()
+            if hasattr(self, 'nom_client_actif'):
+                # Annoté par Order.objects.avec_client()
+                nom_actif = self.nom_client_actif
+            else:
+                reservation = self.chambre.reservation_set.filter(statut='active').select_related('client').first() if self.chambre_id else None
+                nom_actif = reservation.client.nom if reservation else None
+            if nom_actif:
+                return nom_actif
             elif self.client:
-                return self.client.get_full_name()
+                return self.client.nom
             return "Résident Inconnu"
         else: # 'passage'
             return self.nom_client_passage or "Client de Passage"
@@ -107,14 +170,76 @@ class Order(models.Model):
         return f"Commande {self.id} - {ident} ({self.total} FCFA)"
 
 class OrderItem(models.Model):
+    STATUT_CUISINE_CHOICES = [
+        ('a_preparer', 'À préparer'),
+        ('pret', 'Prêt'),
+    ]
+
     commande = models.ForeignKey(Order, related_name='items', on_delete=models.CASCADE)
     plat = models.ForeignKey(MenuItem, on_delete=models.CASCADE)
     quantite = models.PositiveIntegerField(default=1)
     prix_unitaire = models.DecimalField(max_digits=8, decimal_places=2, default=0, verbose_name="Prix Unitaire")
 
+    # Écran cuisine : file des tickets triée par heure promise
+    statut_cuisine = models.CharField(max_length=20, choices=STATUT_CUISINE_CHOICES, default='a_preparer', verbose_name="Statut cuisine")
+    heure_promise = models.DateTimeField(null=True, blank=True, verbose_name="Heure promise")
+    termine_le = models.DateTimeField(null=True, blank=True, verbose_name="Terminé le")
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['statut_cuisine', 'heure_promise'], name='restaurant_file_cuisine_idx'),
+        ]
+
+    @staticmethod
+    def promettre(commande, lignes):
+        """
+        Heure promise des lignes d'une commande : heure de commande + temps de cuisson
+        le plus long de la commande, pour que les plats d'une même table sortent ensemble.
+        Les plats des lignes doivent être chargés.
+        """
+        if not lignes:
+            return
+        debut = commande.date or timezone.now()
+        cuisson = max(ligne.plat.temps_cuisson for ligne in lignes)
+        for ligne in lignes:
+            ligne.heure_promise = debut + timedelta(minutes=cuisson)
+
     @property
     def total(self):
         return self.prix_unitaire * self.quantite
 
+    def save(self, *args, **kwargs):
+        if self.heure_promise is None:
+            OrderItem.promettre(self.commande, [self])
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+
+            # Reporter l'écart sur la commande (et l'ancienne commande si la ligne a changé de commande)
+            ancienne_commande = getattr(self, '_commande_initiale', None)
+            ancien_total = getattr(self, '_total_initial', Decimal('0'))
+            if ancienne_commande and ancienne_commande != self.commande_id:
+                Order.appliquer_ecart(ancienne_commande, -ancien_total)
+                ancien_total = Decimal('0')
+            Order.appliquer_ecart(self.commande_id, self.total - ancien_total)
+
+        self._commande_initiale = self.commande_id
+        self._total_initial = self.total
+
+    def delete(self, *args, **kwargs):
+        commande_id = self.commande_id
+        total = getattr(self, '_total_initial', self.total)
+        with transaction.atomic():
+            result = super().delete(*args, **kwargs)
+            Order.appliquer_ecart(commande_id, -total)
+        return result
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Valeurs chargées : l'écart se calcule à la sauvegarde sans relire la ligne
+        instance._commande_initiale = instance.__dict__.get('commande_id')
+        instance._total_initial = instance.__dict__.get('prix_unitaire', Decimal('0')) * instance.__dict__.get('quantite', 0)
+        return instance
+
     def __str__(self):
         return f"{self.quantite}x {self.plat.nom}"
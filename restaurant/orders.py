@@ -0,0 +1,217 @@
+# -*- coding: utf-8 -*-
+"""
+Enregistrement des commandes POS, à l'unité ou par lot (terminal resynchronisé
+après une coupure réseau). Chaque commande porte une clé générée par le terminal
+(cle_terminal, unique) : une commande renvoyée n'est créée qu'une fois. Plats et
+réservations sont chargés en une requête pour tout le lot ; commandes et lignes
+sont insérées en bloc dans une seule transaction.
+"""
+import uuid
+from decimal import Decimal
+
+from django.db import transaction, IntegrityError
+from django.utils import timezone
+
+from reservations.models import Reservation
+from .models import Order, OrderItem, MenuItem, signaler_changement_commandes
+
+MODES_PAIEMENT = {mode for mode, libelle in Order._meta.get_field('mode_paiement').choices}
+
+
+def _entier(valeur):
+    try:
+        return int(valeur)
+    except (TypeError, ValueError):
+        return None
+
+
+def _cle_terminal(d):
+    """Clé terminal en texte (None si absente) ; lève ValueError si ce n'est ni un texte ni un entier"""
+    valeur = d.get('cle_terminal')
+    if valeur is None:
+        return None
+    if isinstance(valeur, bool) or not isinstance(valeur, (str, int)):
+        raise ValueError('Clé terminal invalide')
+    return str(valeur).strip() or None
+
+
+def _lignes(items, plats):
+    """Lignes validées [(plat, quantité)] ; lève ValueError avec le message d'erreur"""
+    if not items:
+        raise ValueError('Panier vide')
+    if not isinstance(items, list):
+        raise ValueError('Panier invalide')
+    lignes, inconnus = [], []
+    for item in items:
+        if not isinstance(item, dict):
+            raise ValueError('Ligne de panier invalide')
+        plat_id, quantite = _entier(item.get('id')), _entier(item.get('qty'))
+        if plat_id is None or quantite is None:
+            raise ValueError('Ligne de panier invalide')
+        if quantite <= 0:
+            raise ValueError('Quantité invalide')
+        if plat_id not in plats:
+            inconnus.append(plat_id)
+            continue
+        lignes.append((plats[plat_id], quantite))
+    if inconnus:
+        raise ValueError(f"Plat(s) introuvable(s) : {', '.join(map(str, sorted(set(inconnus))))}")
+    return lignes
+
+
+def _commande(d, user, plats, reservations):
+    """Commande (non enregistrée) et ses lignes depuis les données du POS ; lève ValueError"""
+    lignes = _lignes(d.get('items'), plats)
+
+    type_commande = d.get('type_commande')
+    if type_commande not in ('resident', 'passage'):
+        raise ValueError('Type de commande invalide')
+    mode_paiement = d.get('payment_method') or 'cash'
+    if mode_paiement not in MODES_PAIEMENT:
+        raise ValueError(f"Mode de paiement inconnu ({mode_paiement})")
+
+    order = Order(
+        agent=user,
+        type_commande=type_commande,
+        numero_table=(str(d['table'])[:10] if d.get('table') else None),
+        mode_paiement=mode_paiement,
+        statut='en_prepa',
+        # Clé serveur si le terminal n'en fournit pas : sert aussi à relire la commande insérée
+        cle_terminal=_cle_terminal(d) or uuid.uuid4().hex,
+        # Total stocké posé directement : bulk_create ne passe pas par OrderItem.save()
+        montant_total=sum((plat.prix * quantite for plat, quantite in lignes), Decimal('0')),
+    )
+
+    if type_commande == 'resident':
+        res_id = _entier(d.get('reservation_id'))
+        if not res_id:
+            raise ValueError('ID Réservation manquant')
+        if res_id not in reservations:
+            raise ValueError('Réservation introuvable')
+        order.client_id = reservations[res_id].client_id
+        order.chambre_id = reservations[res_id].chambre_id
+    else:
+        order.nom_client_passage = (d.get('customer_name') or "Client de passage")[:100]
+        if order.mode_paiement != 'chambre':
+            order.paiement_effectue = True
+
+    items = [
+        OrderItem(plat=plat, quantite=quantite, prix_unitaire=plat.prix)
+        for plat, quantite in lignes
+    ]
+    return order, items
+
+
+def _cle_ou_none(d):
+    try:
+        return _cle_terminal(d)
+    except ValueError:
+        return None
+
+
+def _enregistrer(donnees, user):
+    cles = {_cle_ou_none(d) for d in donnees if isinstance(d, dict)} - {None}
+    existantes = dict(
+        Order.objects.filter(cle_terminal__in=cles).values_list('cle_terminal', 'id')
+    ) if cles else {}
+
+    plats_ids, reservations_ids = set(), set()
+    for d in donnees:
+        if isinstance(d, dict):
+            for item in d.get('items') or []:
+                if isinstance(item, dict) and _entier(item.get('id')) is not None:
+                    plats_ids.add(_entier(item.get('id')))
+            if _entier(d.get('reservation_id')):
+                reservations_ids.add(_entier(d.get('reservation_id')))
+    plats = MenuItem.objects.in_bulk(plats_ids)
+    reservations = Reservation.objects.only('client_id', 'chambre_id').in_bulk(reservations_ids)
+
+    resultats, a_creer, vues = [], [], set()
+    for d in donnees:
+        if not isinstance(d, dict):
+            resultats.append({'cle_terminal': None, 'statut': 'erreur', 'error': 'Commande invalide'})
+            continue
+        try:
+            cle = _cle_terminal(d)
+        except ValueError as e:
+            resultats.append({'cle_terminal': None, 'statut': 'erreur', 'error': str(e)})
+            continue
+        resultat = {'cle_terminal': cle}
+        resultats.append(resultat)
+        if cle and len(cle) > 64:
+            resultat.update(statut='erreur', error='Clé terminal trop longue (64 caractères maximum)')
+        elif cle in existantes or cle in vues:
+            # Déjà reçue (envoi précédent ou doublon dans le lot) : rien n'est recréé
+            resultat.update(statut='doublon', order_id=existantes.get(cle))
+        else:
+            try:
+                order, items = _commande(d, user, plats, reservations)
+            except ValueError as e:
+                resultat.update(statut='erreur', error=str(e))
+                continue
+            if cle:
+                vues.add(cle)
+            a_creer.append((resultat, order, items))
+
+    if a_creer:
+        with transaction.atomic():
+            commandes = Order.objects.bulk_create([order for _, order, _ in a_creer])
+            if any(order.pk is None for order in commandes):
+                # Clés primaires non renvoyées par le SGBD (MySQL) : relecture par clé terminal
+                ids = dict(Order.objects.filter(
+                    cle_terminal__in=[order.cle_terminal for order in commandes]
+                ).values_list('cle_terminal', 'id'))
+                for order in commandes:
+                    order.pk = ids[order.cle_terminal]
+
+            lignes = []
+            for resultat, order, items in a_creer:
+                for item in items:
+                    item.commande = order
+                OrderItem.promettre(order, items)
+                lignes.extend(items)
+                resultat.update(statut='cree', order_id=order.pk, total=float(order.montant_total))
+            OrderItem.objects.bulk_create(lignes, batch_size=500)
+            signaler_changement_commandes()
+
+    # Doublons internes au lot : même commande que la première occurrence
+    creees = {r['cle_terminal']: r['order_id'] for r in resultats if r.get('statut') == 'cree' and r['cle_terminal']}
+    for resultat in resultats:
+        if resultat.get('statut') == 'doublon' and resultat.get('order_id') is None:
+            resultat['order_id'] = creees.get(resultat['cle_terminal'])
+    return resultats
+
+
+def enregistrer_commandes(donnees, user):
+    """
+    Enregistre une liste de commandes POS ; retourne un résultat par commande, dans
+    l'ordre : statut 'cree' (order_id, total), 'doublon' (order_id) ou 'erreur' (error).
+    Les commandes invalides sont ignorées sans bloquer les autres.
+    """
+    try:
+        return _enregistrer(donnees, user)
+    except IntegrityError:
+        # Même clé envoyée au même instant par une autre requête : relancer, elle sera vue comme doublon
+        return _enregistrer(donnees, user)
+
+
+def livrer_commandes(order_ids):
+    """
+    Passe en une fois les commandes en préparation à 'livre' (tournée room service) et
+    poste celles des résidents sur leur folio, dans une seule transaction. Les commandes
+    déjà livrées ou payées sont laissées telles quelles (pas de double facturation).
+    Retourne (ids livrés, commandes résidents non facturées avec leur motif).
+    """
+    from billing.folios import poster_commandes
+
+    with transaction.atomic():
+        # Verrou : deux livreurs validant la même commande ne la facturent qu'une fois
+        livrees = list(
+            Order.objects.select_for_update().filter(pk__in=order_ids, statut='en_prepa').values_list('id', flat=True)
+        )
+        if not livrees:
+            return [], []
+        Order.objects.filter(pk__in=livrees).update(statut='livre', modifie_le=timezone.now())
+        _, ignorees = poster_commandes(livrees)
+        signaler_changement_commandes()
+    return livrees, ignorees
@@ -0,0 +1,19 @@
+# -*- coding: utf-8 -*-
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from services.models import Service, ServiceCategory
+from .models import DishCategory, MenuItem
+from .catalog import invalider_catalogue
+
+
+@receiver(post_save, sender=MenuItem)
+@receiver(post_delete, sender=MenuItem)
+@receiver(post_save, sender=DishCategory)
+@receiver(post_delete, sender=DishCategory)
+@receiver(post_save, sender=Service)
+@receiver(post_delete, sender=Service)
+@receiver(post_save, sender=ServiceCategory)
+@receiver(post_delete, sender=ServiceCategory)
+def invalider_catalogue_menu(sender, **kwargs):
+    """Tout changement de plat, catégorie ou service publie une nouvelle version du catalogue"""
+    invalider_catalogue()
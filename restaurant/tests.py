@@ -0,0 +1,384 @@
+import datetime
+import json
+from decimal import Decimal
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import connection
+from django.db.models import Sum
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from billing.models import Invoice, InvoiceLine, MouvementSolde
+from clients.models import Client
+from reservations.models import Reservation
+from restaurant.models import DishCategory, MenuItem, Order, OrderItem
+from rooms.models import Room, RoomCategory
+from services.models import ServiceCategory
+
+
+class POSTestCase(TestCase):
+    """Utilisateur connecté et deux plats du menu"""
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(username='serveur', password='secret')
+        self.client.force_login(self.user)
+        categorie = DishCategory.objects.create(nom='Plats')
+        self.poulet = MenuItem.objects.create(nom='Poulet DG', prix=Decimal('4500.00'), categorie=categorie)
+        self.jus = MenuItem.objects.create(nom='Jus de bissap', prix=Decimal('750.00'), categorie=categorie)
+
+    def commande(self, cle=None, **donnees):
+        commande = {
+            'type_commande': 'passage',
+            'payment_method': 'cash',
+            'items': [{'id': self.poulet.pk, 'qty': 2}, {'id': self.jus.pk, 'qty': 3}],
+        }
+        if cle is not None:
+            commande['cle_terminal'] = cle
+        commande.update(donnees)
+        return commande
+
+    def post(self, url_name, corps):
+        return self.client.post(reverse(url_name), json.dumps(corps), content_type='application/json')
+
+
+class BatchOrderSyncTests(POSTestCase):
+    """Synchronisation par lot d'un terminal resté hors ligne"""
+
+    def test_doublons_dans_le_lot_et_renvoi(self):
+        lot = {'commandes': [self.commande('T1-001'), self.commande('T1-002'), self.commande('T1-001')]}
+        resultats = self.post('place_orders_batch_api', lot).json()['resultats']
+
+        self.assertEqual([r['statut'] for r in resultats], ['cree', 'cree', 'doublon'])
+        self.assertEqual(resultats[2]['order_id'], resultats[0]['order_id'])
+        self.assertEqual(Order.objects.count(), 2)
+        self.assertEqual(OrderItem.objects.count(), 4)
+
+        # Lot renvoyé après une coupure : rien n'est recréé
+        data = self.post('place_orders_batch_api', lot).json()
+        self.assertEqual((data['creees'], data['doublons']), (0, 3))
+        self.assertEqual(Order.objects.count(), 2)
+
+    def test_commande_invalide_ignoree(self):
+        lot = {'commandes': [
+            self.commande('T1-010'),
+            self.commande('T1-011', items=[{'id': 999999, 'qty': 1}]),
+            self.commande('T1-012', payment_method='bitcoin'),
+            'pas une commande',
+        ]}
+        response = self.post('place_orders_batch_api', lot)
+
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual([r['statut'] for r in data['resultats']], ['cree', 'erreur', 'erreur', 'erreur'])
+        self.assertEqual(list(Order.objects.values_list('cle_terminal', flat=True)), ['T1-010'])
+
+    def test_cle_terminal_non_textuelle(self):
+        lot = {'commandes': [self.commande(123), self.commande(['T1']), self.commande('T1-020')]}
+        response = self.post('place_orders_batch_api', lot)
+
+        self.assertEqual(response.status_code, 200)
+        resultats = response.json()['resultats']
+        self.assertEqual([r['statut'] for r in resultats], ['cree', 'erreur', 'cree'])
+        self.assertEqual(resultats[0]['cle_terminal'], '123')
+        # Une clé numérique renvoyée est reconnue comme la même commande
+        resultats = self.post('place_orders_batch_api', {'commandes': [self.commande(123)]}).json()['resultats']
+        self.assertEqual(resultats[0]['statut'], 'doublon')
+        self.assertEqual(Order.objects.count(), 2)
+
+
+class PlaceOrderApiTests(POSTestCase):
+    """Commande unique depuis le POS"""
+
+    def test_total_calcule_par_le_serveur(self):
+        data = self.post('place_order_api', self.commande('T2-001', total=1)).json()
+
+        self.assertTrue(data['success'])
+        # 2 x 4500 + 3 x 750, le total envoyé par le terminal est ignoré
+        self.assertEqual(data['total'], 11250.0)
+        order = Order.objects.get(pk=data['order_id'])
+        self.assertEqual(order.montant_total, Decimal('11250.00'))
+        self.assertEqual(order.items.count(), 2)
+
+    def test_commande_renvoyee_non_recreee(self):
+        premiere = self.post('place_order_api', self.commande('T2-002')).json()
+        seconde = self.post('place_order_api', self.commande('T2-002')).json()
+
+        self.assertTrue(seconde['doublon'])
+        self.assertEqual(seconde['order_id'], premiere['order_id'])
+        self.assertEqual(seconde['total'], premiere['total'])
+        self.assertEqual(Order.objects.count(), 1)
+
+    def test_cle_terminal_invalide(self):
+        response = self.post('place_order_api', self.commande({'cle': 1}))
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()['error'], 'Clé terminal invalide')
+
+        data = self.post('place_order_api', self.commande(456)).json()
+        self.assertTrue(data['success'])
+        self.assertTrue(self.post('place_order_api', self.commande('456')).json()['doublon'])
+        self.assertEqual(Order.objects.count(), 1)
+
+
+class OrderTotalTests(POSTestCase):
+    """Total de commande tenu à jour par les lignes"""
+
+    def test_total_suit_les_lignes(self):
+        order = Order.objects.create(agent=self.user)
+        ligne = OrderItem.objects.create(commande=order, plat=self.poulet, quantite=2, prix_unitaire=self.poulet.prix)
+        OrderItem.objects.create(commande=order, plat=self.jus, quantite=1, prix_unitaire=self.jus.prix)
+        order.refresh_from_db()
+        self.assertEqual(order.montant_total, Decimal('9750.00'))
+
+        ligne = OrderItem.objects.get(pk=ligne.pk)
+        ligne.quantite = 1
+        ligne.save()
+        order.refresh_from_db()
+        self.assertEqual(order.montant_total, Decimal('5250.00'))
+
+        ligne.delete()
+        order.refresh_from_db()
+        self.assertEqual(order.montant_total, Decimal('750.00'))
+
+    def test_ligne_deplacee_et_commande_perimee(self):
+        source = Order.objects.create(agent=self.user)
+        cible = Order.objects.create(agent=self.user)
+        perimee = Order.objects.get(pk=cible.pk)
+        ligne = OrderItem.objects.create(commande=source, plat=self.poulet, quantite=1, prix_unitaire=self.poulet.prix)
+
+        ligne = OrderItem.objects.get(pk=ligne.pk)
+        ligne.commande = cible
+        ligne.save()
+        # Une instance chargée avant l'ajout de la ligne n'écrase pas le total en base
+        perimee.numero_table = '7'
+        perimee.save()
+
+        self.assertEqual(Order.objects.get(pk=source.pk).montant_total, Decimal('0.00'))
+        self.assertEqual(Order.objects.get(pk=cible.pk).montant_total, Decimal('4500.00'))
+
+
+class PendingOrdersFeedTests(POSTestCase):
+    """Flux des commandes en cours du POS"""
+
+    def flux(self, **entetes):
+        return self.client.get(reverse('get_pending_orders_api'), **entetes)
+
+    def requetes(self):
+        with CaptureQueriesContext(connection) as requetes:
+            self.assertEqual(self.flux().status_code, 200)
+        return len(requetes)
+
+    def test_nombre_de_requetes_constant(self):
+        categorie = RoomCategory.objects.create(nom='Standard', prix=Decimal('25000'))
+        hote = Client.objects.create(nom='Dupont', email='dupont@example.com')
+        self.post('place_order_api', self.commande('T3-001'))
+        une_commande = self.requetes()
+
+        for numero in ('101', '102', '103'):
+            reservation = Reservation.objects.create(
+                client=hote, chambre=Room.objects.create(numero=numero, categorie=categorie), statut='active',
+                date_debut=datetime.date(2026, 3, 10), date_fin=datetime.date(2026, 3, 12),
+            )
+            self.post('place_order_api', self.commande(f'T3-{numero}', type_commande='resident', reservation_id=reservation.pk))
+
+        self.assertEqual(self.requetes(), une_commande)
+        data = self.flux().json()
+        self.assertEqual(len(data), 4)
+        self.assertEqual({commande['total'] for commande in data}, {11250.0})
+        self.assertEqual([commande['client'] for commande in data].count('Dupont'), 3)
+
+    def test_etag(self):
+        self.post('place_order_api', self.commande('T3-010'))
+        etag = self.flux()['ETag']
+
+        self.assertEqual(self.flux(HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        self.post('place_order_api', self.commande('T3-011'))
+        response = self.flux(HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()), 2)
+
+
+class KitchenQueueTests(POSTestCase):
+    """File de l'écran cuisine par heure promise"""
+
+    def setUp(self):
+        super().setUp()
+        MenuItem.objects.filter(pk=self.poulet.pk).update(temps_cuisson=40)
+        MenuItem.objects.filter(pk=self.jus.pk).update(temps_cuisson=5)
+
+    def passer(self, cle, items):
+        return Order.objects.get(pk=self.post('place_order_api', self.commande(cle, items=items)).json()['order_id'])
+
+    def tickets(self, **params):
+        return self.client.get(reverse('kitchen_tickets_api'), params).json()
+
+    def bump(self, ligne):
+        return self.client.post(reverse('kitchen_bump_api', args=[ligne.pk])).json()
+
+    def test_heure_promise_commune_a_la_commande(self):
+        order = self.passer('T4-001', [{'id': self.poulet.pk, 'qty': 1}, {'id': self.jus.pk, 'qty': 1}])
+
+        heures = set(order.items.values_list('heure_promise', flat=True))
+        self.assertEqual(heures, {order.date + datetime.timedelta(minutes=40)})
+
+    def test_file_triee_par_heure_promise(self):
+        lente = self.passer('T4-010', [{'id': self.poulet.pk, 'qty': 1}])
+        rapide = self.passer('T4-011', [{'id': self.jus.pk, 'qty': 2}])
+
+        data = self.tickets()
+
+        self.assertTrue(data['complet'])
+        self.assertEqual([ticket['commande'] for ticket in data['tickets']], [rapide.pk, lente.pk])
+        self.assertTrue(all(ticket['ouvert'] for ticket in data['tickets']))
+
+    def test_bump_idempotent(self):
+        order = self.passer('T4-020', [{'id': self.poulet.pk, 'qty': 1}, {'id': self.jus.pk, 'qty': 1}])
+        poulet, jus = order.items.order_by('pk')
+        curseur = self.tickets()['curseur']
+
+        self.assertEqual(self.bump(jus), {'success': True, 'modifie': True, 'commande_prete': False})
+        self.assertEqual(self.bump(jus), {'success': True, 'modifie': False, 'commande_prete': False})
+        self.assertEqual(self.bump(poulet), {'success': True, 'modifie': True, 'commande_prete': True})
+        self.assertEqual(OrderItem.objects.filter(statut_cuisine='pret', termine_le__isnull=False).count(), 2)
+
+        self.assertEqual(self.tickets()['tickets'], [])
+        # Relecture incrémentale : les tickets fermés sont renvoyés pour être retirés de l'écran
+        suivis = self.tickets(depuis=curseur)
+        self.assertFalse(suivis['complet'])
+        self.assertEqual({(t['id'], t['ouvert']) for t in suivis['tickets']}, {(poulet.pk, False), (jus.pk, False)})
+
+    def test_ticket_introuvable_ou_curseur_invalide(self):
+        response = self.client.post(reverse('kitchen_bump_api', args=[999999]))
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(self.client.get(reverse('kitchen_tickets_api'), {'depuis': 'hier'}).status_code, 400)
+
+
+class MenuCatalogTests(POSTestCase):
+    """Catalogue versionné du menu"""
+
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+
+    def catalogue(self, **entetes):
+        return self.client.get(reverse('menu_catalog_api'), **entetes)
+
+    def test_304_si_version_a_jour(self):
+        response = self.catalogue()
+        data = json.loads(response.content)
+        self.assertEqual({plat['nom'] for plat in data['plats']}, {'Poulet DG', 'Jus de bissap'})
+        self.assertEqual(response['ETag'], f'"{data["version"]}"')
+
+        with CaptureQueriesContext(connection) as requetes:
+            self.assertEqual(self.catalogue(HTTP_IF_NONE_MATCH=response['ETag']).status_code, 304)
+        self.assertFalse([q for q in requetes if 'restaurant_menuitem' in q['sql']])
+
+    def test_version_incrementee_par_un_changement(self):
+        etag = self.catalogue()['ETag']
+
+        self.jus.prix = Decimal('1000.00')
+        self.jus.save()
+
+        response = self.catalogue(HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        prix = {plat['nom']: plat['prix'] for plat in json.loads(response.content)['plats']}
+        self.assertEqual(prix['Jus de bissap'], '1000.00')
+
+        etag = response['ETag']
+        ServiceCategory.objects.create(name='Blanchisserie')
+        self.assertEqual(self.catalogue(HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_contenu_serialise_une_fois_par_version(self):
+        self.catalogue()
+        with CaptureQueriesContext(connection) as requetes:
+            self.assertEqual(self.catalogue().status_code, 200)
+        self.assertFalse([q for q in requetes if 'restaurant_menuitem' in q['sql']])
+
+
+class DeliverOrdersTests(POSTestCase):
+    """Livraison groupée : commandes résidents postées une fois sur le folio"""
+
+    def setUp(self):
+        super().setUp()
+        self.hote = Client.objects.create(nom='Dupont', email='dupont@example.com')
+        self.reservation = Reservation.objects.create(
+            client=self.hote,
+            chambre=Room.objects.create(numero='101', categorie=RoomCategory.objects.create(nom='Standard', prix=Decimal('25000'))),
+            statut='active', date_debut=datetime.date(2026, 3, 10), date_fin=datetime.date(2026, 3, 12),
+        )
+        self.folio = Invoice.objects.get(reservation=self.reservation)
+
+    def passer(self, cle, **donnees):
+        return self.post('place_order_api', self.commande(cle, **donnees)).json()['order_id']
+
+    def livrer(self, ids):
+        return self.post('deliver_orders_api', {'commandes': ids})
+
+    def lignes_restaurant(self):
+        return InvoiceLine.objects.filter(facture__reservation=self.reservation, description__startswith='Restaurant')
+
+    def assertSoldeCoherent(self):
+        client = Client.objects.get(pk=self.hote.pk)
+        journal = MouvementSolde.objects.filter(client=client).aggregate(s=Sum('montant'))['s']
+        self.assertEqual(client.solde, Invoice.objects.filter(client=client).aggregate(s=Sum('montant_total'))['s'])
+        self.assertEqual(journal, client.solde)
+
+    def test_livraison_idempotente(self):
+        residents = [self.passer(f'T5-00{i}', type_commande='resident', reservation_id=self.reservation.pk) for i in (1, 2)]
+        passage = self.passer('T5-003')
+
+        data = self.livrer(residents + [passage]).json()
+
+        self.assertEqual(sorted(data['livrees']), sorted(residents + [passage]))
+        self.assertEqual(self.lignes_restaurant().count(), 4)
+        self.folio.refresh_from_db()
+        # Nuitée 25000 + 2 x 11250, TVA 18 %
+        self.assertEqual(self.folio.montant_total, Decimal('56050.00'))
+
+        # Deuxième validation de la même tournée : rien n'est refacturé
+        data = self.livrer(residents).json()
+        self.assertEqual((data['livrees'], data['ignorees']), ([], sorted(residents)))
+        self.assertEqual(self.lignes_restaurant().count(), 4)
+        self.assertEqual(Order.objects.filter(statut='livre').count(), 3)
+        self.assertSoldeCoherent()
+
+    def test_livraison_unitaire_postee_une_fois(self):
+        order = Order.objects.get(pk=self.passer('T5-010', type_commande='resident', reservation_id=self.reservation.pk))
+        order.statut = 'livre'
+        order.save()
+        order.save()
+        self.livrer([order.pk])
+
+        self.assertEqual(self.lignes_restaurant().count(), 2)
+        self.assertEqual(
+            sorted(self.lignes_restaurant().values_list('prix_unitaire', 'quantite')),
+            [(Decimal('750.00'), 3), (Decimal('4500.00'), 2)],
+        )
+        self.assertSoldeCoherent()
+
+    def test_folio_ouvert_si_facture_soldee(self):
+        order_id = self.passer('T5-020', type_commande='resident', reservation_id=self.reservation.pk)
+        Invoice.objects.filter(pk=self.folio.pk).update(statut='paye')
+
+        self.livrer([order_id])
+
+        nouveau = Invoice.objects.exclude(pk=self.folio.pk).get(reservation=self.reservation)
+        self.assertEqual(nouveau.lines.count(), 2)
+        self.assertEqual(nouveau.montant_total, Decimal('13275.00'))
+
+    def test_chambre_sans_sejour_actif(self):
+        order_id = self.passer('T5-030', type_commande='resident', reservation_id=self.reservation.pk)
+        Reservation.objects.filter(pk=self.reservation.pk).update(statut='terminee')
+
+        data = self.livrer([order_id]).json()
+
+        self.assertEqual(data['livrees'], [order_id])
+        self.assertEqual([n['id'] for n in data['non_facturees']], [order_id])
+        self.assertFalse(self.lignes_restaurant().exists())
+
+    def test_corps_invalide(self):
+        self.assertEqual(self.livrer([]).status_code, 400)
+        self.assertEqual(self.livrer(['abc']).status_code, 400)
+        self.assertEqual(self.post('deliver_orders_api', {}).status_code, 400)
@@ -9,11 +9,13 @@ from .views import (
     place_order_api,
     get_pending_orders_api,
     order_details_api,
+    kitchen_display_view,
 )
 
 urlpatterns = [
     path('', OrderListView.as_view(), name='order_list'),
     path('orders/new/', OrderCreateView.as_view(), name='order_add'),
+    path('cuisine/', kitchen_display_view, name='kitchen_display'),
     path('menu/', MenuItemListView.as_view(), name='menu_item_list'),
     path('menu/new/', MenuItemCreateView.as_view(), name='menu_item_add'),
     path('menu/<int:pk>/edit/', MenuItemUpdateView.as_view(), name='menu_item_edit'),
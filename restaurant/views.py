@@ -1,92 +1,305 @@
 # -*- coding: utf-8 -*-
 import json
+import time
+from datetime import datetime, timezone as dt_timezone
+from django.conf import settings
+from django.core.cache import cache
 from django.views.generic import ListView, CreateView, UpdateView, DeleteView
 from django.urls import reverse_lazy
-from django.http import JsonResponse
+from django.http import HttpResponse, JsonResponse
+from django.db.models import Prefetch, Max, Count, Q
+from django.views.decorators.http import condition, require_GET, require_POST
+from django.utils.dateparse import parse_datetime
 from django.views.decorators.csrf import csrf_exempt
 from django.shortcuts import get_object_or_404, render
 from django.contrib.auth.mixins import LoginRequiredMixin
-from .models import Order, OrderItem, MenuItem
-from reservations.models import Reservation
+from .models import Order, OrderItem, MenuItem, CLE_VERSION_COMMANDES
+from .kitchen import RECOUVREMENT, file_cuisine, terminer_ticket
+from .orders import enregistrer_commandes, livrer_commandes
+from .catalog import catalogue, version_catalogue
 from django.contrib.auth.decorators import login_required
 
+COMMANDES_LOT_MAX = 200
+
+
 @login_required
 @csrf_exempt
 def place_order_api(request):
-    """API endpoint to process orders from the POS interface"""
-    if request.method == 'POST':
-        try:
-            data = json.loads(request.body)
-            print(f"DEBUG: place_order_api received: {data}")
-            type_commande = data.get('type_commande')
-            items = data.get('items', [])
-            
-            if not items:
-                return JsonResponse({'success': False, 'error': 'Panier vide'})
-
-            order = Order(
-                agent=request.user,
-                type_commande=type_commande,
-                numero_table=data.get('table'),
-                mode_paiement=data.get('payment_method'),
-                statut='en_prepa'
-            )
-
-            if type_commande == 'resident':
-                res_id = data.get('reservation_id')
-                if not res_id:
-                    return JsonResponse({'success': False, 'error': 'ID Réservation manquant'})
-                reservation = get_object_or_404(Reservation, pk=res_id)
-                order.client = reservation.client
-                order.chambre = reservation.chambre
-            else:
-                order.nom_client_passage = data.get('customer_name') or "Client de passage"
-                if order.mode_paiement != 'chambre':
-                    order.paiement_effectue = True
-            
-            order.save()
-
-            for item in items:
-                plat = MenuItem.objects.get(pk=item['id'])
-                OrderItem.objects.create(
-                    commande=order,
-                    plat=plat,
-                    quantite=item['qty'],
-                    prix_unitaire=plat.prix
-                )
-            
-            print(f"DEBUG: Order {order.id} saved successfully")
-            return JsonResponse({'success': True, 'order_id': order.id})
-        except Exception as e:
-            print(f"DEBUG error in place_order_api: {str(e)}")
-            return JsonResponse({'success': False, 'error': f"Erreur serveur: {str(e)}"}, status=500)
-    
-    return JsonResponse({'success': False, 'error': 'Méthode non autorisée'}, status=405)
+    """
+    API endpoint to process orders from the POS interface.
+    Lignes validées d'abord, puis commande et lignes écrites en une transaction
+    (bulk_create) ; le total calculé par le serveur est renvoyé. Une commande
+    renvoyée avec la même cle_terminal n'est pas recréée.
+    """
+    if request.method != 'POST':
+        return JsonResponse({'success': False, 'error': 'Méthode non autorisée'}, status=405)
+
+    try:
+        data = json.loads(request.body)
+        if not isinstance(data, dict):
+            raise ValueError
+    except ValueError:
+        return JsonResponse({'success': False, 'error': 'JSON invalide'}, status=400)
+
+    try:
+        resultat, = enregistrer_commandes([data], user=request.user)
+    except Exception as e:
+        return JsonResponse({'success': False, 'error': f"Erreur serveur: {str(e)}"}, status=500)
+
+    if resultat['statut'] == 'erreur':
+        return JsonResponse({'success': False, 'error': resultat['error']}, status=400)
+    if resultat['statut'] == 'doublon':
+        total = Order.objects.values_list('montant_total', flat=True).get(pk=resultat['order_id'])
+        return JsonResponse({'success': True, 'order_id': resultat['order_id'], 'total': float(total), 'doublon': True})
+    return JsonResponse({'success': True, 'order_id': resultat['order_id'], 'total': resultat['total']})
 
 
 @login_required
+@require_POST
+def place_orders_batch_api(request):
+    """
+    Synchronisation d'un terminal POS resté hors ligne : {"commandes": [{..., "cle_terminal": "..."}, ...]}.
+    Une transaction pour tout le lot ; un résultat par commande (cree / doublon / erreur),
+    les commandes invalides n'empêchent pas l'enregistrement des autres.
+    """
+    try:
+        data = json.loads(request.body)
+        commandes = data['commandes']
+        if not isinstance(commandes, list):
+            raise TypeError
+    except (ValueError, KeyError, TypeError):
+        return JsonResponse({'success': False, 'error': 'Corps JSON invalide : {"commandes": [...]}'}, status=400)
+    if not commandes:
+        return JsonResponse({'success': False, 'error': 'Aucune commande'}, status=400)
+    if len(commandes) > COMMANDES_LOT_MAX:
+        return JsonResponse({'success': False, 'error': f'{COMMANDES_LOT_MAX} commandes maximum par lot'}, status=400)
+
+    resultats = enregistrer_commandes(commandes, user=request.user)
+    return JsonResponse({
+        'success': True,
+        'creees': sum(1 for r in resultats if r['statut'] == 'cree'),
+        'doublons': sum(1 for r in resultats if r['statut'] == 'doublon'),
+        'erreurs': sum(1 for r in resultats if r['statut'] == 'erreur'),
+        'resultats': resultats,
+    })
+
+
+@login_required
+@require_POST
+def deliver_orders_api(request):
+    """Livraison groupée (room service) : {"commandes": [id, ...]} ; les résidents sont facturés sur leur folio"""
+    try:
+        data = json.loads(request.body)
+        ids = [int(order_id) for order_id in data['commandes']]
+    except (ValueError, KeyError, TypeError):
+        return JsonResponse({'success': False, 'error': 'Corps JSON invalide : {"commandes": [id, ...]}'}, status=400)
+    if not ids:
+        return JsonResponse({'success': False, 'error': 'Aucune commande'}, status=400)
+    if len(ids) > COMMANDES_LOT_MAX:
+        return JsonResponse({'success': False, 'error': f'{COMMANDES_LOT_MAX} commandes maximum par lot'}, status=400)
+
+    livrees, non_facturees = livrer_commandes(ids)
+    return JsonResponse({
+        'success': True,
+        'livrees': livrees,
+        'ignorees': sorted(set(ids) - set(livrees)),
+        'non_facturees': [{'id': order_id, 'motif': motif} for order_id, motif in non_facturees],
+    })
+
+
+STATUTS_EN_COURS = ['en_prepa', 'livre']
+# Attente longue : plafond absolu (la durée effective vient de settings.POS_CHANGES_MAX_WAIT)
+ATTENTE_PLAFOND = 25
+# Délai conseillé au client avant de relancer quand le serveur n'a pas attendu (ancien
+# intervalle de rafraîchissement du POS)
+RELANCE = 15
+CHANGEMENTS_MAX = 50
+# Position du curseur quand aucune commande n'existe encore
+DEBUT = datetime(2000, 1, 1, tzinfo=dt_timezone.utc)
+
+
+def _commande_json(order):
+    """Résumé d'une commande pour le POS (commande chargée par Order.objects.avec_client())"""
+    return {
+        'id': order.id,
+        'statut': order.statut,
+        'total': float(order.total),
+        'date': order.date.strftime('%H:%M'),
+        'client': order.get_client_name(),
+        'agent': order.agent.username if order.agent else 'Système',
+        'modifie_le': order.modifie_le.isoformat(),
+    }
+
+
+def _etag_commandes_en_cours(request):
+    # Toute modification de commande avance modifie_le ; le nombre couvre les suppressions
+    etat = Order.objects.aggregate(
+        derniere=Max('modifie_le'),
+        en_cours=Count('id', filter=Q(statut__in=STATUTS_EN_COURS)),
+    )
+    derniere = etat['derniere'].timestamp() if etat['derniere'] else 0
+    return f"{derniere}-{etat['en_cours']}"
+
+
+def _attente_max():
+    return min(max(getattr(settings, 'POS_CHANGES_MAX_WAIT', 10), 0), ATTENTE_PLAFOND)
+
+
+def _curseur(modifie_le, pk, version):
+    return f"{modifie_le.astimezone(dt_timezone.utc):%Y%m%d%H%M%S%f}_{pk}_{version}"
+
+
+def _lire_curseur(valeur):
+    """
+    Curseur 'AAAAMMJJHHMMSSffffff_id_version' -> (datetime UTC, id, version du compteur
+    de changements ou None) ; ValueError si invalide
+    """
+    horodatage, pk, *version = valeur.split('_')
+    if len(version) > 1:
+        raise ValueError(valeur)
+    return (
+        datetime.strptime(horodatage, '%Y%m%d%H%M%S%f').replace(tzinfo=dt_timezone.utc),
+        int(pk),
+        int(version[0]) if version else None,
+    )
+
+
+@login_required
+@condition(etag_func=_etag_commandes_en_cours)
 def get_pending_orders_api(request):
     try:
-        pending_orders = Order.objects.filter(statut__in=['en_prepa', 'livre']).order_by('-date')[:10]
-        data = []
-        for order in pending_orders:
-            data.append({
-                'id': order.id,
-                'total': float(order.total),
-                'date': order.date.strftime('%H:%M'),
-                'client': order.get_client_name(),
-                'agent': order.agent.username if order.agent else 'Système'
-            })
-        return JsonResponse(data, safe=False)
+        # Une seule requête : total stocké, agent et nom du client chargés avec la commande
+        pending_orders = Order.objects.avec_client().filter(statut__in=STATUTS_EN_COURS).order_by('-date')[:10]
+        return JsonResponse([_commande_json(order) for order in pending_orders], safe=False)
     except Exception as e:
         return JsonResponse({'error': str(e)}, status=500)
 
+
+@login_required
+@require_GET
+def order_changes_api(request):
+    """
+    Attente longue des changements de commandes (création, statut, total) depuis le
+    curseur du client. La requête reste ouverte jusqu'à un changement ou jusqu'à
+    `attente` secondes (POS_CHANGES_MAX_WAIT au plus) ; sans curseur, renvoie le curseur
+    courant. Le compteur en cache (partagé entre workers) réveille l'attente aussitôt ; la
+    base est aussi relue toutes les 5 secondes au cas où le compteur aurait été évincé.
+
+    Le curseur porte la position de la dernière commande vue et la valeur du compteur.
+    Si le compteur a bougé depuis, les commandes des RECOUVREMENT secondes précédant la
+    position sont renvoyées aussi : une transaction validée après la lecture précédente
+    peut porter une date antérieure. Le client ignore celles qu'il a déjà vues (id et
+    modifie_le). `relance` : secondes à attendre avant la requête suivante si rien n'a changé.
+    """
+    commandes = Order.objects.avec_client().order_by('modifie_le', 'pk')
+    attente_max = _attente_max()
+    valeur = request.GET.get('curseur')
+    if not valeur:
+        version = cache.get(CLE_VERSION_COMMANDES) or 0
+        derniere = commandes.last()
+        return JsonResponse({
+            'success': True,
+            'curseur': (
+                _curseur(derniere.modifie_le, derniere.pk, version) if derniere
+                else _curseur(DEBUT, 0, version)
+            ),
+            'commandes': [],
+            'relance': 0,
+        })
+    try:
+        modifie_le, pk, version = _lire_curseur(valeur)
+        attente = min(max(int(request.GET.get('attente', attente_max)), 0), attente_max)
+    except ValueError:
+        return JsonResponse({'success': False, 'error': 'Curseur invalide'}, status=400)
+
+    apres = Q(modifie_le__gt=modifie_le) | Q(modifie_le=modifie_le, pk__gt=pk)
+    nouvelles = commandes.filter(apres)
+    debut = max(modifie_le, DEBUT) - RECOUVREMENT
+    recouvrement = commandes.filter(modifie_le__gt=debut).exclude(apres)
+    fin = time.monotonic() + attente
+    prochaine_lecture = 0
+    changements = []
+    while True:
+        maintenant = time.monotonic()
+        # Compteur lu avant les commandes : une validation postérieure le fera encore bouger
+        version_courante = cache.get(CLE_VERSION_COMMANDES) or 0
+        signal = version_courante != version
+        if signal or maintenant >= prochaine_lecture:
+            version = version_courante
+            changements = list(nouvelles[:CHANGEMENTS_MAX])
+            if signal:
+                changements = list(recouvrement) + changements
+            if changements:
+                break
+            prochaine_lecture = maintenant + 5
+        if maintenant >= fin:
+            break
+        time.sleep(0.5)
+
+    position = max([(modifie_le, pk)] + [(order.modifie_le, order.pk) for order in changements])
+    return JsonResponse({
+        'success': True,
+        'curseur': _curseur(*position, version),
+        'commandes': [_commande_json(order) for order in changements],
+        'relance': 0 if attente else RELANCE,
+    })
+
+@login_required
+@require_GET
+@condition(etag_func=lambda request: version_catalogue())
+def menu_catalog_api(request):
+    """Catalogue du menu (plats, catégories, services) ; 304 si le terminal a déjà la version courante"""
+    version, contenu = catalogue()
+    response = HttpResponse(contenu, content_type='application/json')
+    # Toujours revalider : le contenu ne change qu'avec la version (ETag)
+    response['Cache-Control'] = 'private, no-cache'
+    return response
+
+
+@login_required
+def kitchen_display_view(request):
+    """Écran cuisine : file des tickets par heure promise"""
+    return render(request, 'restaurant/kitchen.html')
+
+
+@login_required
+@require_GET
+def kitchen_tickets_api(request):
+    """File cuisine complète, ou seulement les tickets des commandes modifiées depuis `depuis`"""
+    depuis = None
+    if request.GET.get('depuis'):
+        depuis = parse_datetime(request.GET['depuis'])
+        if depuis is None:
+            return JsonResponse({'success': False, 'error': 'Curseur invalide'}, status=400)
+    tickets, curseur = file_cuisine(depuis)
+    return JsonResponse({
+        'success': True,
+        'complet': depuis is None,
+        'curseur': curseur.isoformat(),
+        'tickets': tickets,
+    })
+
+
+@login_required
+@require_POST
+def kitchen_bump_api(request, item_id):
+    """Marque un ticket prêt"""
+    try:
+        modifie, commande_prete = terminer_ticket(item_id)
+    except OrderItem.DoesNotExist:
+        return JsonResponse({'success': False, 'error': 'Ticket introuvable'}, status=404)
+    return JsonResponse({'success': True, 'modifie': modifie, 'commande_prete': commande_prete})
+
+
 class OrderListView(LoginRequiredMixin, ListView):
     model = Order
     template_name = 'restaurant/order_list.html'
     context_object_name = 'orders'
     ordering = ['-date']
 
+    def get_queryset(self):
+        return super().get_queryset().avec_client()
+
 class OrderCreateView(LoginRequiredMixin, CreateView):
     model = Order
     fields = ['type_commande', 'client', 'chambre', 'nom_client_passage', 'numero_table', 'statut', 'mode_paiement']
@@ -120,7 +333,12 @@ class MenuItemDeleteView(LoginRequiredMixin, DeleteView):
 @login_required
 def order_details_api(request, order_id):
     try:
-        order = get_object_or_404(Order, pk=order_id)
+        order = get_object_or_404(
+            Order.objects.avec_client().prefetch_related(
+                Prefetch('items', queryset=OrderItem.objects.select_related('plat').order_by('pk'))
+            ),
+            pk=order_id,
+        )
         items_list = []
         for item in order.items.all():
             items_list.append({
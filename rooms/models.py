@@ -27,5 +27,21 @@ class Room(models.Model):
     statut = models.CharField(max_length=20, choices=STATUS_CHOICES, default='disponible')
     cleaning_status = models.CharField(max_length=20, choices=CLEANING_STATUS_CHOICES, default='propre')
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Mémoriser l'état chargé pour détecter les changements de statut à la sauvegarde
+        instance._etat_initial = (instance.__dict__.get('statut'), instance.__dict__.get('cleaning_status'))
+        return instance
+
+    @property
+    def etat_modifie(self):
+        """Vrai si le statut ou l'état de nettoyage diffère de la valeur chargée"""
+        return getattr(self, '_etat_initial', None) != (self.statut, self.cleaning_status)
+
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        self._etat_initial = (self.statut, self.cleaning_status)
+
     def __str__(self):
         return f"Chambre {self.numero}"
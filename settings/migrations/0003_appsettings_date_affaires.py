@@ -0,0 +1,18 @@
+# Generated by Django 4.2.27 on 2026-10-18 16:32
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('settings', '0002_alter_permission_module'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='appsettings',
+            name='date_affaires',
+            field=models.DateField(blank=True, null=True, verbose_name="Date d'affaires"),
+        ),
+    ]
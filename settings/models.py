@@ -65,6 +65,9 @@ class AppSettings(models.Model):
     primary_color = models.CharField(max_length=7, default="#3498db")  # Hex color
     sidebar_color = models.CharField(max_length=7, default="#2c3e50")
     
+    # Date d'affaires courante, avancée par l'audit de nuit (night_audit)
+    date_affaires = models.DateField(null=True, blank=True, verbose_name="Date d'affaires")
+    
     class Meta:
         verbose_name = "Paramètres Application"
         verbose_name_plural = "Paramètres Application"